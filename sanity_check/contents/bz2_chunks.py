@@ -0,0 +1,297 @@
+"""Parallel reading of large bz2-compressed JSON-line files.
+
+A bz2 stream is a sequence of independently compressed blocks, each
+starting with a 48-bit magic number (``0x314159265359``) and ending where the
+next block or the end-of-stream marker (``0x177245385090``) begins. Blocks
+are not byte-aligned, but a block can be cut out of a file and wrapped into a
+standalone single-block stream that :mod:`bz2` decompresses.
+
+A large file is thus split into byte ranges (chunks) that are read in
+parallel: a chunk decompresses the blocks *starting* within its range, and
+owns the lines starting within these blocks:
+
+- a chunk skips the text up to its first newline only if the block just
+  before its first block does not end with a newline (that text then
+  belongs to the line started by the previous chunk);
+- a chunk whose blocks do not end with a newline completes its last line
+  by decompressing as many of the following blocks as needed.
+
+Files smaller than the chunk size (or not compressed with bz2) are read
+serially as a whole, several of them per partition.
+"""
+
+import bz2
+from itertools import chain
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import fsspec
+from dask import bag as db
+
+BLOCK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+MAGIC_BITS = 48
+
+# bz2 headers always declare the maximum block size, which is large enough
+# for blocks of files compressed at any level
+STREAM_HEADER = b"BZh9"
+
+# upper bound of the size of a compressed block (900k of input at level 9,
+# expanded by at most ~1% when incompressible)
+MAX_BLOCK_BYTES = 1024 ** 2
+
+READ_SIZE = 1024 ** 2
+DEFAULT_CHUNK_SIZE = 32 * 1024 ** 2
+
+# a chunk: path, start offset, end offset (`None` means the whole file)
+Chunk = Tuple[str, int, Optional[int]]
+
+
+def _magic_patterns(magic: int) -> List[tuple]:
+    """Precompute the byte patterns of `magic` at each of the 8 bit shifts."""
+    patterns = []
+    for shift in range(8):
+        n_bytes = (shift + MAGIC_BITS + 7) // 8
+        trailing = n_bytes * 8 - MAGIC_BITS - shift
+        window = (magic << trailing).to_bytes(n_bytes, "big")
+        lead = 1 if shift else 0
+        fixed = window[lead : n_bytes - (1 if trailing else 0)]
+        first_mask = 0xFF >> shift
+        last_mask = (0xFF << trailing) & 0xFF
+        patterns.append((shift, n_bytes, lead, fixed, window, first_mask, last_mask))
+    return patterns
+
+
+_PATTERNS = {BLOCK_MAGIC: _magic_patterns(BLOCK_MAGIC), EOS_MAGIC: _magic_patterns(EOS_MAGIC)}
+
+
+def find_magic(data: bytes, magic: int, from_bit: int = 0, to_bit: Optional[int] = None) -> int:
+    """Find the first bit position >= `from_bit` where `magic` occurs in `data`.
+
+    :param bytes data: Compressed data.
+    :param int magic: `BLOCK_MAGIC` or `EOS_MAGIC`.
+    :param int from_bit: Bit position to start searching from.
+    :param int to_bit: Last bit position to consider (optional).
+    :return: The bit position of the magic number, or -1 if not found.
+    :rtype: int
+
+    """
+    found = -1 if to_bit is None else to_bit + 1
+    for shift, n_bytes, lead, fixed, window, first_mask, last_mask in _PATTERNS[magic]:
+        # matches past the best one found so far are irrelevant
+        end = len(data) if found < 0 else min(len(data), found // 8 + n_bytes)
+        index = data.find(fixed, max(0, from_bit // 8) + lead, end)
+        while index >= 0:
+            start = index - lead
+            position = start * 8 + shift
+            if 0 <= found <= position:
+                break
+            if (
+                position >= from_bit
+                and start + n_bytes <= len(data)
+                and data[start] & first_mask == window[0] & first_mask
+                and data[start + n_bytes - 1] & last_mask == window[-1] & last_mask
+            ):
+                found = position
+                break
+            index = data.find(fixed, index + 1, end)
+    return -1 if to_bit is not None and found > to_bit else found
+
+
+def _next_boundary(data: bytes, from_bit: int, to_bit: int) -> int:
+    """Find where the block containing `from_bit` ends (next block or end of stream)."""
+    block = find_magic(data, BLOCK_MAGIC, from_bit, to_bit)
+    eos = find_magic(data, EOS_MAGIC, from_bit, block if block >= 0 else to_bit)
+    return eos if eos >= 0 else block
+
+
+def block_stream(data: bytes, start_bit: int, end_bit: int) -> bytes:
+    """Wrap the block found between two bit positions into a standalone bz2 stream."""
+    n_bits = end_bit - start_bit
+    segment = data[start_bit // 8 : (end_bit + 7) // 8]
+    bits = int.from_bytes(segment, "big") >> (len(segment) * 8 - (end_bit - start_bit // 8 * 8))
+    bits &= (1 << n_bits) - 1
+
+    # the CRC of a single-block stream is the CRC of its block
+    block_crc = (bits >> (n_bits - MAGIC_BITS - 32)) & 0xFFFFFFFF
+    bits = (((bits << MAGIC_BITS) | EOS_MAGIC) << 32) | block_crc
+    n_bits += MAGIC_BITS + 32
+
+    padding = -n_bits % 8
+    return STREAM_HEADER + (bits << padding).to_bytes((n_bits + padding) // 8, "big")
+
+
+def iter_blocks(fileobj, start: int = 0, read_size: int = READ_SIZE) -> Iterator[Tuple[int, bytes]]:
+    """Decompress one by one the bz2 blocks starting at or after byte `start`.
+
+    Candidate boundaries that turn out not to be one (the magic numbers may
+    occur by chance in compressed data) are skipped.
+
+    :param fileobj: Binary file object (seekable).
+    :param int start: Byte offset to start from.
+    :param int read_size: Number of bytes read at once.
+    :return: Pairs of (bit offset of the block in the file, decompressed data).
+    :rtype: Iterator[Tuple[int, bytes]]
+
+    """
+    fileobj.seek(start)
+    buf, offset, eof = b"", start, False
+    scan_from = 0
+
+    def read_more():
+        nonlocal buf, eof
+        data = fileobj.read(read_size)
+        eof = not data
+        buf += data
+
+    while True:
+        # blocks follow each other: look for the next one at the end of the previous one first
+        block_start = find_magic(buf, BLOCK_MAGIC, scan_from, scan_from)
+        if block_start < 0:
+            block_start = find_magic(buf, BLOCK_MAGIC, scan_from)
+        if block_start < 0:
+            if eof:
+                return
+            scan_from = max(0, len(buf) * 8 - 64)
+            read_more()
+            continue
+
+        # a block is at most MAX_BLOCK_BYTES long, otherwise its start is not one
+        limit = block_start + 8 * MAX_BLOCK_BYTES
+        block, search_from = None, block_start + MAGIC_BITS
+        while block is None:
+            block_end = _next_boundary(buf, search_from, limit)
+            if block_end < 0:
+                if eof or len(buf) * 8 > limit + 64:
+                    break
+                read_more()
+                continue
+            try:
+                block = bz2.decompress(block_stream(buf, block_start, block_end))
+            except (OSError, ValueError):
+                search_from = block_end + 1
+
+        if block is None:
+            scan_from = block_start + 1
+            continue
+
+        yield offset * 8 + block_start, block
+
+        cut = block_end // 8
+        buf, offset = buf[cut:], offset + cut
+        scan_from = block_end - cut * 8
+
+
+def _split_lines(data: bytes) -> List[str]:
+    lines = data.split(b"\n")
+    if lines and not lines[-1]:
+        lines.pop()
+    return [line.decode("utf-8") for line in lines]
+
+
+def read_chunk(path: str, start: int = 0, end: Optional[int] = None, storage_options: dict = None) -> List[str]:
+    """Read the lines of a chunk of a (bz2-compressed) text file.
+
+    :param str path: Path of the file (local or s3).
+    :param int start: Start byte offset of the chunk.
+    :param int end: End byte offset of the chunk (`None` to read the whole file).
+    :param dict storage_options: fsspec storage options.
+    :return: The lines starting within the chunk (without line terminators).
+    :rtype: List[str]
+
+    """
+    storage_options = storage_options or {}
+
+    if end is None:
+        with fsspec.open(path, "rb", compression="infer", **storage_options) as infile:
+            return _split_lines(infile.read())
+
+    with fsspec.open(path, "rb", **storage_options) as infile:
+        # the block before the chunk starts at most MAX_BLOCK_BYTES before it
+        blocks = iter_blocks(infile, max(0, start - MAX_BLOCK_BYTES))
+
+        previous, owned = None, []
+        for position, block in blocks:
+            if position < start * 8:
+                previous = block
+                continue
+            if position >= end * 8:
+                owned_data, next_block = b"".join(owned), block
+                break
+            owned.append(block)
+        else:
+            owned_data, next_block = b"".join(owned), None
+
+        # the first line continues the last line of the previous block, unless it ended with a newline
+        if previous is not None and not previous.endswith(b"\n"):
+            newline = owned_data.find(b"\n")
+            if newline < 0:
+                return []
+            owned_data = owned_data[newline + 1 :]
+
+        # complete the last line with the following blocks
+        tail = []
+        if next_block is not None and not owned_data.endswith(b"\n"):
+            for block in chain([next_block], (block for _, block in blocks)):
+                newline = block.find(b"\n")
+                if newline >= 0:
+                    tail.append(block[: newline + 1])
+                    break
+                tail.append(block)
+
+    return _split_lines(owned_data + b"".join(tail))
+
+
+def plan_chunks(files: Iterable[Tuple[str, int]], chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[List[Chunk]]:
+    """Split files into chunks of about `chunk_size` bytes and group them into partitions.
+
+    Large bz2 files are split into several chunks; smaller files are read
+    as a whole and packed together until a partition holds about
+    `chunk_size` bytes.
+
+    :param Iterable[Tuple[str, int]] files: Paths of the files and their sizes.
+    :param int chunk_size: Target number of compressed bytes per partition.
+    :return: One list of chunks per partition.
+    :rtype: List[List[Chunk]]
+
+    """
+    partitions, current, current_size = [], [], 0
+    for path, size in files:
+        if size > chunk_size and path.endswith(".bz2"):
+            n_chunks = -(-size // chunk_size)
+            for k in range(n_chunks):
+                partitions.append([(path, k * size // n_chunks, (k + 1) * size // n_chunks)])
+            continue
+
+        current.append((path, 0, None))
+        current_size += size
+        if current_size >= chunk_size:
+            partitions.append(current)
+            current, current_size = [], 0
+
+    if current:
+        partitions.append(current)
+    return partitions
+
+
+def _read_chunks(chunks: List[Chunk], storage_options: dict = None) -> List[str]:
+    return [line for chunk in chunks for line in read_chunk(*chunk, storage_options=storage_options)]
+
+
+def read_lines(
+    files: Iterable[Tuple[str, int]], chunk_size: int = DEFAULT_CHUNK_SIZE, storage_options: dict = None
+) -> db.Bag:
+    """Create a bag with the lines of (bz2-compressed) text files, reading large files in parallel.
+
+    :param Iterable[Tuple[str, int]] files: Paths of the files and their sizes.
+    :param int chunk_size: Target number of compressed bytes per partition.
+    :param dict storage_options: fsspec storage options.
+    :return: A bag of lines (without line terminators).
+    :rtype: db.Bag
+
+    """
+    partitions = plan_chunks(files, chunk_size)
+    return (
+        db.from_sequence(partitions, npartitions=max(len(partitions), 1))
+        .map(_read_chunks, storage_options=storage_options)
+        .flatten()
+    )
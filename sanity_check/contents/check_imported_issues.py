@@ -1,7 +1,7 @@
 """Command-line script to perform sanity check comparing the number of local issues against s3.
 
 Usage:
-    check_imported_issues.py --canonical-bucket=<cb> --local-dirs=<list> [--output-dir=<od> --thres=<float> --workers=<int>]
+    check_imported_issues.py --canonical-bucket=<cb> --local-dirs=<list> [--output-dir=<od> --thres=<float> --workers=<int> --manifest-dir=<md> --manifest-max-age=<secs>]
 
 Options:
 
@@ -10,6 +10,8 @@ Options:
 --output-dir=<od>           Directory where the results are stored.
 --thres=<float>             Threshold for indicating mismatches [default: 1.0].
 --workers=<int>             Number of parallel Dask workers [default: 8].
+--manifest-dir=<md>         Directory of the local manifest of s3 listings (if omitted, buckets are listed from scratch).
+--manifest-max-age=<secs>   Seconds during which cached listings are reused without any request: files added, removed or rewritten meanwhile are missed (default: 3600; 0 lists each prefix again once per run).
 
 Example:
 
@@ -35,6 +37,7 @@ from dask import bag as db
 from dask import dataframe as dd
 from dask import array as da
 
+from sanity_check.contents.manifest import enable_manifest_cache
 from sanity_check.contents.s3_data import fetch_issue_ids
 
 from impresso_commons.path.path_fs import detect_issues
@@ -262,6 +265,9 @@ def main():
     output_dir = arguments["--output-dir"]
     workers = int(arguments["--workers"]) if arguments["--workers"] else 8
 
+    if arguments["--manifest-dir"]:
+        max_age = arguments["--manifest-max-age"]
+        enable_manifest_cache(arguments["--manifest-dir"], float(max_age) if max_age else None)
 
     logging.basicConfig(
         level=logging.INFO,
@@ -0,0 +1,202 @@
+"""Checkpointed runs of long commands, sharded by newspaper.
+
+Long commands (e.g. :func:`sanity_check.contents.stats.compute_rebuilt_stats`
+or :func:`sanity_check.contents.sync.sync_rebuilt`) process each newspaper as
+an independent shard, whose partial result is written to a checkpoint
+directory as soon as it is computed::
+
+    <checkpoint_dir>/<name>/config.json
+    <checkpoint_dir>/<name>/<shard>.pkl
+
+Shards that are dask computations (see :func:`run_dask_shards`) are all
+submitted to the cluster at once, so that they share it like the tasks of a
+single computation. Partial results are only combined once all shards are done. If a run fails
+(e.g. a worker dies late in the run), it can be resumed: completed shards are
+loaded from the checkpoint directory instead of being computed again, as long
+as they were written with the same configuration.
+"""
+
+import json
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import dask
+
+CONFIG_FILENAME = "config.json"
+
+# shards computed by threads of the client (see `run_shards`)
+DEFAULT_MAX_PARALLEL_SHARDS = 4
+
+
+class Checkpoint:
+    """Partial results of the shards of a command, stored in a directory."""
+
+    def __init__(self, checkpoint_dir: str, name: str, config: dict, resume: bool = False):
+        self.path = os.path.join(checkpoint_dir, name)
+        self.config = config
+        self.resume = resume
+        os.makedirs(self.path, exist_ok=True)
+
+        config_path = os.path.join(self.path, CONFIG_FILENAME)
+        if resume and os.path.exists(config_path):
+            with open(config_path, encoding="utf-8") as infile:
+                stored_config = json.load(infile)
+            if stored_config != config:
+                raise ValueError(
+                    f"Cannot resume from {self.path}: checkpoints were written with {stored_config}, not {config}"
+                )
+        self._write(CONFIG_FILENAME, json.dumps(config).encode("utf-8"))
+
+    def __repr__(self):
+        return f"<Checkpoint {self.path} resume={self.resume}>"
+
+    def _write(self, filename: str, data: bytes):
+        # written atomically, so that a shard is either complete or missing
+        path = os.path.join(self.path, filename)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as outfile:
+            outfile.write(data)
+        os.replace(tmp_path, path)
+
+    def _shard_path(self, shard: str) -> str:
+        return os.path.join(self.path, f"{shard}.pkl")
+
+    def completed(self) -> Set[str]:
+        """Return the shards whose result can be reused (none unless resuming)."""
+        if not self.resume:
+            return set()
+        return {
+            filename[: -len(".pkl")]
+            for filename in os.listdir(self.path)
+            if filename.endswith(".pkl")
+        }
+
+    def save(self, shard: str, result):
+        self._write(f"{shard}.pkl", pickle.dumps(result))
+
+    def load(self, shard: str):
+        with open(self._shard_path(shard), "rb") as infile:
+            return pickle.load(infile)
+
+
+def _load_completed(shards: List[str], checkpoint: Optional[Checkpoint]):
+    completed = checkpoint.completed() if checkpoint is not None else set()
+    results = {shard: checkpoint.load(shard) for shard in shards if shard in completed}
+    to_compute = [shard for shard in shards if shard not in completed]
+    print(f"Computing {len(to_compute)} shards, {len(results)} loaded from checkpoints")
+    return results, to_compute
+
+
+def _default_client():
+    # imported here, as the threaded scheduler does not need distributed
+    try:
+        from distributed import default_client
+    except ImportError:
+        return None
+    try:
+        return default_client()
+    except ValueError:
+        # no client was created (e.g. `--executor=threads`)
+        return None
+
+
+def run_shards(
+    shards: Iterable[str],
+    compute_shard: Callable[[str], object],
+    checkpoint: Optional[Checkpoint] = None,
+    max_parallel: int = DEFAULT_MAX_PARALLEL_SHARDS,
+) -> Dict[str, object]:
+    """Compute the result of each shard, or load it from the checkpoint.
+
+    Shards are computed concurrently (each of them being a separate dask
+    computation), and their result is checkpointed as soon as it is
+    available.
+
+    :param Iterable[str] shards: Shard names (e.g. newspaper IDs).
+    :param Callable compute_shard: Function computing the result of a shard.
+    :param Checkpoint checkpoint: Where results are saved to / loaded from
+        (optional).
+    :param int max_parallel: Maximum number of shards computed at once.
+    :return: The result of each shard.
+    :rtype: Dict[str, object]
+
+    """
+    shards = list(shards)
+    results, to_compute = _load_completed(shards, checkpoint)
+
+    def _compute_and_save(shard):
+        # saved by the shard's own thread: if another shard fails, the ones
+        # still running are checkpointed all the same
+        result = compute_shard(shard)
+        if checkpoint is not None:
+            checkpoint.save(shard, result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+        futures = {executor.submit(_compute_and_save, shard): shard for shard in to_compute}
+        for future in as_completed(futures):
+            shard = futures[future]
+            results[shard] = future.result()
+            print(f"Shard {shard} done ({len(results)}/{len(shards)})")
+
+    return {shard: results[shard] for shard in shards}
+
+
+def run_dask_shards(
+    shards: Iterable[str],
+    shard_graph: Callable[[str], object],
+    checkpoint: Optional[Checkpoint] = None,
+    max_parallel: int = DEFAULT_MAX_PARALLEL_SHARDS,
+) -> Dict[str, object]:
+    """Compute the result of each shard from its (lazy) dask collection, or load it from the checkpoint.
+
+    With a distributed client, the collections of all shards are submitted
+    at once as futures, so that the whole cluster works on them, and each
+    result is checkpointed as soon as its future completes. Otherwise (e.g.
+    with the threaded scheduler), shards are computed by :func:`run_shards`.
+
+    :param Iterable[str] shards: Shard names (e.g. newspaper IDs).
+    :param Callable shard_graph: Function returning the dask collection
+        (e.g. a bag or a delayed object) of a shard, without computing it.
+    :param Checkpoint checkpoint: Where results are saved to / loaded from
+        (optional).
+    :param int max_parallel: Maximum number of shards computed at once
+        without a distributed client.
+    :return: The result of each shard.
+    :rtype: Dict[str, object]
+
+    """
+    client = _default_client()
+    if client is None:
+        return run_shards(shards, lambda shard: dask.compute(shard_graph(shard))[0], checkpoint, max_parallel)
+
+    # imported here, as the threaded scheduler does not need distributed
+    from distributed import as_completed as futures_completed
+
+    shards = list(shards)
+    results, to_compute = _load_completed(shards, checkpoint)
+    futures = client.compute([shard_graph(shard) for shard in to_compute])
+    shard_of = {id(future): shard for future, shard in zip(futures, to_compute)}
+
+    # if a shard fails, the other ones are still checkpointed before raising
+    error = None
+    for future in futures_completed(futures):
+        shard = shard_of[id(future)]
+        try:
+            results[shard] = future.result()
+        except Exception as e:
+            error = error or e
+            print(f"Shard {shard} failed: {e}")
+            continue
+        finally:
+            # the result is no longer kept by the cluster
+            future.release()
+        if checkpoint is not None:
+            checkpoint.save(shard, results[shard])
+        print(f"Shard {shard} done ({len(results)}/{len(shards)})")
+    if error is not None:
+        raise error
+
+    return {shard: results[shard] for shard in shards}
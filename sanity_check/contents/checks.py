@@ -1,11 +1,28 @@
 """Command-line script to perform sanity checks on canonical/rebuilt data in s3.
 
 Usage:
-    checks.py --canonical-bucket=<cb> --rebuilt-bucket=<rb> --output-dir=<od> [--k8-memory=<mem> --k8-workers=<wkrs>]
+    checks.py --canonical-bucket=<cb> --rebuilt-bucket=<rb> --output-dir=<od> [--executor=<ex> --k8-memory=<mem> --k8-workers=<wkrs> --manifest-dir=<md> --manifest-max-age=<secs> --index-dir=<idx> --index-version=<v> --newspapers=<nps> --years=<yrs> --two-stage --approximate --sketch-dir=<sd> --reuse-sketches --sketch-capacity=<n> --state-dir=<std> --full --checks=<names>]
 
 Options:
 
+--executor=<ex>  Dask executor: k8 (cluster on Kubernetes), local (worker processes sized from the local CPUs and memory) or threads [default: k8]
+--k8-memory=<mem>  Memory of each worker of the k8 executor (default: planned from the size of the input files)
+--k8-workers=<wkrs>  Maximum number of workers of the k8 executor (default: planned from the size of the input files)
 --canonical-bucket=<cb>  S3 bucket where canonical JSON data will be read from
+--manifest-dir=<md>  Directory of the local manifest of s3 listings (if omitted, buckets are listed from scratch)
+--manifest-max-age=<secs>  Seconds during which cached listings are reused without any request: files added, removed or rewritten meanwhile are missed (default: 3600; 0 lists each prefix again once per run)
+--index-dir=<idx>  Read canonical data from the Parquet index in this directory (see index.py) instead of bz2 files (ci_types and ci_page_references, which need data the index lacks, are then not run)
+--index-version=<v>  Version of the index to read, even if the bucket changed since it was built (default: the latest version, which must match the bucket)
+--newspapers=<nps>  Newspaper IDs or glob patterns to restrict the run to (e.g. "GDL JDG BL*")
+--years=<yrs>  Years or year ranges to restrict the run to (e.g. "1850-1860 1900")
+--two-stage  Check duplicated IDs with Bloom filter/HyperLogLog sketches first, then verify only candidates
+--approximate  With --two-stage, only report the approximate number of duplicates per newspaper
+--sketch-dir=<sd>  With --two-stage, directory where the sketches are saved
+--reuse-sketches  With --two-stage, load the sketches found in --sketch-dir instead of recomputing them, if they were built from the same data
+--sketch-capacity=<n>  With --two-stage, number of IDs each sketch is sized for, at about 2.4 bytes per ID (default: estimated from the size of the issue files)
+--checks=<names>  Names of the checks to run, space or comma separated (default: all registered checks, except empty_pages which scans all page files)
+--state-dir=<std>  Directory of the per-newspaper state: only newspapers whose files changed are re-checked
+--full  With --state-dir, re-check all newspapers regardless of their state
 
 Example:
 
@@ -13,168 +30,277 @@ Example:
     --rebuilt-bucket='s3://passim-rebuilt' --output-dir=./ --k8-memory="1G" --k8-workers=25
 """  # noqa: E501
 
-from collections import Counter
-from dask_k8 import DaskCluster
 from docopt import docopt
-from typing import Dict
-
-from impresso_commons.utils.kube import (
-    make_scheduler_configuration,
-    make_worker_configuration,
+from typing import Dict, List
+
+from sanity_check.contents.cluster import StageEstimate, dask_executor, plan_resources
+from sanity_check.contents.helpers import parse_list, parse_newspapers, parse_years
+from sanity_check.contents.index import issues_by_newspaper, objects_fingerprint, pin_index_version, resolve_index
+from sanity_check.contents.manifest import enable_manifest_cache
+from sanity_check.contents.s3_data import (
+    fetch_issue_lines,
+    fetch_page_lines,
+    files_by_newspaper_year,
+    list_newspaper_file_sizes,
+    list_newspaper_objects,
+    list_pages,
+    split_bucket_name,
+)
+from sanity_check.contents.scan import (
+    create_checks,
+    scan_issues,
+    scan_pipeline,
+    sketch_report,
+    ScanReport,
+    SketchedDuplicateIDs,
 )
-from sanity_check.contents.s3_data import fetch_issues, fetch_page_ids, fetch_issue_ids
+from sanity_check.contents.sketches import DuplicateSketch
+from sanity_check.contents.state import CheckState, newspaper_etags, split_by_newspaper
 import pandas as pd
-from dask import bag
+import hashlib
+import json
 import os
 
 OUTPUT_SEPARATOR = "\n#####"
 
 
-def check_duplicated_content_item_IDs(issue_bag: bag.Bag) -> pd.DataFrame:
-    """Short summary.
-
-    ..note::
-        This is a global check.
-
-    :param bag.Bag issue_bag: Description of parameter `issue_bag`.
-    :return: Description of returned object.
-    :rtype: pd.DataFrame
-
-    """
-    duplicates = (
-        issue_bag.map(lambda issue_json: [ci["m"]["id"] for ci in issue_json["i"]])
-        .flatten()
-        .frequencies()
-        .filter(lambda i: i[1] > 1)
-        .map(lambda i: {"ci_id": i[0], "freq": i[1], "newspaper_id": i[0].split("-")[0]})
-        .compute()
-    )
-
-    if duplicates:
-        duplicates_df = pd.DataFrame(duplicates).set_index("ci_id")
+def _write_results(results: Dict[str, pd.DataFrame], output_dir: str):
+    for fname, result_df in results.items():
+        if output_dir and os.path.exists(output_dir):
+            pickle_path = os.path.join(output_dir, f"{fname}.pkl")
+            csv_path = os.path.join(output_dir, f"{fname}.csv")
+
+            result_df.to_pickle(pickle_path)
+            print(f"Written pickle file to {pickle_path}")
+
+            result_df.to_csv(csv_path)
+            print(f"Written CSV output to {csv_path}")
+        elif os.path.exists(output_dir) is False:
+            print(f"No outputs written as folder {output_dir} does not exist.")
+
+
+def _sketch_fingerprint(canonical_bucket_name, index_dir, newspapers, years, issue_objects: List[dict]) -> str:
+    """Fingerprint the issues that are sketched: the keys and ETags of their files, or the version of the index read."""
+    if index_dir:
+        version = os.path.basename(resolve_index(index_dir, canonical_bucket_name))
+        return hashlib.sha1(json.dumps([version, newspapers, years]).encode("utf-8")).hexdigest()[:16]
+    return objects_fingerprint(issue_objects)
+
+
+def _scan_checks(
+    canonical_bucket_name,
+    index_dir,
+    newspapers,
+    years,
+    check_names,
+    two_stage,
+    sketch_dir,
+    reuse_sketches,
+    approximate,
+    sketch_capacity,
+) -> ScanReport:
+    """Run the selected checks on the issues (and pages) of the selected newspapers with fused scans."""
+    listed_page_files = None
+    partition_contexts = None
+    issue_objects = None
+    whole_newspapers = bool(index_dir)
+    if index_dir:
+        # each partition is a newspaper, whose singletons are dropped before the reduction
+        canonical_issue_lines = issues_by_newspaper(index_dir, canonical_bucket_name, newspapers, years)
     else:
-        # there are no duplicates
-        duplicates_df = pd.DataFrame(columns=["ci_id", "freq", "newspaper_id"])
-
-    print(
-        (
-            f"Found {duplicates_df.shape[0]} duplicated "
-            "content item IDs, belonging to "
-            f"{duplicates_df.newspaper_id.unique().size} journals"
-            f"({', '.join(list(duplicates_df.newspaper_id.unique()))})"
-        )
-    )
-    return duplicates_df
-
-
-def check_duplicated_issues_IDs(issue_bag: bag.Bag) -> pd.DataFrame:
-    """Check that newspaper issue IDs are unique within the corpus."""
-
-    duplicate_issue_ids = (
-        issue_bag.pluck("id")
-        .frequencies()
-        .filter(lambda i: i[1] > 1)
-        .map(
-            lambda i: {
-                "issue_id": i[0],
-                "freq": i[1],
-                "newspaper_id": i[0].split("-")[0],
-            }
-        )
-        .compute()
-    )
-    print(f"{len(duplicate_issue_ids)} duplicated IDs were found")
-    return pd.DataFrame(duplicate_issue_ids).set_index("issue_id")
-
-
-def check_inconsistent_page_ids(canonical_bucket_name: str) -> pd.DataFrame:
-    """Check whether there are mismatches between page IDs.
-
-    Page IDs are found in two places in our data:
-    1. field `pp` of issue JSON
-    2. field `id` of page JSON
-
-    As there can be mismatches between these two sets of identifiers,
-    we need to verify that all page IDs in #1 are contained within #2.
-    """
-
-    page_ids_from_issues = fetch_page_ids(canonical_bucket_name, source="issues")
-    page_ids_from_pages = fetch_page_ids(canonical_bucket_name, source="pages")
-
-    df_page_ids_from_issues = (
-        page_ids_from_issues.map(lambda id: {"id": id, "from_issues": True}).to_dataframe().set_index("id").persist()
+        # issue and page files are listed once: each newspaper-year is a partition, which gets its page files
+        issue_objects = list_newspaper_objects(canonical_bucket_name, "{np}/issues/", newspapers, years)
+        print(f"{canonical_bucket_name} contains {len(issue_objects)} .bz2 files with issues")
+        bucket = split_bucket_name(canonical_bucket_name)
+        issue_files = files_by_newspaper_year(f"s3://{bucket}/{obj['key']}" for obj in issue_objects)
+        page_files = files_by_newspaper_year(list_pages(canonical_bucket_name, newspapers, years))
+        keys = sorted(set(issue_files) | set(page_files))
+        canonical_issue_lines = fetch_issue_lines(file_groups=[issue_files.get(key, []) for key in keys])
+        listed_page_files = [path for key in sorted(page_files) for path in page_files[key]]
+        # (an empty selection is a single empty partition, without context)
+        partition_contexts = [
+            {"newspaper": newspaper, "year": year, "page_files": page_files.get((newspaper, year), [])}
+            for newspaper, year in keys
+        ] or None
+
+    checks = create_checks(
+        check_names,
+        canonical_bucket_name=canonical_bucket_name,
+        index_dir=index_dir,
+        newspapers=newspapers,
+        years=years,
     )
 
-    df_page_ids_from_pages = (
-        page_ids_from_pages.map(lambda id: {"id": id, "from_pages": True}).to_dataframe().set_index("id").persist()
-    )
-
-    df_pages = df_page_ids_from_issues.join(df_page_ids_from_pages, how="outer").compute()
-
-    df_pages["newspaper_id"] = df_pages.index.map(lambda z: z.split("-")[0])
-    return df_pages[~(df_pages.from_pages == df_pages.from_issues)]
+    # in two-stage mode, checks of duplicated IDs are replaced by sketches
+    # of the IDs, and only verify the candidates in a second scan
+    sketches = {}
+    sketch_checks = []
+    exact_checks = [check for check in checks if two_stage and check.sketch_kind]
+    if exact_checks:
+        if issue_objects is None:
+            # sketches are sized from the issue files the index was built from
+            issue_objects = list_newspaper_objects(canonical_bucket_name, "{np}/issues/", newspapers, years)
+        fingerprint = _sketch_fingerprint(canonical_bucket_name, index_dir, newspapers, years, issue_objects)
+        input_bytes = sum(obj["size"] for obj in issue_objects)
+
+        checks = [check for check in checks if check not in exact_checks]
+        for check in exact_checks:
+            sketch_path = os.path.join(sketch_dir, f"{check.sketch_kind}_ids.npz") if sketch_dir else None
+            if reuse_sketches and sketch_path and os.path.exists(sketch_path):
+                try:
+                    sketches[check.sketch_kind] = DuplicateSketch.load(sketch_path, fingerprint)
+                    print(f"Reusing sketch {sketch_path}")
+                    continue
+                except ValueError as e:
+                    print(f"Not reusing sketch: {e}")
+            if sketch_capacity:
+                sketch_checks.append(SketchedDuplicateIDs(check.sketch_kind, sketch_capacity))
+            else:
+                sketch_checks.append(SketchedDuplicateIDs.for_input_size(check.sketch_kind, input_bytes))
+        checks = sketch_checks + checks
 
-
-def run_checks_canonical(canonical_bucket_name, output_dir=None):
-    canonical_issues_bag = fetch_issues(canonical_bucket_name, compute=False).filter(lambda i: len(i) > 0)
-
-    # 1) verify that there are not duplicated issue IDs
     print(OUTPUT_SEPARATOR)
-    print('Verifying existence of duplicated issue IDs...')
-    duplicated_issues_df = check_duplicated_issues_IDs(canonical_issues_bag)
-    print('Done')
-    if output_dir and os.path.exists(output_dir):
-        fname = "duplicate_issue_ids"
-        pickle_path = os.path.join(output_dir, f"{fname}.pkl")
-        csv_path = os.path.join(output_dir, f"{fname}.csv")
-
-        duplicated_issues_df.to_pickle(pickle_path)
-        print(f"Written pickle file to {pickle_path}")
-
-        duplicated_issues_df.to_csv(csv_path)
-        print(f"Written CSV output to {csv_path}")
-    elif os.path.exists(output_dir) is False:
-        print(f"No outputs written as folder {output_dir} does not exist.")
+    print(f"Running checks {', '.join(check.name for check in checks)} in fused scans...")
+    report = scan_pipeline(
+        checks,
+        canonical_issue_lines,
+        lambda: fetch_page_lines(canonical_bucket_name, newspapers, years, page_files=listed_page_files),
+        partition_contexts=partition_contexts,
+        whole_newspapers=whole_newspapers,
+    )
+    print(report.summary())
+
+    if exact_checks:
+        for check in sketch_checks:
+            sketches[check.kind] = check.sketch
+            if sketch_dir:
+                os.makedirs(sketch_dir, exist_ok=True)
+                check.sketch.save(os.path.join(sketch_dir, f"{check.kind}_ids.npz"), fingerprint)
+        for check in exact_checks:
+            report.results.setdefault(f"{check.name}_approx", sketch_report(sketches[check.sketch_kind]))
+
+        if not approximate:
+            print("Verifying candidate duplicated IDs...")
+            verification = scan_issues(
+                canonical_issue_lines,
+                [type(check)(candidates=sketches[check.sketch_kind]) for check in exact_checks],
+                partition_contexts=partition_contexts,
+                whole_newspapers=whole_newspapers,
+            )
+            print(verification.summary())
+            report.update(verification)
+    return report
+
+
+def run_checks_canonical(
+    canonical_bucket_name,
+    output_dir=None,
+    index_dir=None,
+    newspapers=None,
+    years=None,
+    two_stage=False,
+    sketch_dir=None,
+    reuse_sketches=False,
+    approximate=False,
+    state_dir=None,
+    full=False,
+    check_names=None,
+    sketch_capacity=None,
+):
+    """Run all sanity checks on canonical data with a single scan of the issues.
+
+    Issue files are decompressed and parsed only once: each check extracts
+    what it needs from every issue, and its partial results are reduced by
+    the scan engine (see :mod:`sanity_check.contents.scan`). If `index_dir`
+    is given, the Parquet index of the bucket is scanned instead, without the
+    checks of data it does not store (see
+    :func:`sanity_check.contents.scan.create_checks`).
+
+    `check_names` selects registered checks by name (all of them by default,
+    see :data:`sanity_check.contents.scan.CHECKS`); page checks, if any, share
+    one additional scan of the page files.
+
+    `newspapers` (IDs or glob patterns) and `years` restrict the checks to a
+    subset of the bucket; other files are neither listed nor read.
+
+    When reading bz2 files, each partition holds the issues of one
+    newspaper-year (one issue file), so that duplicated IDs are counted per
+    newspaper-year and only collisions are reduced, instead of every ID of
+    the corpus. When reading the index, each partition holds the issues of
+    one newspaper, and collisions are likewise kept per newspaper.
+
+    With `two_stage=True`, duplicated issue and content item IDs are first
+    sketched (Bloom filters and HyperLogLog counts, see
+    :class:`sanity_check.contents.scan.SketchedDuplicateIDs`), which gives
+    approximate reports (`*_approx`); unless `approximate` is set, a second
+    scan then counts exactly only the IDs flagged as candidates. Sketches are
+    sized for `sketch_capacity` IDs (by default, for the IDs estimated from
+    the size of the issue files), saved to `sketch_dir` if given together
+    with a fingerprint of the data, and loaded from it instead of being
+    recomputed if `reuse_sketches` is set and the data did not change.
+
+    If `state_dir` is given, checks are incremental (see
+    :mod:`sanity_check.contents.state`): only newspapers whose issue or page
+    files changed since their last check are scanned, and the stored results
+    of the others are merged into the report. `full=True` re-checks all
+    newspapers (and refreshes their state). The status of every newspaper is
+    reported as `incremental_status`.
+    """
+    scan_args = (check_names, two_stage, sketch_dir, reuse_sketches, approximate, sketch_capacity)
+    if not state_dir:
+        report = _scan_checks(canonical_bucket_name, index_dir, newspapers, years, *scan_args)
+        print('Done')
+        _write_results(report.results, output_dir)
+        return report
+
+    state = CheckState(state_dir, canonical_bucket_name)
+    # (results from the index lack the checks of data it does not store, see `create_checks`)
+    config = {
+        "years": years,
+        "checks": check_names,
+        "indexed": bool(index_dir),
+        "two_stage": two_stage,
+        "approximate": approximate,
+    }
+    etags = newspaper_etags(canonical_bucket_name, newspapers, years)
+    to_check = sorted(np for np in etags if full or not state.is_current(np, etags[np], config))
+    skipped = sorted(set(etags) - set(to_check))
 
-    # 2) verify that there are not duplicated content item IDs
     print(OUTPUT_SEPARATOR)
-    print('Verifying existence of duplicated content item IDs...')
-    duplicates_df = check_duplicated_content_item_IDs(canonical_issues_bag)
-    if output_dir and os.path.exists(output_dir):
-        fname = "duplicate_ci_ids"
-        pickle_path = os.path.join(output_dir, f"{fname}.pkl")
-        csv_path = os.path.join(output_dir, f"{fname}.csv")
-
-        duplicates_df.to_pickle(pickle_path)
-        print(f"Written pickle file to {pickle_path}")
-
-        duplicates_df.to_csv(csv_path)
-        print(f"Written CSV output to {csv_path}")
-    elif os.path.exists(output_dir) is False:
-        print(f"No outputs written as folder {output_dir} does not exist.")
+    print(f"Checking {len(to_check)} newspapers, skipping {len(skipped)} unchanged ones ({', '.join(skipped)})")
+
+    if to_check:
+        report = _scan_checks(canonical_bucket_name, index_dir, to_check, years, *scan_args)
+        fresh_results = {name: split_by_newspaper(df, to_check) for name, df in report.results.items()}
+        for newspaper in to_check:
+            state.save(
+                newspaper,
+                etags[newspaper],
+                config,
+                {name: by_newspaper[newspaper] for name, by_newspaper in fresh_results.items()},
+            )
+    else:
+        report = ScanReport({}, 0, 0, {})
+
+    # merge with the stored results of unchanged newspapers
+    for newspaper in skipped:
+        for name, df in state.results(newspaper).items():
+            report.results[name] = pd.concat([report.results[name], df]) if name in report.results else df
+
+    report.results["incremental_status"] = pd.DataFrame(
+        [
+            {"newspaper_id": np, "status": "checked" if np in to_check else "skipped", "n_objects": len(etags[np])}
+            for np in sorted(etags)
+        ],
+        columns=["newspaper_id", "status", "n_objects"],
+    ).set_index("newspaper_id")
     print('Done')
 
-    # 3) verify the consistency of page IDs
-    print(OUTPUT_SEPARATOR)
-    print('Verifying integrity of page IDs...')
-    inconsistencies_df = check_inconsistent_page_ids(canonical_bucket_name)
-    if output_dir and os.path.exists(output_dir):
-        fname = "inconsistent_page_ids"
-        pickle_path = os.path.join(output_dir, f"{fname}.pkl")
-        csv_path = os.path.join(output_dir, f"{fname}.csv")
-
-        inconsistencies_df.to_pickle(pickle_path)
-        print(f"Written pickle file to {pickle_path}")
-
-        inconsistencies_df.to_csv(csv_path)
-        print(f"Written CSV output to {csv_path}")
-    elif os.path.exists(output_dir) is False:
-        print(f"No outputs written as folder {output_dir} does not exist.")
-    print('Done')
+    _write_results(report.results, output_dir)
 
     # TODO: at this point output a list of newspaper that can be moved
     # to staging
-    return
+    return report
 
 
 def main():
@@ -182,37 +308,47 @@ def main():
     s3_canonical_bucket = arguments["--canonical-bucket"]
     s3_rebuilt_bucket = arguments["--rebuilt-bucket"]
     output_dir = arguments["--output-dir"]
-    memory = arguments["--k8-memory"] if arguments["--k8-memory"] else "1G"
-    workers = int(arguments["--k8-workers"]) if arguments["--k8-workers"] else 50
-
-    image_uri = "ic-registry.epfl.ch/dhlab/impresso_data-sanity-check:v1"
-
-    try:
-        # first thing to do is to create the dask kubernetes cluster
-        cluster = DaskCluster(
-            namespace="dhlab",
-            cluster_id="impresso-sanitycheck-cli",
-            scheduler_pod_spec=make_scheduler_configuration(),
-            worker_pod_spec=make_worker_configuration(docker_image=image_uri, memory=memory),
+    index_dir = arguments["--index-dir"]
+    newspapers = parse_newspapers(arguments["--newspapers"])
+    years = parse_years(arguments["--years"])
+    executor = arguments["--executor"]
+    memory = arguments["--k8-memory"]
+    workers = int(arguments["--k8-workers"]) if arguments["--k8-workers"] else None
+
+    if arguments["--manifest-dir"]:
+        max_age = arguments["--manifest-max-age"]
+        enable_manifest_cache(arguments["--manifest-dir"], float(max_age) if max_age else None)
+    if arguments["--index-version"]:
+        pin_index_version(arguments["--index-version"])
+
+    # nothing to plan if the resources are given, or if the index is read instead of the files
+    plan = None
+    if executor != "threads" and not index_dir and not (memory and workers):
+        plan = plan_resources(
+            [
+                StageEstimate(
+                    "issues", list_newspaper_file_sizes(s3_canonical_bucket, "{np}/issues/", newspapers, years)
+                ),
+                StageEstimate("pages", list_newspaper_file_sizes(s3_canonical_bucket, "{np}/pages/", newspapers, years)),
+            ]
+        )
+
+    with dask_executor(executor, memory, workers, plan):
+        run_checks_canonical(
+            s3_canonical_bucket,
+            output_dir,
+            index_dir,
+            newspapers,
+            years,
+            two_stage=arguments["--two-stage"],
+            sketch_dir=arguments["--sketch-dir"],
+            reuse_sketches=arguments["--reuse-sketches"],
+            approximate=arguments["--approximate"],
+            state_dir=arguments["--state-dir"],
+            full=arguments["--full"],
+            check_names=parse_list(arguments["--checks"]),
+            sketch_capacity=int(arguments["--sketch-capacity"]) if arguments["--sketch-capacity"] else None,
         )
-        cluster.create()
-        cluster.scale(workers, blocking=True)
-        dask_client = cluster.make_dask_client()
-
-        # NB here we check that scheduler and workers do have the same
-        # versions of the various libraries, as mismatches may cause
-        # exceptions and weird behaviours.
-        libraries_versions = dask_client.get_versions(check=True)
-        print(dask_client)
-        run_checks_canonical(s3_canonical_bucket, output_dir)
-
-        # TODO: do stuff
-
-    except Exception as e:
-        raise e
-    finally:
-        if cluster:
-            cluster.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,329 @@
+"""Dask executors shared by the command-line scripts.
+
+Three executors are available:
+
+- `k8`: a dask cluster on Kubernetes (one scheduler pod, `workers` worker
+  pods of `memory` each), as used for full runs on the whole corpus;
+- `local`: a cluster of worker processes on the local machine, sized from
+  its number of CPUs and available memory;
+- `threads`: dask's threaded scheduler, without any cluster.
+
+Local executors start in seconds, which suits small re-checks (e.g. a few
+newspapers or years). All of them are used through :func:`dask_executor`,
+which also takes care of shutting the cluster down.
+
+Instead of fixed guesses, the resources of a run can be planned from the
+sizes of its input files (see :func:`plan_resources`): the number of tasks
+of each stage gives the number of workers, and the size of the largest task
+the memory of each worker. Commands skip planning when both the workers and
+their memory are given, or when they read the Parquet index instead of the
+files. Clusters are then scaled adaptively between a small minimum and the
+planned number of workers, so that they shrink during the light (pandas)
+phases at the end of a run, and the planned resources are logged next to
+the ones actually used.
+"""
+
+import math
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
+
+import dask
+from dask.utils import parse_bytes
+
+EXECUTORS = ("k8", "local", "threads")
+DEFAULT_EXECUTOR = "k8"
+
+K8_IMAGE_URI = "ic-registry.epfl.ch/dhlab/impresso_data-sanity-check:v1"
+K8_NAMESPACE = "dhlab"
+K8_CLUSTER_ID = "impresso-sanitycheck-cli"
+DEFAULT_K8_MEMORY = "1G"
+DEFAULT_K8_WORKERS = 50
+
+# local workers get at least this much memory, and the cluster leaves some
+# of the available memory to the rest of the machine
+MIN_LOCAL_WORKER_MEMORY = parse_bytes("2GiB")
+LOCAL_MEMORY_FRACTION = 0.8
+
+# resource planning: bz2 JSON data takes up to this many times its size once
+# decompressed and parsed, and each worker should get a few tasks per stage
+DECOMPRESSION_FACTOR = 10
+TASK_SIZE = 32 * 1024 ** 2
+TASKS_PER_WORKER = 4
+MAX_PLANNED_WORKERS = 100
+MIN_WORKER_MEMORY = parse_bytes("1GiB")
+MAX_WORKER_MEMORY = parse_bytes("16GiB")
+# adaptive clusters keep at least this fraction of the planned workers
+ADAPTIVE_MIN_FRACTION = 0.1
+
+# seconds between two samples of the workers of a cluster
+MONITOR_INTERVAL = 10
+
+
+def available_memory() -> int:
+    """Return the memory (in bytes) currently available on the local machine."""
+    # imported here as it is only needed by local clusters
+    import psutil
+
+    return psutil.virtual_memory().available
+
+
+def local_cluster_size(n_cpus: int = None, memory: int = None) -> Tuple[int, int, int]:
+    """Size a local cluster from the number of CPUs and the available memory.
+
+    One worker process is started per CPU, unless there is not enough memory
+    to give each of them at least `MIN_LOCAL_WORKER_MEMORY`: fewer workers
+    are then started, with several threads each.
+
+    :param int n_cpus: Number of CPUs (default: `os.cpu_count()`).
+    :param int memory: Available memory in bytes (default: `available_memory()`).
+    :return: The number of workers, threads per worker and memory limit (in
+        bytes) of each worker.
+    :rtype: Tuple[int, int, int]
+
+    """
+    n_cpus = n_cpus or os.cpu_count() or 1
+    memory = int((memory if memory is not None else available_memory()) * LOCAL_MEMORY_FRACTION)
+
+    n_workers = max(1, min(n_cpus, memory // MIN_LOCAL_WORKER_MEMORY))
+    threads_per_worker = max(1, n_cpus // n_workers)
+    return n_workers, threads_per_worker, memory // n_workers
+
+
+class StageEstimate:
+    """Estimated size of a stage of a run (e.g. reading the issues of a bucket).
+
+    By default each file is read by a single task (e.g. issue scans, with
+    one partition per issue file). With `split_files=True`, files larger than
+    `TASK_SIZE` are assumed to be split into several tasks (see
+    :mod:`sanity_check.contents.bz2_chunks`).
+    """
+
+    def __init__(self, name: str, file_sizes: Iterable[Tuple[str, int]], split_files: bool = False):
+        sizes = [size for _, size in file_sizes]
+        self.name = name
+        self.n_files = len(sizes)
+        self.n_bytes = sum(sizes)
+        if split_files:
+            self.n_tasks = sum(max(1, math.ceil(size / TASK_SIZE)) for size in sizes)
+            self.max_task_bytes = min(max(sizes, default=0), TASK_SIZE)
+        else:
+            self.n_tasks = len(sizes)
+            self.max_task_bytes = max(sizes, default=0)
+
+    def __repr__(self):
+        return (
+            f"<StageEstimate {self.name} files={self.n_files} bytes={format_bytes(self.n_bytes)} "
+            f"tasks={self.n_tasks}>"
+        )
+
+
+class ResourcePlan:
+    """Number of workers (adaptive bounds) and memory per worker planned for a run."""
+
+    def __init__(self, workers: int, min_workers: int, memory: str, stages: List[StageEstimate] = None):
+        self.workers = workers
+        self.min_workers = min_workers
+        self.memory = memory
+        self.stages = stages or []
+
+    def __repr__(self):
+        return f"<ResourcePlan workers={self.min_workers}-{self.workers} memory={self.memory}>"
+
+    def summary(self) -> str:
+        lines = [f"Planned {self.min_workers}-{self.workers} workers with {self.memory} each"]
+        for stage in self.stages:
+            lines.append(
+                f"  {stage.name}: {stage.n_files} files, {format_bytes(stage.n_bytes)}, ~{stage.n_tasks} tasks"
+            )
+        return "\n".join(lines)
+
+
+def format_bytes(n_bytes: int) -> str:
+    """Format a number of bytes, e.g. `1610612736` => `"1.5G"`."""
+    for unit in ("", "K", "M", "G"):
+        if n_bytes < 1024:
+            return f"{n_bytes:.1f}{unit}" if unit else f"{n_bytes}"
+        n_bytes /= 1024
+    return f"{n_bytes:.1f}T"
+
+
+def plan_resources(stages: List[StageEstimate], max_workers: int = MAX_PLANNED_WORKERS) -> ResourcePlan:
+    """Plan the workers and memory of a run from the estimated size of its stages.
+
+    The stage with the most tasks sets the number of workers (a few tasks
+    each, at most `max_workers`), and the largest task the memory of each
+    worker, once decompressed.
+
+    :param List[StageEstimate] stages: Estimated size of the stages of the run.
+    :param int max_workers: Maximum number of workers.
+    :return: The planned resources.
+    :rtype: ResourcePlan
+
+    """
+    n_tasks = max((stage.n_tasks for stage in stages), default=0)
+    workers = max(1, min(max_workers, math.ceil(n_tasks / TASKS_PER_WORKER)))
+    min_workers = max(1, int(workers * ADAPTIVE_MIN_FRACTION))
+
+    task_bytes = max((stage.max_task_bytes for stage in stages), default=0)
+    memory = min(max(task_bytes * DECOMPRESSION_FACTOR * 2, MIN_WORKER_MEMORY), MAX_WORKER_MEMORY)
+    memory_gib = math.ceil(memory / parse_bytes("1GiB"))
+
+    plan = ResourcePlan(workers, min_workers, f"{memory_gib}G", stages)
+    print(plan.summary())
+    return plan
+
+
+class ResourceMonitor:
+    """Sample the workers of a cluster in the background to log the resources actually used."""
+
+    def __init__(self, dask_client, interval: float = MONITOR_INTERVAL):
+        self.dask_client = dask_client
+        self.interval = interval
+        self.max_workers = 0
+        self.min_workers = None
+        self.max_worker_memory = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        workers = self.dask_client.scheduler_info()["workers"].values()
+        self.max_workers = max(self.max_workers, len(workers))
+        self.min_workers = len(workers) if self.min_workers is None else min(self.min_workers, len(workers))
+        memory = [worker.get("metrics", {}).get("memory", 0) for worker in workers]
+        self.max_worker_memory = max([self.max_worker_memory] + memory)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception:
+                # the scheduler may be unreachable while shutting down
+                pass
+
+    def start(self) -> "ResourceMonitor":
+        self._sample()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self, plan: Optional[ResourcePlan] = None) -> str:
+        actual = (
+            f"used {self.min_workers}-{self.max_workers} workers, "
+            f"peak worker memory {format_bytes(self.max_worker_memory)}"
+        )
+        if plan is None:
+            return f"Resources: {actual}"
+        return f"Resources: planned {plan.min_workers}-{plan.workers} workers with {plan.memory} each, {actual}"
+
+
+def _adapt(cluster, minimum: int, maximum: int):
+    """Let a cluster scale between `minimum` and `maximum` workers, or scale it to `maximum` workers.
+
+    Clusters without adaptive scaling (e.g. those of `dask_k8`) are scaled
+    explicitly, and keep `maximum` workers for the whole run.
+    """
+    if hasattr(cluster, "adapt"):
+        cluster.adapt(minimum=minimum, maximum=maximum)
+        print(f"Adaptive scaling between {minimum} and {maximum} workers")
+    else:
+        cluster.scale(maximum)
+        print(f"{type(cluster).__name__} does not support adaptive scaling: scaled to {maximum} workers")
+
+
+def _create_k8_cluster(memory: str, workers: int):
+    # imported here as they are only needed (and installed) on Kubernetes
+    from dask_k8 import DaskCluster
+    from impresso_commons.utils.kube import make_scheduler_configuration, make_worker_configuration
+
+    cluster = DaskCluster(
+        namespace=K8_NAMESPACE,
+        cluster_id=K8_CLUSTER_ID,
+        scheduler_pod_spec=make_scheduler_configuration(),
+        worker_pod_spec=make_worker_configuration(docker_image=K8_IMAGE_URI, memory=memory),
+    )
+    cluster.create()
+    cluster.scale(workers, blocking=True)
+    return cluster, cluster.make_dask_client()
+
+
+def _create_local_cluster(plan: Optional[ResourcePlan] = None):
+    from distributed import Client, LocalCluster
+
+    n_workers, threads_per_worker, memory_limit = local_cluster_size()
+    cluster = LocalCluster(
+        n_workers=n_workers,
+        threads_per_worker=threads_per_worker,
+        memory_limit=memory_limit,
+        processes=True,
+    )
+    if plan is not None:
+        # the machine, not the plan, bounds the number of local workers
+        _adapt(cluster, min(plan.min_workers, n_workers), n_workers)
+    return cluster, Client(cluster)
+
+
+@contextmanager
+def dask_executor(
+    executor: Optional[str] = None,
+    memory: Optional[str] = None,
+    workers: Optional[int] = None,
+    plan: Optional[ResourcePlan] = None,
+):
+    """Run the enclosed computations with the given dask executor.
+
+    The cluster (if any) is created when entering the context, and closed
+    when leaving it, even if the computations fail.
+
+    :param str executor: One of `EXECUTORS` (default: `DEFAULT_EXECUTOR`).
+    :param str memory: Memory of each worker of the `k8` cluster (e.g. "2G");
+        overrides the planned memory.
+    :param int workers: Number of workers of the `k8` cluster; overrides the
+        planned number of workers.
+    :param ResourcePlan plan: Resources planned for the run (see
+        :func:`plan_resources`); clusters are then scaled adaptively.
+    :return: The dask client of the cluster (`None` for `threads`).
+    :rtype: distributed.Client
+
+    """
+    executor = executor or DEFAULT_EXECUTOR
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor {executor}, expected one of {', '.join(EXECUTORS)}")
+
+    if executor == "threads":
+        with dask.config.set(scheduler="threads"):
+            print("Running with dask's threaded scheduler")
+            yield None
+        return
+
+    cluster = dask_client = monitor = None
+    try:
+        if executor == "k8":
+            if plan is not None:
+                memory = memory or plan.memory
+                workers = workers or plan.workers
+            cluster, dask_client = _create_k8_cluster(memory or DEFAULT_K8_MEMORY, workers or DEFAULT_K8_WORKERS)
+            if plan is not None:
+                _adapt(cluster, min(plan.min_workers, workers), workers)
+        else:
+            cluster, dask_client = _create_local_cluster(plan)
+
+        # NB here we check that scheduler and workers do have the same
+        # versions of the various libraries, as mismatches may cause
+        # exceptions and weird behaviours.
+        dask_client.get_versions(check=True)
+        print(dask_client)
+        monitor = ResourceMonitor(dask_client).start()
+        yield dask_client
+    finally:
+        if monitor is not None:
+            monitor.stop()
+            print(monitor.summary(plan))
+        if dask_client is not None and executor == "local":
+            dask_client.close()
+        if cluster is not None:
+            cluster.close()
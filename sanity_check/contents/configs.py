@@ -0,0 +1,138 @@
+"""Generation of the configuration files of the rebuild/ingestion scripts.
+
+A configuration is a list of entries, one per newspaper and range of years
+to process, e.g. `{"GDL": [1850, 1852]}` (years `1850` to `1851` included),
+as expected by the downstream scripts. Ranges cover exactly the years with
+missing issues: if only 1850 and 1990 are missing, two entries are generated
+instead of a range of 140 years.
+
+The estimated cost of each entry is kept apart from the configuration (see
+:func:`entry_costs`), in the same order as the entries: the number of
+missing issues (`n_issues`) and, if known, the size of the files to be read
+(`bytes`), as listed in s3.
+
+So that a single large newspaper does not dominate the run time of the
+downstream job, the entries can also be planned into batches of roughly
+equal cost (see :func:`plan_batches`), one per downstream worker.
+"""
+
+import heapq
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+
+def year_ranges(years: Iterable[int]) -> List[List[int]]:
+    """Return the minimal ranges `[start, end)` covering exactly the given years.
+
+    E.g. `[1850, 1851, 1852, 1990]` => `[[1850, 1853], [1990, 1991]]`.
+    """
+    ranges = []
+    for year in sorted(set(years)):
+        if ranges and ranges[-1][1] == year:
+            ranges[-1][1] = year + 1
+        else:
+            ranges.append([year, year + 1])
+    return ranges
+
+
+def sizes_by_newspaper_year(file_sizes: Iterable[Tuple[str, int]]) -> Dict[Tuple[str, int], int]:
+    """Sum the sizes of files (e.g. from the manifest of a bucket) by newspaper and year."""
+    # imported here so that entries can be generated without the s3 dependencies
+    from sanity_check.contents.s3_data import path_newspaper_year
+
+    sizes = {}
+    for path, size in file_sizes:
+        key = path_newspaper_year(path)
+        sizes[key] = sizes.get(key, 0) + size
+    return sizes
+
+
+def _entry_issues(issues: pd.DataFrame) -> Iterator[Tuple[str, List[int], pd.DataFrame]]:
+    for newspaper, group in issues.groupby(by='newspaper_id'):
+        for start, end in year_ranges(group.year):
+            yield newspaper, [start, end], group[(group.year >= start) & (group.year < end)]
+
+
+def config_entries(issues: pd.DataFrame) -> List[dict]:
+    """Generate the configuration entries processing exactly the given issues.
+
+    :param pd.DataFrame issues: Issues to process, indexed by issue ID, with
+        columns `newspaper_id` and `year`.
+    :return: One entry `{newspaper: [start, end]}` per newspaper and range of years.
+    :rtype: List[dict]
+
+    """
+    return [{newspaper: years} for newspaper, years, _ in _entry_issues(issues)]
+
+
+def entry_costs(issues: pd.DataFrame, sizes: Optional[Dict[Tuple[str, int], int]] = None) -> List[dict]:
+    """Estimate the cost of each entry of :func:`config_entries`, in the same order.
+
+    :param pd.DataFrame issues: Issues to process, indexed by issue ID, with
+        columns `newspaper_id` and `year`.
+    :param Dict[Tuple[str, int], int] sizes: Size in bytes of the input files
+        of each newspaper and year (see :func:`sizes_by_newspaper_year`).
+    :return: The `newspaper`, `years`, `n_issues` and (if `sizes` is given)
+        `bytes` of each entry.
+    :rtype: List[dict]
+
+    """
+    costs = []
+    for newspaper, (start, end), entry_issues in _entry_issues(issues):
+        cost = {"newspaper": newspaper, "years": [start, end], "n_issues": len(entry_issues)}
+        if sizes is not None:
+            cost["bytes"] = sum(sizes.get((newspaper, year), 0) for year in range(start, end))
+        costs.append(cost)
+    return costs
+
+
+def plan_batches(
+    issues: pd.DataFrame,
+    sizes: Optional[Dict[Tuple[str, int], int]] = None,
+    n_batches: int = 1,
+) -> List[dict]:
+    """Split the issues to process into batches of roughly equal cost.
+
+    Each year of a newspaper is an item, whose cost is the size of its files
+    (or its number of issues if `sizes` is not given). Items are assigned,
+    from the most to the least costly, to the batch with the lowest total
+    cost so far (longest processing time first), and the items of each batch
+    are then turned into configuration entries (see :func:`config_entries`).
+
+    :param pd.DataFrame issues: Issues to process, indexed by issue ID, with
+        columns `newspaper_id` and `year`.
+    :param Dict[Tuple[str, int], int] sizes: Size in bytes of the input files
+        of each newspaper and year (see :func:`sizes_by_newspaper_year`).
+    :param int n_batches: Number of batches (e.g. of downstream workers).
+    :return: The non-empty batches, with their `cost` (in `bytes` or
+        `n_issues`) and `config` entries.
+    :rtype: List[dict]
+
+    """
+    unit = "bytes" if sizes is not None else "n_issues"
+    costs = {}
+    for key, group in issues.groupby(by=['newspaper_id', 'year']):
+        costs[key] = sizes.get(key, 0) if sizes is not None else len(group)
+
+    loads = [(0, batch) for batch in range(max(1, n_batches))]
+    assigned = {}
+    for key in sorted(costs, key=lambda key: (-costs[key], key)):
+        load, batch = heapq.heappop(loads)
+        assigned.setdefault(batch, []).append(key)
+        heapq.heappush(loads, (load + costs[key], batch))
+
+    issue_keys = list(zip(issues.newspaper_id, issues.year))
+    batches = []
+    for batch in sorted(assigned):
+        keys = set(assigned[batch])
+        batch_issues = issues[[key in keys for key in issue_keys]]
+        batches.append(
+            {
+                "batch": len(batches),
+                "cost": sum(costs[key] for key in keys),
+                "unit": unit,
+                "config": config_entries(batch_issues),
+            }
+        )
+    return batches
@@ -0,0 +1,320 @@
+"""Databases the commands read impresso metadata from.
+
+Usage:
+    db_backends.py --output=<db> --fixtures-dir=<fd>
+    db_backends.py --output=<db> --newspapers=<nps> --years=<yrs> [--issues-per-year=<n> --items-per-issue=<n>]
+
+Options:
+
+--output=<db>  Path of the SQLite (`.sqlite`, `.db`) or DuckDB (`.duckdb`) file to create
+--fixtures-dir=<fd>  Directory holding one CSV file per table (e.g. `issues.csv`), with a header row
+--newspapers=<nps>  Newspaper IDs of the generated fixtures (e.g. "GDL JDG")
+--years=<yrs>  Years or year ranges of the generated fixtures (e.g. "1850-1860 1900")
+--issues-per-year=<n>  Number of issues of each newspaper and year [default: 300]
+--items-per-issue=<n>  Number of content items of each issue [default: 50]
+
+The `--db-config` of the commands (`sync.py db`, `stats.py mysql`,
+`stats.py corpus`, `snapshots.py`) selects the backend:
+
+- a DB configuration of `impresso_db` (e.g. "dev", "prod") is the impresso
+  MySQL DB (see :class:`MySQLBackend`);
+- the path of a `.sqlite`/`.db` file (or a `sqlite:///<path>` URL) is a
+  local SQLite DB (see :class:`SQLiteBackend`);
+- the path of a `.duckdb` file (or a `duckdb:///<path>` URL) is a local
+  DuckDB DB (see :class:`DuckDBBackend`).
+
+Local DBs are created with the tables read by the commands (see
+`FIXTURE_TABLES`), filled from CSV fixtures or generated ones (see
+:func:`generate_fixtures`), so that DB-sync paths can be tested and
+benchmarked with realistic row counts without a live MySQL.
+"""
+
+import csv
+import importlib
+import os
+import re
+import sqlite3
+import string
+import sys
+import threading
+from datetime import date, timedelta
+from typing import Dict, Iterable, Iterator, List
+
+from docopt import docopt
+
+from sanity_check.contents.helpers import parse_newspapers, parse_years
+
+# rows are fetched from server-side cursors by batches of this size
+FETCH_SIZE = 10000
+
+# tables (and their columns) read by the commands
+FIXTURE_TABLES = {
+    "newspapers": [("id", "VARCHAR(50)"), ("title", "VARCHAR(500)"), ("start_year", "INTEGER"), ("end_year", "INTEGER")],
+    "np_timespan_v": [("newspaper_id", "VARCHAR(50)"), ("start_year", "INTEGER"), ("end_year", "INTEGER")],
+    "issues": [("id", "VARCHAR(50)"), ("newspaper_id", "VARCHAR(50)"), ("year", "INTEGER")],
+    "content_items": [("id", "VARCHAR(50)"), ("issue_id", "VARCHAR(50)")],
+}
+
+SQLITE_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+DUCKDB_EXTENSIONS = (".duckdb",)
+
+_BACKENDS = {}
+_BACKENDS_LOCK = threading.Lock()
+
+
+class DBBackend:
+    """Interface of a database holding impresso metadata.
+
+    Queries are plain SQL with named parameters (e.g. `:low`), valid for
+    every backend.
+    """
+
+    name = None
+
+    def __init__(self, db_config: str):
+        self.db_config = db_config
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.db_config}>"
+
+    def iter_rows(self, query: str, params: dict = None, fetch_size: int = FETCH_SIZE) -> Iterator[tuple]:
+        """Stream the rows of a query."""
+        raise NotImplementedError
+
+    def connect(self):
+        """Open a new DB-API connection, to be closed by the caller."""
+        raise NotImplementedError
+
+
+class MySQLBackend(DBBackend):
+    """The impresso MySQL DB, through the pooled SQLAlchemy engine of `impresso_db`."""
+
+    name = "mysql"
+
+    def __init__(self, db_config: str):
+        super().__init__(db_config)
+        print(f'Connecting to MySQL DB {db_config}')
+        os.environ["IMPRESSO_DB_CONFIG"] = db_config
+        # `impresso_db` creates its engine from the `IMPRESSO_DB_CONFIG` environment variable when imported:
+        # it needs to be imported here (not earlier!) otherwise we can't change/overwrite the DB config
+        if "impresso_db.base" in sys.modules:
+            base = importlib.reload(sys.modules["impresso_db.base"])
+        else:
+            base = importlib.import_module("impresso_db.base")
+        self.engine = base.engine
+
+    def iter_rows(self, query: str, params: dict = None, fetch_size: int = FETCH_SIZE) -> Iterator[tuple]:
+        # imported here as only the processes querying the DB need it
+        from sqlalchemy import text
+
+        with self.engine.connect() as db_conn:
+            result = db_conn.execution_options(stream_results=True).execute(text(query), params or {})
+            while True:
+                rows = result.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+
+    def connect(self):
+        return self.engine.raw_connection()
+
+
+class SQLiteBackend(DBBackend):
+    """A local SQLite DB file (see :func:`create_local_db`)."""
+
+    name = "sqlite"
+
+    def __init__(self, db_config: str):
+        super().__init__(db_config)
+        self.path = _local_db_path(db_config)
+        if not os.path.exists(self.path):
+            raise ValueError(f"Local DB {self.path} does not exist")
+
+    def connect(self):
+        # a new (read-only) connection per query, as sqlite3 connections can't be shared between threads
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    def _execute(self, cursor, query: str, params: dict):
+        # sqlite3 supports `:name` parameters natively
+        cursor.execute(query, params or {})
+
+    def iter_rows(self, query: str, params: dict = None, fetch_size: int = FETCH_SIZE) -> Iterator[tuple]:
+        db_conn = self.connect()
+        try:
+            cursor = db_conn.cursor()
+            self._execute(cursor, query, params)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            db_conn.close()
+
+
+class DuckDBBackend(SQLiteBackend):
+    """A local DuckDB DB file (requires the `duckdb` package)."""
+
+    name = "duckdb"
+
+    def connect(self):
+        # imported here as it is an optional dependency, only needed by DuckDB DBs
+        import duckdb
+
+        return duckdb.connect(self.path, read_only=True)
+
+    def _execute(self, cursor, query: str, params: dict):
+        # DuckDB names its parameters `$name`
+        cursor.execute(re.sub(r"(?<!:):(\w+)", r"$\1", query), params or {})
+
+
+def _local_db_path(db_config: str) -> str:
+    return re.sub(r"^(sqlite|duckdb):///", "", db_config)
+
+
+def backend_class(db_config: str) -> type:
+    """Return the backend class of a `--db-config` value (see the module docstring)."""
+    if db_config.startswith("sqlite:///") or db_config.endswith(SQLITE_EXTENSIONS):
+        return SQLiteBackend
+    if db_config.startswith("duckdb:///") or db_config.endswith(DUCKDB_EXTENSIONS):
+        return DuckDBBackend
+    return MySQLBackend
+
+
+def db_label(db_config: str = None) -> str:
+    """Return a name for a DB, usable in file names (e.g. `/tmp/fixtures.sqlite` => `fixtures`)."""
+    db_config = db_config or os.environ["IMPRESSO_DB_CONFIG"]
+    if backend_class(db_config) is MySQLBackend:
+        return db_config
+    return os.path.splitext(os.path.basename(_local_db_path(db_config)))[0]
+
+
+def get_backend(db_config: str = None) -> DBBackend:
+    """Return the backend of a DB configuration (default: `IMPRESSO_DB_CONFIG`).
+
+    Backends are created once per configuration and process (e.g. each dask
+    worker), and then reused, together with their connection pool.
+    """
+    db_config = db_config or os.environ["IMPRESSO_DB_CONFIG"]
+    key = (os.getpid(), db_config)
+
+    with _BACKENDS_LOCK:
+        if key not in _BACKENDS:
+            _BACKENDS[key] = backend_class(db_config)(db_config)
+        return _BACKENDS[key]
+
+
+def generate_fixtures(
+    newspapers: List[str], years: Iterable[int], issues_per_year: int = 300, items_per_issue: int = 50
+) -> Dict[str, List[tuple]]:
+    """Generate fixtures with realistic IDs (e.g. `GDL-1900-01-01-a-i0001`) and row counts.
+
+    :param List[str] newspapers: Newspaper IDs.
+    :param Iterable[int] years: Years of each newspaper.
+    :param int issues_per_year: Number of issues of each newspaper and year.
+    :param int items_per_issue: Number of content items of each issue.
+    :return: The rows of each table of `FIXTURE_TABLES`.
+    :rtype: Dict[str, List[tuple]]
+
+    """
+    years = sorted(set(years))
+    fixtures = {table: [] for table in FIXTURE_TABLES}
+    for np in newspapers:
+        fixtures["newspapers"].append((np, np, years[0], years[-1]))
+        fixtures["np_timespan_v"].append((np, years[0], years[-1]))
+        for year in years:
+            n_days = (date(year + 1, 1, 1) - date(year, 1, 1)).days
+            for issue in range(issues_per_year):
+                # one issue per day, with several editions (`a`, `b`, ...) when there are more issues than days
+                day = date(year, 1, 1) + timedelta(days=issue % n_days)
+                issue_id = f"{np}-{day.isoformat()}-{string.ascii_lowercase[issue // n_days]}"
+                fixtures["issues"].append((issue_id, np, year))
+                fixtures["content_items"].extend(
+                    (f"{issue_id}-i{item + 1:04}", issue_id) for item in range(items_per_issue)
+                )
+    return fixtures
+
+
+def read_fixtures(fixtures_dir: str) -> Dict[str, List[tuple]]:
+    """Read the fixtures of a directory, one CSV file per table (e.g. `issues.csv`), with a header row.
+
+    Missing files are empty tables; columns are reordered as in `FIXTURE_TABLES`.
+    """
+    fixtures = {}
+    for table, columns in FIXTURE_TABLES.items():
+        path = os.path.join(fixtures_dir, f"{table}.csv")
+        fixtures[table] = []
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8", newline="") as infile:
+            for row in csv.DictReader(infile):
+                fixtures[table].append(tuple(row.get(name) or None for name, _ in columns))
+    return fixtures
+
+
+def create_local_db(path: str, fixtures: Dict[str, List[tuple]]) -> DBBackend:
+    """Create a local SQLite or DuckDB DB with the tables of `FIXTURE_TABLES`, filled with fixtures.
+
+    :param str path: Path of the DB file (its extension selects the backend);
+        an existing file is overwritten.
+    :param Dict[str, List[tuple]] fixtures: Rows of each table (see
+        :func:`generate_fixtures` and :func:`read_fixtures`).
+    :return: The backend of the new DB.
+    :rtype: DBBackend
+
+    """
+    backend = backend_class(path)
+    if backend is MySQLBackend:
+        raise ValueError(f"Expected a path ending with one of {SQLITE_EXTENSIONS + DUCKDB_EXTENSIONS}, got {path}")
+
+    path = _local_db_path(path)
+    if os.path.exists(path):
+        os.remove(path)
+
+    if backend is DuckDBBackend:
+        # imported here as it is an optional dependency, only needed by DuckDB DBs
+        import duckdb
+
+        db_conn = duckdb.connect(path)
+    else:
+        db_conn = sqlite3.connect(path)
+
+    try:
+        for table, columns in FIXTURE_TABLES.items():
+            column_defs = ", ".join(f"{name} {sql_type}" for name, sql_type in columns)
+            db_conn.execute(f"CREATE TABLE {table} ({column_defs});")
+            rows = fixtures.get(table, [])
+            if rows:
+                placeholders = ", ".join("?" for _ in columns)
+                db_conn.executemany(f"INSERT INTO {table} VALUES ({placeholders});", rows)
+            print(f"Loaded {len(rows)} rows into {table}")
+        # IDs are read by key ranges (see `sanity_check.contents.mysql.key_ranges`)
+        for table in ("newspapers", "issues", "content_items"):
+            db_conn.execute(f"CREATE UNIQUE INDEX {table}_id ON {table} (id);")
+        db_conn.commit()
+    finally:
+        db_conn.close()
+
+    return backend(path)
+
+
+def main():
+    arguments = docopt(__doc__)
+    output = arguments['--output']
+
+    if arguments['--fixtures-dir']:
+        fixtures = read_fixtures(arguments['--fixtures-dir'])
+    else:
+        fixtures = generate_fixtures(
+            parse_newspapers(arguments['--newspapers']),
+            parse_years(arguments['--years']),
+            int(arguments['--issues-per-year']),
+            int(arguments['--items-per-issue']),
+        )
+
+    create_local_db(output, fixtures)
+    print(f"Written local DB to {output}: use it with --db-config={output}")
+
+
+if __name__ == '__main__':
+    main()
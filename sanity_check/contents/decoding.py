@@ -0,0 +1,157 @@
+"""Field-projected decoding of impresso JSON-line records.
+
+Callers name the fields they need, e.g. ``["id", "pp"]`` or ``["i[*].m.id"]``
+(``[*]`` maps the rest of the path over the items of an array), and get back
+a dictionary containing only those fields, with the same nesting as the
+original document.
+
+The fastest available parser is used:
+
+- `pysimdjson <https://github.com/TkTech/pysimdjson>`_ parses documents lazily,
+  so that only the projected fields are turned into Python objects;
+- `orjson <https://github.com/ijl/orjson>`_ parses the whole document, but
+  several times faster than the standard library;
+- :mod:`json` is the fallback when none of the above is installed.
+
+For the common case of a single top-level string field (e.g. the ``id`` of
+rebuilt or page records), :func:`extract_field` reads it directly from the
+raw line without parsing it. Whenever a fast path fails (unexpected layout,
+malformed record), decoding falls back to a full parse of the document.
+"""
+
+import json
+import logging
+import re
+import threading
+from functools import lru_cache
+from typing import Optional, Sequence
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOGGER = logging.getLogger(__name__)
+
+ALL_ITEMS = "[*]"
+
+# simdjson parsers are not thread-safe: one parser per thread
+_local = threading.local()
+
+
+def _simdjson_parser():
+    parser = getattr(_local, "parser", None)
+    if parser is None:
+        parser = _local.parser = simdjson.Parser()
+    return parser
+
+
+@lru_cache(maxsize=128)
+def _compile_fields(fields: Sequence[str]) -> dict:
+    """Turn a list of field paths into a projection tree.
+
+    E.g. ``("id", "i[*].m.id", "i[*].m.pp")`` becomes
+    ``{"id": None, "i": {"[*]": {"m": {"id": None, "pp": None}}}}``.
+    """
+    tree = {}
+    for field in fields:
+        node = tree
+        parts = field.split(".")
+        for n, part in enumerate(parts):
+            last = n == len(parts) - 1
+            keys = [part[: -len(ALL_ITEMS)], ALL_ITEMS] if part.endswith(ALL_ITEMS) else [part]
+            for m, key in enumerate(keys):
+                if last and m == len(keys) - 1:
+                    node.setdefault(key, None)
+                else:
+                    if node.get(key) is None:
+                        node[key] = {}
+                    node = node[key]
+    return tree
+
+
+def _materialize(value):
+    """Turn a (possibly lazy) simdjson value into a Python object."""
+    if hasattr(value, "as_dict"):
+        return value.as_dict()
+    if hasattr(value, "as_list"):
+        return value.as_list()
+    return value
+
+
+def _project(node, tree: Optional[dict]):
+    if tree is None:
+        return _materialize(node)
+    if ALL_ITEMS in tree:
+        return [_project(item, tree[ALL_ITEMS]) for item in node]
+    return {key: _project(node[key], subtree) for key, subtree in tree.items() if key in node}
+
+
+def _full_parse(line: str) -> dict:
+    if orjson is not None:
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            # the standard library is more lenient (e.g. NaN, lone surrogates)
+            pass
+    return json.loads(line)
+
+
+def decode(line: str, fields: Optional[Sequence[str]] = None) -> dict:
+    """Decode a JSON line, keeping only the requested fields.
+
+    :param str line: A JSON document.
+    :param Sequence[str] fields: Paths of the fields to keep (e.g. ``"id"``,
+        ``"i[*].m.id"``); the whole document is returned if `None`.
+    :return: The (projected) document.
+    :rtype: dict
+
+    """
+    if fields is None:
+        return _full_parse(line)
+
+    tree = _compile_fields(tuple(fields))
+
+    if simdjson is not None:
+        try:
+            return _project(_simdjson_parser().parse(line), tree)
+        except (ValueError, TypeError, KeyError, RuntimeError) as e:
+            # a parser that failed half-way may still be referenced by the
+            # traceback: start afresh with a new one
+            _local.parser = None
+            LOGGER.debug(f"Fast projected decoding failed ({e}), falling back to full parse")
+
+    return _project(_full_parse(line), tree)
+
+
+def extract_field(line: str, field: str = "id") -> Optional[str]:
+    """Extract a top-level string field from a JSON line without parsing it.
+
+    The raw line is matched only when `field` is the first key of the
+    document and its value contains no escape sequences, which is the case
+    of the `id` field in impresso data. Otherwise the line is decoded.
+
+    :param str line: A JSON document.
+    :param str field: Name of the top-level string field.
+    :return: The value of the field, or `None` if the document does not
+        contain it (e.g. empty documents).
+    :rtype: Optional[str]
+
+    """
+    match = _first_key_pattern(field).match(line)
+    if match:
+        return match.group(1)
+
+    if not line.strip():
+        return None
+    return decode(line, [field]).get(field)
+
+
+@lru_cache(maxsize=16)
+def _first_key_pattern(field: str):
+    return re.compile(r'\s*\{\s*"' + re.escape(field) + r'"\s*:\s*"([^"\\]*)"')
@@ -1 +1,39 @@
+"""Helper functions shared by the command-line scripts."""
 
+from typing import List, Optional
+
+
+def parse_list(value: Optional[str]) -> Optional[List[str]]:
+    """Parse an option holding a space or comma separated list of names.
+
+    E.g. `"duplicate_issue_ids,inconsistent_page_ids"` => `["duplicate_issue_ids", "inconsistent_page_ids"]`.
+    """
+    if not value:
+        return None
+    return value.replace(",", " ").split()
+
+
+def parse_newspapers(value: Optional[str]) -> Optional[List[str]]:
+    """Parse a `--newspapers` option (IDs or glob patterns, space or comma separated).
+
+    E.g. `"GDL JDG BL*"` => `["GDL", "JDG", "BL*"]`.
+    """
+    return parse_list(value)
+
+
+def parse_years(value: Optional[str]) -> Optional[List[int]]:
+    """Parse a `--years` option (years or inclusive ranges, space or comma separated).
+
+    E.g. `"1850-1852 1900"` => `[1850, 1851, 1852, 1900]`.
+    """
+    if not value:
+        return None
+
+    years = set()
+    for token in value.replace(",", " ").split():
+        if "-" in token:
+            start, end = token.split("-")
+            years.update(range(int(start), int(end) + 1))
+        else:
+            years.add(int(token))
+    return sorted(years)
@@ -0,0 +1,478 @@
+"""Command-line script to build a columnar (Parquet) index of a canonical bucket.
+
+Usage:
+    index.py --canonical-bucket=<cb> --index-dir=<idx> [--force --executor=<ex> --k8-memory=<mem> --k8-workers=<wkrs> --manifest-dir=<md> --manifest-max-age=<secs>]
+
+Options:
+
+--executor=<ex>  Dask executor: k8 (cluster on Kubernetes), local (worker processes sized from the local CPUs and memory) or threads [default: k8]
+--k8-memory=<mem>  Memory of each worker of the k8 executor (default: planned from the size of the input files)
+--k8-workers=<wkrs>  Maximum number of workers of the k8 executor (default: planned from the size of the input files)
+--canonical-bucket=<cb>  S3 bucket where canonical JSON data will be read from
+--index-dir=<idx>  Directory (local or s3) where the index is written
+--force  Rebuild the index even if one exists already for the current version of the bucket
+--manifest-dir=<md>  Directory of the local manifest of s3 listings (if omitted, buckets are listed from scratch)
+--manifest-max-age=<secs>  Seconds during which cached listings are reused without any request: files added, removed or rewritten meanwhile are missed (default: 3600; 0 lists each prefix again once per run)
+
+The index is made of two tables, partitioned by newspaper:
+
+- `issues`: one row per issue, with `issue_id`, `newspaper`, `year`,
+  `access_rights`, `page_ids` (list) and `ci_ids` (list);
+- `pages`: one row per page JSON document, with `page_id`, `newspaper`, `year`.
+
+It is written to `<index-dir>/<bucket>/<version>/`, where the version is a
+fingerprint of the keys and ETags of all issue and page files, so that it
+needs to be built only once per version of the bucket. Checks, stats and sync
+commands accept `--index-dir` to read this index instead of the bz2 files:
+they refuse to read it if the bucket changed since it was built, unless the
+version to read is pinned with `--index-version`.
+
+Example:
+
+    python sanity_check/contents/index.py --canonical-bucket='s3://original-canonical-fixed' \
+    --index-dir='s3://impresso-sanitycheck/index' --k8-memory="2G" --k8-workers=25
+"""  # noqa: E501
+
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Iterable, List, Tuple
+
+import fsspec
+import pandas as pd
+from dask import bag as db
+from dask import dataframe as dd
+from dask import delayed
+from docopt import docopt
+
+from sanity_check.contents.cluster import StageEstimate, dask_executor, plan_resources
+from sanity_check.contents.decoding import decode, extract_field
+from sanity_check.contents.manifest import enable_manifest_cache
+from sanity_check.contents.s3_data import (
+    get_storage_options,
+    list_newspaper_file_sizes,
+    list_newspapers,
+    list_prefix_objects,
+    read_text_file,
+    select_newspapers,
+    split_bucket_name,
+)
+
+INDEX_VERSION_ENV = "IMPRESSO_INDEX_VERSION"
+INDEX_METADATA_FILE = "_index.json"
+LATEST_VERSION_FILE = "LATEST"
+
+ISSUE_INDEX_FIELDS = ["id", "ar", "pp", "i[*].m.id"]
+ISSUE_INDEX_META = {
+    "issue_id": str,
+    "newspaper": str,
+    "year": int,
+    "access_rights": str,
+    "page_ids": object,
+    "ci_ids": object,
+}
+PAGE_INDEX_META = {"page_id": str, "newspaper": str, "year": int}
+
+# latest versions found to match their bucket, checked once per process
+_CHECKED_VERSIONS = {}
+
+
+def _storage_options(path: str) -> dict:
+    return get_storage_options() if path.startswith("s3://") else {}
+
+
+def _issue_index_schema():
+    # pyarrow is needed only when writing the index
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("issue_id", pa.string()),
+            ("newspaper", pa.string()),
+            ("year", pa.int64()),
+            ("access_rights", pa.string()),
+            ("page_ids", pa.list_(pa.string())),
+            ("ci_ids", pa.list_(pa.string())),
+        ]
+    )
+
+
+def issue_index_row(issue: dict) -> dict:
+    """Turn an issue JSON document into a row of the `issues` index table."""
+    issue_id = issue["id"]
+    return {
+        "issue_id": issue_id,
+        "newspaper": issue_id.split("-")[0],
+        "year": int(issue_id.split("-")[1]),
+        "access_rights": issue.get("ar"),
+        "page_ids": list(issue.get("pp", [])),
+        "ci_ids": [ci["m"]["id"] for ci in issue.get("i", [])],
+    }
+
+
+def page_index_row(page_id: str) -> dict:
+    """Turn a page ID into a row of the `pages` index table."""
+    return {"page_id": page_id, "newspaper": page_id.split("-")[0], "year": int(page_id.split("-")[1])}
+
+
+def _list_canonical_objects(canonical_bucket_name: str) -> list:
+    """List the issue and page files of a canonical bucket."""
+    newspapers = list_newspapers(canonical_bucket_name)
+    prefixes = [f"{np}/{kind}/" for np in newspapers for kind in ["issues", "pages"]]
+    return list_prefix_objects(canonical_bucket_name, prefixes)
+
+
+def objects_fingerprint(objects: list) -> str:
+    """Fingerprint the keys and ETags of s3 objects (e.g. listed by :func:`list_prefix_objects`), in any order.
+
+    :param list objects: Objects with a `key` and an `etag`.
+    :return: A short hexadecimal digest, which changes as soon as any object
+        is added, removed or rewritten.
+    :rtype: str
+
+    """
+    fingerprint = hashlib.sha1()
+    for obj in sorted(objects, key=lambda obj: obj["key"]):
+        fingerprint.update(f"{obj['key']}\t{obj['etag']}\n".encode("utf-8"))
+    return fingerprint.hexdigest()[:16]
+
+
+def bucket_version(canonical_bucket_name: str) -> str:
+    """Compute the version of a canonical bucket.
+
+    The version is a fingerprint of the keys and ETags of all issue and page
+    files: it changes as soon as any of them is added, removed or rewritten
+    (if listed from the manifest, once its cached listings expire, see
+    :class:`sanity_check.contents.manifest.BucketManifest`).
+
+    :param str canonical_bucket_name: S3 bucket with canonical data.
+    :return: A short hexadecimal digest.
+    :rtype: str
+
+    """
+    return objects_fingerprint(_list_canonical_objects(canonical_bucket_name))
+
+
+def pin_index_version(version: str) -> None:
+    """Make :func:`resolve_index` use a given version of the index instead of the latest one."""
+    os.environ[INDEX_VERSION_ENV] = version
+
+
+def _read_latest_version(bucket_dir: str) -> str:
+    latest_path = os.path.join(bucket_dir, LATEST_VERSION_FILE)
+    with fsspec.open(latest_path, "r", **_storage_options(latest_path)) as infile:
+        return infile.read().strip()
+
+
+def resolve_index(index_dir: str, canonical_bucket_name: str, version: str = None) -> str:
+    """Return the path of an index version (by default the latest one).
+
+    The latest version is used only if it is the current version of the
+    bucket (see :func:`bucket_version`): an index built before files were
+    added, removed or rewritten would silently give outdated results. A
+    `version` given explicitly is used as is, even if the bucket changed
+    since it was built, as is one pinned with :func:`pin_index_version`.
+
+    :param str index_dir: Root directory of the index (local or s3).
+    :param str canonical_bucket_name: S3 bucket the index was built from.
+    :param str version: Version of the index; if `None` the latest is used.
+    :return: Path of the directory containing the `issues` and `pages` tables.
+    :rtype: str
+    :raises ValueError: If the latest version of the index is not the
+        current version of the bucket.
+
+    """
+    bucket_dir = os.path.join(index_dir, split_bucket_name(canonical_bucket_name))
+    version = version or os.environ.get(INDEX_VERSION_ENV)
+    if version is None:
+        key = (index_dir, canonical_bucket_name)
+        if key not in _CHECKED_VERSIONS:
+            latest, current = _read_latest_version(bucket_dir), bucket_version(canonical_bucket_name)
+            if latest != current:
+                raise ValueError(
+                    f"The latest index of {canonical_bucket_name} in {index_dir} is version {latest}, but the bucket "
+                    f"is now at version {current}: rebuild the index with index.py, or pin it with --index-version"
+                )
+            _CHECKED_VERSIONS[key] = latest
+        version = _CHECKED_VERSIONS[key]
+    return os.path.join(bucket_dir, version)
+
+
+def build_index(canonical_bucket_name: str, index_dir: str, force: bool = False) -> str:
+    """Build the Parquet index of a canonical bucket.
+
+    :param str canonical_bucket_name: S3 bucket with canonical data.
+    :param str index_dir: Root directory of the index (local or s3).
+    :param bool force: Rebuild the index even if the current version exists.
+    :return: Path of the built index version.
+    :rtype: str
+
+    """
+    bucket = split_bucket_name(canonical_bucket_name)
+    objects = _list_canonical_objects(canonical_bucket_name)
+    version = objects_fingerprint(objects)
+    bucket_dir = os.path.join(index_dir, bucket)
+    version_dir = os.path.join(bucket_dir, version)
+    storage_options = _storage_options(index_dir)
+    fs, _, _ = fsspec.get_fs_token_paths(index_dir, storage_options=storage_options)
+
+    if fs.exists(os.path.join(version_dir, INDEX_METADATA_FILE)) and not force:
+        print(f"Index version {version} of {canonical_bucket_name} exists already ({version_dir})")
+        return version_dir
+
+    issue_files = [f"s3://{bucket}/{obj['key']}" for obj in objects if "/issues/" in obj["key"]]
+    page_files = [f"s3://{bucket}/{obj['key']}" for obj in objects if "/pages/" in obj["key"]]
+    print(f"Indexing {len(issue_files)} issue files and {len(page_files)} page files (version {version})")
+
+    issues_ddf = (
+        db.read_text(issue_files, storage_options=get_storage_options())
+        .filter(lambda line: line.strip())
+        .map(decode, fields=ISSUE_INDEX_FIELDS)
+        .filter(lambda issue: len(issue) > 0)
+        .map(issue_index_row)
+        .to_dataframe(meta=ISSUE_INDEX_META)
+    )
+    issues_ddf.to_parquet(
+        os.path.join(version_dir, "issues"),
+        partition_on=["newspaper"],
+        schema=_issue_index_schema(),
+        storage_options=storage_options,
+    )
+
+    pages_ddf = (
+        db.from_sequence(page_files, partition_size=100)
+        .map(read_text_file)
+        .flatten()
+        .map(extract_field, "id")
+        .filter(lambda page_id: page_id is not None)
+        .map(page_index_row)
+        .to_dataframe(meta=PAGE_INDEX_META)
+    )
+    pages_ddf.to_parquet(
+        os.path.join(version_dir, "pages"),
+        partition_on=["newspaper"],
+        storage_options=storage_options,
+    )
+
+    metadata = {
+        "bucket": canonical_bucket_name,
+        "version": version,
+        "created": datetime.now().isoformat(),
+        "n_issue_files": len(issue_files),
+        "n_page_files": len(page_files),
+    }
+    with fs.open(os.path.join(version_dir, INDEX_METADATA_FILE), "w") as outfile:
+        json.dump(metadata, outfile, indent=2)
+    with fs.open(os.path.join(bucket_dir, LATEST_VERSION_FILE), "w") as outfile:
+        outfile.write(version)
+
+    print(f"Written index of {canonical_bucket_name} to {version_dir}")
+    return version_dir
+
+
+def _index_newspapers(table_path: str) -> List[str]:
+    """List the newspapers partitions of an index table."""
+    fs, _, _ = fsspec.get_fs_token_paths(table_path, storage_options=_storage_options(table_path))
+    partitions = [os.path.basename(path.rstrip("/")) for path in fs.ls(table_path)]
+    return [partition.split("=", 1)[1] for partition in partitions if partition.startswith("newspaper=")]
+
+
+def read_index_table(
+    index_dir: str,
+    canonical_bucket_name: str,
+    table: str,
+    columns: list = None,
+    newspapers: List[str] = None,
+    years: Iterable[int] = None,
+    version: str = None,
+) -> dd.DataFrame:
+    """Read a table (`issues` or `pages`) of the index of a bucket (see :func:`resolve_index`).
+
+    :param str index_dir: Root directory of the index (local or s3).
+    :param str canonical_bucket_name: S3 bucket the index was built from.
+    :param str table: Name of the table.
+    :param list columns: Columns to read (all if `None`).
+    :param List[str] newspapers: Newspaper IDs or glob patterns; only the
+        partitions of these newspapers are read.
+    :param Iterable[int] years: Years to keep.
+    :param str version: Version of the index (default: the latest one).
+    :return: The table as a dask DataFrame.
+    :rtype: dd.DataFrame
+
+    """
+    assert table in ["issues", "pages"]
+    path = os.path.join(resolve_index(index_dir, canonical_bucket_name, version), table)
+
+    filters = []
+    if newspapers:
+        filters.append(("newspaper", "in", select_newspapers(_index_newspapers(path), newspapers)))
+    if years is not None:
+        filters.append(("year", "in", sorted(set(years))))
+
+    print(f"Reading {table} from index {path} (filters={filters})")
+    return dd.read_parquet(
+        path, columns=columns, filters=filters or None, storage_options=_storage_options(path)
+    )
+
+
+def read_index_partition(
+    version_dir: str, table: str, newspaper: str, columns: list, years: Iterable[int] = None
+) -> pd.DataFrame:
+    """Read the partition of one newspaper of an index table, in the calling process.
+
+    Unlike :func:`read_index_table`, no dask graph is built: this is meant to
+    be called from tasks working on a single newspaper.
+
+    :param str version_dir: Path of an index version (see :func:`resolve_index`).
+    :param str table: Name of the table (`issues` or `pages`).
+    :param str newspaper: Newspaper ID.
+    :param list columns: Columns to read.
+    :param Iterable[int] years: Years to keep.
+    :return: The rows of the newspaper (none if it has no partition).
+    :rtype: pd.DataFrame
+
+    """
+    path = os.path.join(version_dir, table, f"newspaper={newspaper}")
+    storage_options = _storage_options(path)
+    fs, _, _ = fsspec.get_fs_token_paths(path, storage_options=storage_options)
+    if not fs.exists(path):
+        return pd.DataFrame(columns=columns)
+
+    filters = [("year", "in", sorted(set(years)))] if years is not None else None
+    return pd.read_parquet(path, columns=columns, filters=filters, storage_options=storage_options or None)
+
+
+def read_newspaper_page_ids(version_dir: str, newspaper: str, years: Iterable[int] = None) -> Tuple[List[str], List[str]]:
+    """Read the page IDs listed in the issues of one newspaper, and those of its page JSON documents.
+
+    See :func:`read_index_partition`.
+    """
+    issues_df = read_index_partition(version_dir, "issues", newspaper, ["page_ids", "year"], years)
+    pages_df = read_index_partition(version_dir, "pages", newspaper, ["page_id", "year"], years)
+    return [page_id for page_ids in issues_df.page_ids for page_id in page_ids], list(pages_df.page_id)
+
+
+def _issue_from_index_row(row: dict) -> dict:
+    """Rebuild a skeleton issue JSON document from a row of the `issues` table."""
+    return {
+        "id": row["issue_id"],
+        "ar": row["access_rights"],
+        "pp": list(row["page_ids"]),
+        "i": [{"m": {"id": ci_id}} for ci_id in row["ci_ids"]],
+    }
+
+
+def _to_records(df) -> list:
+    return df.to_dict("records")
+
+
+def issues_from_index(
+    index_dir: str,
+    canonical_bucket_name: str,
+    newspapers: List[str] = None,
+    years: Iterable[int] = None,
+    version: str = None,
+) -> db.Bag:
+    """Fetch issues from the index, as skeleton issue JSON documents.
+
+    Documents contain only the fields stored in the index, i.e. `id`, `ar`,
+    `pp` and the content item IDs (`i[*].m.id`).
+    """
+    issues_ddf = read_index_table(
+        index_dir,
+        canonical_bucket_name,
+        "issues",
+        ["issue_id", "access_rights", "page_ids", "ci_ids"],
+        newspapers,
+        years,
+        version,
+    )
+    return db.from_delayed([delayed(_to_records)(part) for part in issues_ddf.to_delayed()]).map(
+        _issue_from_index_row
+    )
+
+
+def _read_newspaper_issues(newspaper: str, version_dir: str, years: Iterable[int] = None) -> List[dict]:
+    issues_df = read_index_partition(
+        version_dir, "issues", newspaper, ["issue_id", "access_rights", "page_ids", "ci_ids"], years
+    )
+    return [_issue_from_index_row(row) for row in _to_records(issues_df)]
+
+
+def issues_by_newspaper(
+    index_dir: str,
+    canonical_bucket_name: str,
+    newspapers: List[str] = None,
+    years: Iterable[int] = None,
+    version: str = None,
+) -> db.Bag:
+    """Fetch issues from the index, with one partition per newspaper.
+
+    Each partition holds all the issues of a newspaper, read by its task (see
+    :func:`read_index_partition`), so that checks can compact their partial
+    results newspaper by newspaper (see `whole_newspapers` in
+    :func:`sanity_check.contents.scan.scan_issues`). Documents are the same
+    as those of :func:`issues_from_index`.
+    """
+    version_dir = resolve_index(index_dir, canonical_bucket_name, version)
+    selected = sorted(select_newspapers(_index_newspapers(os.path.join(version_dir, "issues")), newspapers))
+    print(f"Reading the issues of {len(selected)} newspapers from index {version_dir}")
+    return db.from_sequence(selected, npartitions=max(len(selected), 1)).map(
+        _read_newspaper_issues, version_dir, years=years
+    ).flatten()
+
+
+def issue_ids_from_index(
+    index_dir: str,
+    canonical_bucket_name: str,
+    newspapers: List[str] = None,
+    years: Iterable[int] = None,
+    version: str = None,
+) -> db.Bag:
+    """Fetch issue IDs from the index."""
+    issues_ddf = read_index_table(index_dir, canonical_bucket_name, "issues", ["issue_id"], newspapers, years, version)
+    return issues_ddf.issue_id.to_bag()
+
+
+def page_ids_from_index(
+    index_dir: str,
+    canonical_bucket_name: str,
+    newspapers: List[str] = None,
+    years: Iterable[int] = None,
+    version: str = None,
+) -> db.Bag:
+    """Fetch the IDs of pages with a page JSON document from the index."""
+    pages_ddf = read_index_table(index_dir, canonical_bucket_name, "pages", ["page_id"], newspapers, years, version)
+    return pages_ddf.page_id.to_bag()
+
+
+def main():
+    arguments = docopt(__doc__)
+    s3_canonical_bucket = arguments["--canonical-bucket"]
+    index_dir = arguments["--index-dir"]
+    force = arguments["--force"]
+    executor = arguments["--executor"]
+    memory = arguments["--k8-memory"]
+    workers = int(arguments["--k8-workers"]) if arguments["--k8-workers"] else None
+
+    if arguments["--manifest-dir"]:
+        max_age = arguments["--manifest-max-age"]
+        enable_manifest_cache(arguments["--manifest-dir"], float(max_age) if max_age else None)
+
+    # nothing to plan if the resources are given
+    plan = None
+    if executor != "threads" and not (memory and workers):
+        plan = plan_resources(
+            [
+                StageEstimate("issues", list_newspaper_file_sizes(s3_canonical_bucket, "{np}/issues/")),
+                StageEstimate("pages", list_newspaper_file_sizes(s3_canonical_bucket, "{np}/pages/")),
+            ]
+        )
+
+    with dask_executor(executor, memory, workers, plan):
+        build_index(s3_canonical_bucket, index_dir, force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Persistent local manifest of s3 bucket listings.
+
+The manifest stores, for each listed prefix of a bucket, the key, size, ETag
+and last modification date of every object under it. It is kept on disk so
+that each run can tell which prefixes changed since the previous one (new,
+removed or rewritten objects), and so that a run lists each prefix only
+once, however many times its commands list it.
+
+The listing functions of :mod:`sanity_check.contents.s3_data` use the
+manifest as soon as a manifest directory is configured, either with
+:func:`enable_manifest_cache` or via the `IMPRESSO_MANIFEST_DIR` (and
+`IMPRESSO_MANIFEST_MAX_AGE`) environment variables.
+"""
+
+import gzip
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+MANIFEST_DIR_ENV = "IMPRESSO_MANIFEST_DIR"
+MANIFEST_MAX_AGE_ENV = "IMPRESSO_MANIFEST_MAX_AGE"
+MANIFEST_FILENAME = "_manifest.json.gz"
+
+# by default cached listings are reused for an hour, e.g. by the successive
+# commands of a pipeline: objects written meanwhile are not seen until then
+DEFAULT_MAX_AGE = 3600
+
+# listings made since this module was imported are up to date for this run
+_RUN_STARTED_AT = time.time()
+
+
+def enable_manifest_cache(manifest_dir: str, max_age: Optional[float] = None) -> None:
+    """Make the listing functions in `s3_data` use an on-disk manifest.
+
+    :param str manifest_dir: Directory where manifests are stored.
+    :param float max_age: Number of seconds during which a cached listing is
+        reused without listing its prefix again (default:
+        :data:`DEFAULT_MAX_AGE`; 0 means once per run).
+    """
+    os.environ[MANIFEST_DIR_ENV] = manifest_dir
+    if max_age is not None:
+        os.environ[MANIFEST_MAX_AGE_ENV] = str(max_age)
+
+
+def manifest_from_env(bucket_name: str, s3_client=None) -> Optional["BucketManifest"]:
+    """Return the manifest of `bucket_name` if a manifest directory is configured."""
+    manifest_dir = os.environ.get(MANIFEST_DIR_ENV)
+    if not manifest_dir:
+        return None
+
+    max_age = float(os.environ.get(MANIFEST_MAX_AGE_ENV, DEFAULT_MAX_AGE))
+    return BucketManifest(bucket_name, manifest_dir, max_age=max_age, s3_client=s3_client)
+
+
+def _object_entry(obj: dict) -> dict:
+    last_modified = obj.get("LastModified")
+    return {
+        "key": obj["Key"],
+        "size": obj["Size"],
+        "etag": obj.get("ETag", "").strip('"'),
+        "last_modified": last_modified.isoformat() if last_modified is not None else None,
+    }
+
+
+def _signature(objects: List[dict]) -> List[tuple]:
+    # `last_modified` is left out: it changes when an identical object is uploaded again
+    return [(obj["key"], obj["size"], obj["etag"]) for obj in objects]
+
+
+class BucketManifest:
+    """On-disk manifest of (key, size, ETag, LastModified) of an s3 bucket.
+
+    Listings are stored per prefix (e.g. `GDL/issues/`) in
+    `<manifest_dir>/<bucket>/<prefix>/_manifest.json.gz`.
+
+    A cached prefix is listed again unless it was listed during this run or
+    less than `max_age` seconds ago, and the new listing is compared with the
+    cached one (number of objects, keys, sizes and ETags): added, removed and
+    rewritten objects are all detected. Canonical prefixes hold one file per
+    newspaper and year, so listing one takes about as many requests as a
+    probe would (and a probe from the last cached key, e.g. with
+    `StartAfter`, would miss rewritten objects and keys inserted before it).
+
+    Within `max_age`, no request is made at all: objects added, removed or
+    rewritten since a prefix was listed are not seen. Listings that must
+    reflect the current state of the bucket (e.g. the ETags of incremental
+    checks, see :func:`sanity_check.contents.state.newspaper_etags`) bypass
+    the manifest.
+    """
+
+    def __init__(self, bucket_name: str, manifest_dir: str, max_age: float = DEFAULT_MAX_AGE, s3_client=None):
+        # imported here to avoid a circular import
+        from sanity_check.contents.s3_data import split_bucket_name
+
+        self.bucket = split_bucket_name(bucket_name)
+        self.manifest_dir = manifest_dir
+        self.max_age = max_age
+        self._s3_client = s3_client
+        self._listings = {}
+
+    def __repr__(self):
+        return f"<BucketManifest bucket={self.bucket} dir={self.manifest_dir} max_age={self.max_age}>"
+
+    @property
+    def s3_client(self):
+        if self._s3_client is None:
+            from sanity_check.contents.s3_data import get_s3_client
+
+            self._s3_client = get_s3_client()
+        return self._s3_client
+
+    def _prefix_path(self, prefix: str) -> str:
+        return os.path.join(self.manifest_dir, self.bucket, prefix, MANIFEST_FILENAME)
+
+    def load(self, prefix: str) -> Optional[dict]:
+        """Load the cached listing of a prefix (`None` if never listed)."""
+        if prefix in self._listings:
+            return self._listings[prefix]
+
+        path = self._prefix_path(prefix)
+        if not os.path.exists(path):
+            return None
+
+        with gzip.open(path, "rt", encoding="utf-8") as infile:
+            listing = json.load(infile)
+        self._listings[prefix] = listing
+        return listing
+
+    def save(self, prefix: str, listing: dict) -> None:
+        path = self._prefix_path(prefix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file first, so that an interrupted run
+        # does not leave a truncated manifest behind
+        # (unique to each writer, as processes may share the manifest)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as outfile:
+            json.dump(listing, outfile)
+        os.replace(tmp_path, path)
+        self._listings[prefix] = listing
+
+    def is_current(self, prefix: str) -> bool:
+        """Tell whether the cached listing of a prefix can be used without listing it again."""
+        listing = self.load(prefix)
+        if listing is None:
+            return False
+        listed_at = listing["listed_at"]
+        return listed_at >= _RUN_STARTED_AT or time.time() - listed_at < self.max_age
+
+    def relist(self, prefix: str) -> bool:
+        """List a prefix from s3 and update its cached listing.
+
+        :param str prefix: Prefix to list.
+        :return: Whether the listing differs from the cached one (or there
+            was none).
+        :rtype: bool
+
+        """
+        # imported here to avoid a circular import
+        from sanity_check.contents.s3_data import list_keys
+
+        cached = self.load(prefix)
+        objects = sorted(
+            (_object_entry(obj) for obj in list_keys(self.bucket, prefix, self.s3_client)),
+            key=lambda obj: obj["key"],
+        )
+        self.save(prefix, {"prefix": prefix, "listed_at": time.time(), "objects": objects})
+        return cached is None or _signature(cached["objects"]) != _signature(objects)
+
+    def refresh(self, prefixes: List[str], max_workers: int = 8) -> List[str]:
+        """Bring the listings of the given prefixes up to date.
+
+        :param List[str] prefixes: Prefixes to refresh.
+        :param int max_workers: Maximum number of concurrent listings.
+        :return: The prefixes whose listing changed (or that were never
+            listed before).
+        :rtype: List[str]
+
+        """
+        stale = [prefix for prefix in sorted(prefixes) if not self.is_current(prefix)]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            changed = [prefix for prefix, diff in zip(stale, executor.map(self.relist, stale)) if diff]
+
+        LOGGER.info(
+            f"Manifest of {self.bucket}: listed {len(stale)}/{len(prefixes)} prefixes, {len(changed)} changed"
+        )
+        return changed
+
+    def objects(self, prefixes: List[str], refresh: bool = True) -> List[dict]:
+        """Return the manifest entries of all objects under the given prefixes.
+
+        :param List[str] prefixes: Prefixes whose objects should be returned.
+        :param bool refresh: Whether to refresh stale prefixes first.
+        :return: Entries with `key`, `size`, `etag` and `last_modified`.
+        :rtype: List[dict]
+
+        """
+        if refresh:
+            self.refresh(prefixes)
+
+        return [
+            obj
+            for prefix in sorted(prefixes)
+            for obj in (self.load(prefix) or {"objects": []})["objects"]
+            if not obj["key"].endswith("/")
+        ]
@@ -1,61 +1,205 @@
-"""Functions to fetch impresso data from MySQL DB."""
+"""Functions to fetch impresso data from MySQL DB.
 
-import os
+Each process (client or dask worker) opens one pooled engine per DB
+configuration (see :func:`get_engine`), and rows are streamed with
+server-side cursors instead of being fetched all at once.
 
+Large tables (e.g. `content_items`) are never listed by the client: they are
+split into ranges of primary keys, one per newspaper (or newspaper and year),
+and each partition of the resulting dask bag is fetched by a worker (see
+:func:`fetch_ids`). Since IDs start with the newspaper ID and the year, these
+ranges are index range scans. Their newspapers are those of the table itself
+(see :func:`list_table_newspapers`), so that the IDs of a newspaper missing
+from `np_timespan_v` are not left out.
 
-def list_newspapers(db_config=None):
-    if db_config:
-        os.environ["IMPRESSO_DB_CONFIG"] = db_config
+Aggregates (e.g. the number of content items per newspaper and year, see
+:func:`content_item_counts`) can also be computed by the database itself.
+
+Queries are plain SQL, so that they also run on the local SQLite/DuckDB
+stand-ins of the MySQL DB (see :mod:`sanity_check.contents.db_backends`).
+"""
+
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from dask import bag as db
+
+from sanity_check.contents.db_backends import FETCH_SIZE, get_backend
+
+# number of content items per newspaper and year, derived from their IDs
+# (e.g. `GDL-1900-01-01-a-i0001`); valid SQL for MySQL, SQLite and DuckDB
+CONTENT_ITEM_COUNTS_QUERY = """
+SELECT substr(id, 1, instr(id, '-') - 1) AS newspaper,
+       substr(id, instr(id, '-') + 1, 4) AS year,
+       COUNT(*) AS count
+FROM content_items
+GROUP BY newspaper, year
+ORDER BY newspaper, year;
+"""
+
+# first ID of a table from a given key: one index lookup
+FIRST_ID_QUERY = "SELECT id FROM {table} WHERE id >= :low ORDER BY id LIMIT 1;"
+
+
+def get_engine(db_config: str = None):
+    """Return the pooled SQLAlchemy engine of a MySQL DB configuration (e.g. "dev", "prod").
+
+    `impresso_db` creates its engine from the `IMPRESSO_DB_CONFIG` environment
+    variable when imported: it is (re)imported once per configuration and
+    process, and the engine is then reused, together with its connection pool
+    (see :class:`sanity_check.contents.db_backends.MySQLBackend`).
+    """
+    return get_backend(db_config).engine
+
+
+def iter_rows(query: str, params: dict = None, db_config: str = None, fetch_size: int = FETCH_SIZE) -> Iterator[tuple]:
+    """Stream the rows of a query with a server-side cursor.
+
+    :param str query: SQL query, with named parameters (e.g. `:low`).
+    :param dict params: Values of the parameters of the query.
+    :param str db_config: DB configuration to use (e.g. "dev", "prod", or the
+        path of a local DB, see :mod:`sanity_check.contents.db_backends`).
+    :param int fetch_size: Number of rows fetched at a time.
+    :return: The rows of the query.
+    :rtype: Iterator[tuple]
+
+    """
+    return get_backend(db_config).iter_rows(query, params, fetch_size)
+
+
+def key_ranges(newspapers: Iterable[str], years: Optional[Iterable[int]] = None) -> List[Tuple[str, str]]:
+    """Split a table whose IDs start with the newspaper ID (and year) into key ranges.
+
+    E.g. `["GDL"]` => `[("GDL-", "GDL.")]` (all IDs starting with `GDL-`),
+    and `["GDL"], [1900]` => `[("GDL-1900", "GDL-1901")]`.
+
+    :return: Ranges `(low, high)` of IDs such that `low <= id < high`.
+    :rtype: List[Tuple[str, str]]
 
-    config = os.environ["IMPRESSO_DB_CONFIG"]
-    print(f'Connecting to MySQL DB {config}')
+    """
+    if years is None:
+        # "." is the character following "-"
+        return [(f"{np}-", f"{np}.") for np in newspapers]
+    return [(f"{np}-{year}", f"{np}-{year + 1}") for np in newspapers for year in sorted(set(years))]
 
-    #
-    from impresso_db.base import engine
 
-    with engine.connect() as db_conn:
-        q = "SELECT newspaper_id FROM np_timespan_v;"
-        mysql_ids = db_conn.execute(q)
+def iter_ids(table: str, key_range: Tuple[str, str], db_config: str = None) -> Iterator[str]:
+    """Stream the IDs of a table within a key range, in sorted order."""
+    low, high = key_range
+    query = f"SELECT id FROM {table} WHERE id >= :low AND id < :high ORDER BY id;"
+    for row in iter_rows(query, {"low": low, "high": high}, db_config):
+        yield row[0]
 
-    np_ids = [db_id[0] for db_id in mysql_ids]
-    print(f'Fetched {len(np_ids)} content item IDs from DB')
+
+def read_ids(table: str, key_range: Tuple[str, str], db_config: str = None) -> List[str]:
+    """Fetch the IDs of a table within a key range (run by a worker)."""
+    return list(iter_ids(table, key_range, db_config))
+
+
+def list_table_newspapers(table: str, db_config: str = None) -> List[str]:
+    """List the newspapers of the IDs of a table (e.g. `content_items`), in sorted order.
+
+    The table is not scanned: the first ID of each newspaper is looked up in
+    the index of the table, from the end of the previous newspaper (one
+    lookup per newspaper).
+    """
+    np_ids, low = [], ""
+    while True:
+        rows = list(iter_rows(FIRST_ID_QUERY.format(table=table), {"low": low}, db_config))
+        if not rows:
+            break
+        newspaper = rows[0][0].split("-")[0]
+        if newspaper == rows[0][0]:
+            raise ValueError(f"Cannot derive the newspaper of {rows[0][0]} (from {table})")
+        np_ids.append(newspaper)
+        low = key_ranges([newspaper])[0][1]
+    print(f'Found {len(np_ids)} newspapers in {table}')
     return np_ids
 
 
-def list_issues(db_config=None):
-    if db_config:
-        os.environ["IMPRESSO_DB_CONFIG"] = db_config
+def _newspaper_key_ranges(table: str, db_config: str = None, newspapers: List[str] = None, years: List[int] = None):
+    # imported here to avoid a circular import
+    from sanity_check.contents.s3_data import select_newspapers
 
-    config = os.environ["IMPRESSO_DB_CONFIG"]
-    print(f'Connecting to MySQL DB {config}')
+    return key_ranges(select_newspapers(list_table_newspapers(table, db_config), newspapers), years)
 
-    #
-    from impresso_db.base import engine
 
-    with engine.connect() as db_conn:
-        q = "SELECT id FROM issues;"
-        mysql_ids = db_conn.execute(q)
+def fetch_ids(table: str, db_config: str = None, newspapers: List[str] = None, years: List[int] = None) -> db.Bag:
+    """Fetch the IDs of a table as a dask bag, with one partition per key range.
 
-    issue_ids = [db_id[0] for db_id in mysql_ids]
-    print(f'Fetched {len(issue_ids)} issue IDs from DB')
-    return issue_ids
+    Partitions are fetched by the workers themselves: the client only lists
+    the newspapers of the table (see :func:`list_table_newspapers`).
 
+    :param str table: Name of the table (e.g. `content_items`).
+    :param str db_config: DB configuration to use (e.g. "dev", "prod", etc.).
+    :param list newspapers: Newspaper IDs or glob patterns to restrict the IDs to (optional).
+    :param list years: Years to restrict the IDs to (optional); each year of
+        each newspaper is then a separate partition.
+    :return: A bag of IDs.
+    :rtype: db.Bag
 
-def list_content_items(db_config=None):
-    if db_config:
-        os.environ["IMPRESSO_DB_CONFIG"] = db_config
+    """
+    ranges = _newspaper_key_ranges(table, db_config, newspapers, years)
+    print(f'Fetching IDs of {table} in {len(ranges)} key ranges')
+    return db.from_sequence(ranges, npartitions=max(len(ranges), 1)).map(
+        lambda key_range: read_ids(table, key_range, db_config)
+    ).flatten()
 
-    config = os.environ["IMPRESSO_DB_CONFIG"]
-    print(f'Connecting to MySQL DB {config}')
 
-    #
-    from impresso_db.base import engine
+def list_newspapers(db_config=None):
+    np_ids = [row[0] for row in iter_rows("SELECT newspaper_id FROM np_timespan_v;", db_config=db_config)]
+    print(f'Fetched {len(np_ids)} newspaper IDs from DB')
+    return np_ids
 
-    with engine.connect() as db_conn:
-        print(f'Fetching content item IDs from MySQL DB {config}')
-        q = "SELECT id FROM content_items;"
-        mysql_ids = db_conn.execute(q)
 
-    ci_ids = [db_id[0] for db_id in mysql_ids]
+def list_issues(db_config=None, newspapers=None, years=None):
+    """List issue IDs (restricted to some newspapers and years, if given)."""
+    if newspapers is None and years is None:
+        issue_ids = [row[0] for row in iter_rows("SELECT id FROM issues;", db_config=db_config)]
+    else:
+        issue_ids = [
+            issue_id
+            for key_range in _newspaper_key_ranges("issues", db_config, newspapers, years)
+            for issue_id in read_ids("issues", key_range, db_config)
+        ]
+    print(f'Fetched {len(issue_ids)} issue IDs from DB')
+    return issue_ids
+
+
+def list_content_items(db_config=None):
+    """List all content item IDs on the client.
+
+    ..note::
+        Use :func:`fetch_ids` to process content item IDs with dask: they
+        are then fetched by the workers, and never held by the client.
+    """
+    ci_ids = [row[0] for row in iter_rows("SELECT id FROM content_items;", db_config=db_config)]
     print(f'Fetched {len(ci_ids)} IDs.')
     return ci_ids
+
+
+def content_item_counts(db_config: str = None, db_conn=None) -> List[Tuple[str, str, int]]:
+    """Count the content items of each newspaper and year with a grouped query.
+
+    Only one row per newspaper and year is sent back by the database.
+
+    :param str db_config: DB configuration to use (e.g. "dev", "prod", etc.).
+    :param db_conn: DB-API connection to use instead (e.g. `sqlite3`).
+    :return: Tuples `(newspaper, year, count)`, sorted by newspaper and year.
+    :rtype: List[Tuple[str, str, int]]
+
+    """
+    if db_conn is None:
+        backend = get_backend(db_config)
+        print(f'Counting content items by newspaper and year in {backend}')
+        db_conn = backend.connect()
+        try:
+            return content_item_counts(db_conn=db_conn)
+        finally:
+            db_conn.close()
+
+    cursor = db_conn.cursor()
+    try:
+        cursor.execute(CONTENT_ITEM_COUNTS_QUERY)
+        return [(newspaper, str(year), int(count)) for newspaper, year, count in cursor.fetchall()]
+    finally:
+        cursor.close()
@@ -1,46 +1,154 @@
 """Functions to fetch impresso data from S3 storage."""
 
-from impresso_commons.utils.s3 import (
-    get_s3_client,
-    alternative_read_text,
-    IMPRESSO_STORAGEOPT,
-)
-from impresso_commons.utils.s3 import fixed_s3fs_glob
+from impresso_commons.utils.s3 import IMPRESSO_STORAGEOPT
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 from dask import bag as db
-import json
+from fnmatch import fnmatch
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import boto3
+import fsspec
 import logging
 import os
+import re
+import threading
+
+from sanity_check.contents.decoding import decode, extract_field
 
 S3_CANONICAL_DATA_BUCKET = "s3://original-canonical-fixed"
 S3_REBUILT_DATA_BUCKET = "s3://canonical-rebuilt"
 
+# above this number of selected years, newspapers are listed as a whole
+# and files are filtered by year afterwards
+MAX_YEAR_PREFIXES = 10
+
+# e.g. `GDL-1900-issues.jsonl.bz2`, `GDL-1900-01-01-a-pages.jsonl.bz2`
+FILENAME_PATTERN = re.compile(r"^([^-]+)-(\d{4})")
+
+# size of the HTTP connection pool of the s3 client of each process
+S3_POOL_SIZE_ENV = "IMPRESSO_S3_POOL_SIZE"
+DEFAULT_S3_POOL_SIZE = 32
+
 LOGGER = logging.getLogger(__name__)
 
+# one s3 client per process (clients must not be shared across a fork)
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+
+def _s3_pool_size() -> int:
+    return int(os.environ.get(S3_POOL_SIZE_ENV, DEFAULT_S3_POOL_SIZE))
+
+
+def get_s3_client():
+    """Return the s3 client of the current process, creating it on first use.
+
+    The client is built from `IMPRESSO_STORAGEOPT` with a connection pool of
+    `IMPRESSO_S3_POOL_SIZE` connections (32 by default), and is shared by all
+    the threads of the process. Nothing is created at import time, so that
+    importing this module (e.g. in dask workers unpickling tasks) does not
+    touch credentials or the network.
+    """
+    key = (os.getpid(), _s3_pool_size())
+    client = _s3_clients.get(key)
+    if client is not None:
+        return client
+
+    with _s3_clients_lock:
+        if key not in _s3_clients:
+            session = boto3.session.Session(
+                aws_access_key_id=IMPRESSO_STORAGEOPT["key"],
+                aws_secret_access_key=IMPRESSO_STORAGEOPT["secret"],
+            )
+            _s3_clients[key] = session.client(
+                "s3",
+                endpoint_url=IMPRESSO_STORAGEOPT["client_kwargs"]["endpoint_url"],
+                config=Config(max_pool_connections=key[1]),
+            )
+            LOGGER.debug(f"Created s3 client for process {key[0]} (pool size {key[1]})")
+        return _s3_clients[key]
+
+
+def get_storage_options() -> dict:
+    """Return the s3fs storage options to read impresso data.
+
+    Same as `IMPRESSO_STORAGEOPT`, with the connection pool size of
+    :func:`get_s3_client`. s3fs caches its filesystem instances per process
+    and options, so all the reads of a worker share one connection pool.
+    """
+    options = dict(IMPRESSO_STORAGEOPT)
+    options["config_kwargs"] = dict(
+        options.get("config_kwargs", {}), max_pool_connections=_s3_pool_size()
+    )
+    return options
+
+
+def read_text_file(path: str) -> List[str]:
+    """Read the lines of a (possibly compressed) text file stored on s3.
+
+    Unlike `impresso_commons.utils.s3.alternative_read_text`, which opens a
+    new boto session for each file, the connection pool of the process is
+    reused (see :func:`get_storage_options`).
+    """
+    with fsspec.open(
+        path, "rt", compression="infer", encoding="utf-8", **get_storage_options()
+    ) as infile:
+        return infile.readlines()
+
+
+def iter_text_lines(path: str) -> Iterator[str]:
+    """Stream the lines of a (possibly compressed) text file stored on s3.
+
+    Unlike :func:`read_text_file`, the decompressed file is never held in
+    memory as a whole.
+    """
+    with fsspec.open(path, "rt", compression="infer", encoding="utf-8", **get_storage_options()) as infile:
+        yield from infile
+
+
+def split_bucket_name(bucket_name: str) -> str:
+    """Return the bare bucket name (e.g. `s3://bucket/a/b` => `bucket`)."""
+    return bucket_name.replace("s3://", "").split("/")[0]
+
 
 def list_newspapers(
     bucket_name: str = S3_CANONICAL_DATA_BUCKET,
-    s3_client=get_s3_client(),
+    s3_client=None,
     page_size: int = 10000,
+    delimited: bool = True,
 ):
     """List newspapers contained in an s3 bucket with impresso data.
 
+    By default newspapers are found by means of a delimiter-based listing,
+    which returns only the common prefixes at the top level of the bucket
+    (one per newspaper) instead of every key in it. With `delimited=False`
+    all keys are paged through and their first path segment is collected.
+
     ..note::
         25,000 seems to be the maximum `PageSize` value supported by
         SwitchEngines' S3 implementation (ceph).
     """
     print(f"Fetching list of newspapers from {bucket_name}")
 
-    original_bucket_name = bucket_name
+    if s3_client is None:
+        s3_client = get_s3_client()
 
-    if "s3://" in bucket_name:
-        bucket_name = bucket_name.replace("s3://", "").split("/")[0]
+    bucket_name = split_bucket_name(bucket_name)
 
     paginator = s3_client.get_paginator("list_objects")
+    pagination_args = {"Bucket": bucket_name, "PaginationConfig": {"PageSize": page_size}}
+    if delimited:
+        pagination_args["Delimiter"] = "/"
 
     newspapers = set()
-    for n, resp in enumerate(
-        paginator.paginate(Bucket=bucket_name, PaginationConfig={"PageSize": page_size})
-    ):
+    for n, resp in enumerate(paginator.paginate(**pagination_args)):
+
+        if delimited:
+            for prefix in resp.get("CommonPrefixes", []):
+                newspapers.add(prefix["Prefix"].rstrip("/"))
+            continue
+
         # means the bucket is empty
         if "Contents" not in resp:
             continue
@@ -54,68 +162,266 @@ def list_newspapers(
     return newspapers
 
 
-def list_issues(bucket_name=S3_CANONICAL_DATA_BUCKET):
-    if bucket_name:
-        newspapers = list_newspapers(bucket_name)
-    else:
-        newspapers = list_newspapers()
-    issue_files = [
-        file
-        for np in newspapers
-        for file in fixed_s3fs_glob(f"{os.path.join(bucket_name, f'{np}/issues/*')}")
+def list_keys(
+    bucket_name: str, prefix: str, s3_client=None, page_size: int = 10000
+) -> List[dict]:
+    """List all objects in an s3 bucket whose key starts with `prefix`.
+
+    :param str bucket_name: Name of the s3 bucket (with or without `s3://`).
+    :param str prefix: Key prefix to list (e.g. `GDL/issues/`).
+    :param s3_client: boto3 s3 client to use.
+    :param int page_size: Number of keys requested per page.
+    :return: The object summaries returned by S3 (`Key`, `Size`, `ETag`,
+        `LastModified`, ...).
+    :rtype: List[dict]
+
+    """
+    if s3_client is None:
+        s3_client = get_s3_client()
+
+    paginator = s3_client.get_paginator("list_objects")
+    objects = []
+    for resp in paginator.paginate(
+        Bucket=split_bucket_name(bucket_name),
+        Prefix=prefix,
+        PaginationConfig={"PageSize": page_size},
+    ):
+        objects += resp.get("Contents", [])
+    return objects
+
+
+def list_prefix_objects(
+    bucket_name: str, prefixes: List[str], s3_client=None, max_workers: int = 8, use_manifest: bool = True
+) -> List[dict]:
+    """List concurrently the objects under several prefixes of an s3 bucket.
+
+    Each prefix is listed by a separate thread of a bounded pool, sharing the
+    same (thread-safe) s3 client. If a manifest directory is configured (see
+    :mod:`sanity_check.contents.manifest`), prefixes already listed during
+    this run (or less than its `max_age` ago) are read from the manifest.
+
+    :param str bucket_name: Name of the s3 bucket (with or without `s3://`).
+    :param List[str] prefixes: Key prefixes to list (e.g. `GDL/issues/`).
+    :param s3_client: boto3 s3 client to use.
+    :param int max_workers: Maximum number of concurrent listings.
+    :param bool use_manifest: Whether the manifest may be used (listings
+        that must reflect objects overwritten in place, e.g. to compare
+        ETags, should bypass it).
+    :return: One entry per object, with `key`, `size`, `etag` and
+        `last_modified`.
+    :rtype: List[dict]
+
+    """
+    # imported here to avoid a circular import
+    from sanity_check.contents.manifest import manifest_from_env, _object_entry
+
+    manifest = manifest_from_env(bucket_name, s3_client) if use_manifest else None
+    if manifest is not None:
+        return manifest.objects(prefixes)
+
+    if s3_client is None:
+        s3_client = get_s3_client()
+
+    bucket = split_bucket_name(bucket_name)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        listings = executor.map(
+            lambda prefix: list_keys(bucket, prefix, s3_client), sorted(prefixes)
+        )
+        return [
+            _object_entry(obj)
+            for objects in listings
+            for obj in objects
+            if not obj["Key"].endswith("/")
+        ]
+
+
+def list_prefixes(
+    bucket_name: str, prefixes: List[str], s3_client=None, max_workers: int = 8
+) -> List[str]:
+    """List the s3 paths (`s3://bucket/key`) of objects under several prefixes.
+
+    See :func:`list_prefix_objects`.
+    """
+    bucket = split_bucket_name(bucket_name)
+    return [
+        f"s3://{bucket}/{obj['key']}"
+        for obj in list_prefix_objects(bucket_name, prefixes, s3_client, max_workers)
     ]
+
+
+def select_newspapers(newspapers: Iterable[str], selection: Optional[List[str]] = None) -> List[str]:
+    """Keep only the newspapers matching a selection of IDs or glob patterns.
+
+    :param Iterable[str] newspapers: Newspaper IDs (e.g. as listed in a bucket).
+    :param List[str] selection: Newspaper IDs or glob patterns (e.g. `BL*`);
+        all newspapers are kept if `None` or empty.
+    :return: The selected newspaper IDs, sorted.
+    :rtype: List[str]
+
+    """
+    if not selection:
+        return sorted(newspapers)
+    return sorted(np for np in newspapers if any(fnmatch(np, pattern) for pattern in selection))
+
+
+def path_newspaper_year(path: str) -> Tuple[Optional[str], Optional[int]]:
+    """Derive newspaper ID and year from the name of an impresso data file.
+
+    E.g. `s3://bucket/GDL/issues/GDL-1900-issues.jsonl.bz2` => `("GDL", 1900)`.
+    """
+    match = FILENAME_PATTERN.match(os.path.basename(path))
+    if not match:
+        return None, None
+    return match.group(1), int(match.group(2))
+
+
+def files_by_newspaper_year(paths: Iterable[str]) -> Dict[Tuple[str, int], List[str]]:
+    """Group impresso data files by newspaper and year (see :func:`path_newspaper_year`).
+
+    Files whose name does not follow the impresso naming scheme are left out.
+    """
+    files = {}
+    for path in paths:
+        newspaper, year = path_newspaper_year(path)
+        if newspaper is not None:
+            files.setdefault((newspaper, year), []).append(path)
+    return files
+
+
+def filter_files(
+    paths: List[str], newspapers: Optional[List[str]] = None, years: Optional[Iterable[int]] = None
+) -> List[str]:
+    """Keep only the files of the selected newspapers and years.
+
+    This is meant for listings that cannot be restricted by prefix (e.g. flat
+    buckets); files whose name does not follow the impresso naming scheme
+    are kept.
+    """
+    if not newspapers and years is None:
+        return paths
+
+    years = set(years) if years is not None else None
+    selected = []
+    for path in paths:
+        np, year = path_newspaper_year(path)
+        if np is None:
+            selected.append(path)
+        elif (not newspapers or select_newspapers([np], newspapers)) and (years is None or year in years):
+            selected.append(path)
+    return selected
+
+
+def list_file_sizes(
+    s3_path: str,
+    suffix: str = ".bz2",
+    newspapers: Optional[List[str]] = None,
+    years: Optional[Iterable[int]] = None,
+) -> List[Tuple[str, int]]:
+    """List the files directly under an s3 path, with their size in bytes.
+
+    E.g. `s3://canonical-rebuilt` => `[("s3://canonical-rebuilt/GDL-1900.jsonl.bz2", 12345), ...]`.
+    Sizes are needed to split large files into chunks read in parallel (see
+    :mod:`sanity_check.contents.bz2_chunks`).
+    """
+    bucket = split_bucket_name(s3_path)
+    prefix = s3_path.replace("s3://", "")[len(bucket) :].strip("/")
+    prefix = f"{prefix}/" if prefix else ""
+
+    sizes = {
+        f"s3://{bucket}/{obj['key']}": obj["size"]
+        for obj in list_prefix_objects(bucket, [prefix])
+        if obj["key"].endswith(suffix) and "/" not in obj["key"][len(prefix) :]
+    }
+    return [(path, sizes[path]) for path in filter_files(sorted(sizes), newspapers, years)]
+
+
+def _listing_prefixes(newspapers: List[str], base: str, years: Optional[Iterable[int]] = None) -> List[str]:
+    """Build the prefixes to list for the given newspapers and years.
+
+    `base` is a template such as `{np}/issues/`. When only a few years are
+    selected, one prefix per newspaper and year is returned (e.g.
+    `GDL/issues/GDL-1900`), so that other years are never listed.
+    """
+    if years is None or len(set(years)) > MAX_YEAR_PREFIXES:
+        return [base.format(np=np) for np in newspapers]
+    return [f"{base.format(np=np)}{np}-{year}" for np in newspapers for year in sorted(set(years))]
+
+
+def list_newspaper_objects(
+    bucket_name: str, base: str, newspapers: Optional[List[str]] = None, years: Optional[Iterable[int]] = None
+) -> List[dict]:
+    """List the files of the selected newspapers and years, with their `key`, `size`, `etag` and `last_modified`.
+
+    `base` is the template of the prefix of each newspaper (e.g.
+    `{np}/issues/`, see :func:`_listing_prefixes`).
+    """
+    selected_newspapers = select_newspapers(list_newspapers(bucket_name), newspapers)
+    objects = {
+        obj["key"]: obj for obj in list_prefix_objects(bucket_name, _listing_prefixes(selected_newspapers, base, years))
+    }
+    # needed when there are too many years to list them by prefix
+    return [objects[key] for key in filter_files(sorted(objects), years=years)]
+
+
+def list_newspaper_file_sizes(
+    bucket_name: str, base: str, newspapers: Optional[List[str]] = None, years: Optional[Iterable[int]] = None
+) -> List[Tuple[str, int]]:
+    """List the files of the selected newspapers and years, with their size in bytes.
+
+    See :func:`list_newspaper_objects`.
+    """
+    bucket = split_bucket_name(bucket_name)
+    return [
+        (f"s3://{bucket}/{obj['key']}", obj["size"])
+        for obj in list_newspaper_objects(bucket_name, base, newspapers, years)
+    ]
+
+
+def _list_newspaper_files(
+    bucket_name: str, base: str, newspapers: Optional[List[str]] = None, years: Optional[Iterable[int]] = None
+) -> List[str]:
+    return [path for path, _ in list_newspaper_file_sizes(bucket_name, base, newspapers, years)]
+
+
+def list_issues(bucket_name=S3_CANONICAL_DATA_BUCKET, newspapers=None, years=None):
+    issue_files = _list_newspaper_files(bucket_name, "{np}/issues/", newspapers, years)
     print(f"{bucket_name} contains {len(issue_files)} .bz2 files with issues")
     return issue_files
 
 
-def list_pages(bucket_name=S3_CANONICAL_DATA_BUCKET):
-    if bucket_name:
-        newspapers = list_newspapers(bucket_name)
-    else:
-        newspapers = list_newspapers()
-
-    page_files = (
-        db.from_sequence(newspapers)
-        .map(
-            lambda np: fixed_s3fs_glob(f"{os.path.join(bucket_name, f'{np}/pages/*')}")
-        )
-        .flatten()
-        .compute()
-    )
+def list_pages(bucket_name=S3_CANONICAL_DATA_BUCKET, newspapers=None, years=None):
+    page_files = _list_newspaper_files(bucket_name, "{np}/pages/", newspapers, years)
     print(f"{bucket_name} contains {len(page_files)} .bz2 files with pages")
     return page_files
 
 
-def list_files_rebuilt(bucket_name=S3_REBUILT_DATA_BUCKET):
-    if bucket_name:
-        newspapers = list_newspapers(bucket_name)
-    else:
-        newspapers = list_newspapers()
-    rebuilt_files = [
-        file
-        for np in newspapers
-        for file in fixed_s3fs_glob(f"{os.path.join(bucket_name, f'{np}/*')}")
-    ]
+def list_files_rebuilt(bucket_name=S3_REBUILT_DATA_BUCKET, newspapers=None, years=None):
+    rebuilt_files = _list_newspaper_files(bucket_name, "{np}/", newspapers, years)
     print(f"{bucket_name} contains {len(rebuilt_files)} .bz2 files")
     return rebuilt_files
 
 
-def fetch_issue_ids_rebuilt(bucket_name=S3_REBUILT_DATA_BUCKET, compute=True):
+def fetch_issue_ids_rebuilt(bucket_name=S3_REBUILT_DATA_BUCKET, compute=True, newspapers=None, years=None):
     """
     Derive issue IDs from an s3 bucket with rebuilt data.
 
     Since rebuilt data is organized by content item and not by issue, we need
     to parse all content items IDs in rebuilt data and derive issue IDs.
+
+    `newspapers` (IDs or glob patterns) and `years` restrict the files that
+    are listed and read.
     """
-    rebuilt_files = list_files_rebuilt(bucket_name)
+    rebuilt_files = list_files_rebuilt(bucket_name, newspapers, years)
 
     if not rebuilt_files:
         return None
 
     ci_bag = (
-        db.read_text(rebuilt_files, storage_options=IMPRESSO_STORAGEOPT)
-        .map(json.loads)
-        .map(lambda ci: "-".join(ci["id"].split("-")[:-1]))
+        db.read_text(rebuilt_files, storage_options=get_storage_options())
+        .map(extract_field, "id")
+        .filter(lambda ci_id: ci_id is not None)
+        .map(lambda ci_id: "-".join(ci_id.split("-")[:-1]))
         .distinct()
     )
 
@@ -125,11 +431,79 @@ def fetch_issue_ids_rebuilt(bucket_name=S3_REBUILT_DATA_BUCKET, compute=True):
         return ci_bag
 
 
-def fetch_issues(bucket_name=S3_CANONICAL_DATA_BUCKET, compute=True):
+def _iter_file_lines(paths: List[str]) -> Iterable[str]:
+    for path in paths:
+        yield from iter_text_lines(path)
+
+
+def fetch_issue_lines(
+    bucket_name=S3_CANONICAL_DATA_BUCKET, newspapers=None, years=None, file_groups: List[List[str]] = None
+) -> db.Bag:
+    """
+    Fetch raw (undecoded) issue JSON lines from an s3 bucket with impresso
+    canonical data.
+
+    Each issue file holds the issues of one newspaper-year, and the bag has
+    one partition per file: checks whose results only depend on issues of the
+    same newspaper-year (e.g. duplicated IDs, which start with the newspaper
+    ID and the year) can then be computed partition by partition, without any
+    shuffle, while newspapers with many years are still read in parallel.
+
+    Issue files already listed can be given as `file_groups` instead, one
+    partition per group (e.g. the files of a newspaper-year, possibly none).
+    """
+    if file_groups is not None:
+        print(f"Fetching issue lines from {sum(map(len, file_groups))} .bz2 files in {len(file_groups)} partitions")
+        return db.from_sequence(file_groups, npartitions=max(len(file_groups), 1)).map(_iter_file_lines).flatten()
+
+    issue_files = list_issues(bucket_name, newspapers, years)
+
+    print(f"Fetching issue lines from {len(issue_files)} .bz2 files")
+    return db.read_text(issue_files, storage_options=get_storage_options())
+
+
+def fetch_page_lines(
+    bucket_name=S3_CANONICAL_DATA_BUCKET, newspapers=None, years=None, n_partitions=100, page_files: List[str] = None
+) -> db.Bag:
+    """
+    Fetch raw (undecoded) page JSON lines from an s3 bucket with impresso
+    canonical data (or from `page_files`, if already listed).
+    """
+    if page_files is None:
+        page_files = list_pages(bucket_name, newspapers, years)
+
+    print(f"Fetching page lines from {len(page_files)} .bz2 files")
+    return (
+        db.from_sequence(page_files, npartitions=max(1, min(n_partitions, len(page_files))))
+        .map(read_text_file)
+        .flatten()
+    )
+
+
+def fetch_issues(
+    bucket_name=S3_CANONICAL_DATA_BUCKET, compute=True, fields=None, index_dir=None, newspapers=None, years=None
+):
     """
     Fetch issue JSON docs from an s3 bucket with impresso canonical data.
+
+    If `fields` is given (e.g. `["id", "pp"]`), only these fields are decoded
+    and kept in each document (see :func:`sanity_check.contents.decoding.decode`).
+
+    If `index_dir` is given, issues are read from the Parquet index of the
+    bucket (see :mod:`sanity_check.contents.index`) instead of the bz2 files;
+    documents then contain only `id`, `ar`, `pp` and `i[*].m.id`.
+
+    `newspapers` (IDs or glob patterns) and `years` restrict the files that
+    are listed and read (or the index partitions that are read).
     """
-    issue_files = list_issues(bucket_name)
+    if index_dir:
+        # imported here to avoid a circular import
+        from sanity_check.contents.index import issues_from_index
+
+        issue_bag = issues_from_index(index_dir, bucket_name, newspapers, years)
+        return issue_bag.compute() if compute else issue_bag
+
+    issue_files = list_issues(bucket_name, newspapers, years)
 
     print(
         (
@@ -137,8 +511,8 @@ def fetch_issues(bucket_name=S3_CANONICAL_DATA_BUCKET, compute=True):
             f"(compute={compute})"
         )
     )
-    issue_bag = db.read_text(issue_files, storage_options=IMPRESSO_STORAGEOPT).map(
-        json.loads
+    issue_bag = db.read_text(issue_files, storage_options=get_storage_options()).map(
+        decode, fields=fields
     )
 
     if compute:
@@ -147,16 +521,28 @@ def fetch_issues(bucket_name=S3_CANONICAL_DATA_BUCKET, compute=True):
         return issue_bag
 
 
-def fetch_issue_ids(bucket_name=S3_CANONICAL_DATA_BUCKET, compute=True, issue_bag=None):
+def fetch_issue_ids(
+    bucket_name=S3_CANONICAL_DATA_BUCKET, compute=True, issue_bag=None, index_dir=None, newspapers=None, years=None
+):
     """
     Fetch newspaper issue IDs from an s3 bucket with impresso canonical data.
+
+    If `index_dir` is given, IDs are read from the Parquet index of the bucket.
     """
-    if not issue_bag:
-        issue_bag = fetch_issues(bucket_name, compute=False)
+    if index_dir and not issue_bag:
+        from sanity_check.contents.index import issue_ids_from_index
+
+        issue_id_bag = issue_ids_from_index(index_dir, bucket_name, newspapers, years)
+    elif not issue_bag:
+        # the issue ID can be read without decoding the whole issue
+        issue_id_bag = (
+            fetch_issue_lines(bucket_name, newspapers, years)
+            .map(extract_field, "id")
+            .filter(lambda issue_id: issue_id is not None)
+        )
     else:
         print(f"using input issue bag {issue_bag}")
-
-    issue_id_bag = issue_bag.pluck("id")
+        issue_id_bag = issue_bag.pluck("id")
 
     if compute:
         return issue_id_bag.compute()
@@ -164,39 +550,76 @@ def fetch_issue_ids(bucket_name=S3_CANONICAL_DATA_BUCKET, compute=True, issue_ba
         return issue_id_bag
 
 
-# TODO:
-# - add  possibility to do it only for certain newspapers
-# - finish implementation
 def fetch_page_ids(
     bucket_name: str = S3_CANONICAL_DATA_BUCKET,
     source: str = "issues",
     issue_bag: db.Bag = None,
     n_partitions: int = 100,
+    index_dir: str = None,
+    newspapers: List[str] = None,
+    years: Iterable[int] = None,
+    page_files: List[str] = None,
 ) -> db.Bag:
+    """
+    Fetch page IDs from an s3 bucket with impresso canonical data.
+
+    Page IDs are found in two places: in the `pp` field of issue JSON
+    (`source="issues"`) and in the `id` field of page JSON
+    (`source="pages"`).
+
+    :param str bucket_name: S3 bucket with canonical data.
+    :param str source: Where to read the page IDs from (`issues` or `pages`).
+    :param db.Bag issue_bag: With `source="issues"`, bag of issue documents
+        already fetched (see :func:`fetch_issues`), to avoid reading them again.
+    :param int n_partitions: With `source="pages"`, maximum number of
+        partitions of the page files.
+    :param str index_dir: Read the IDs from the Parquet index of the bucket
+        instead of the bz2 files (see :mod:`sanity_check.contents.index`).
+    :param List[str] newspapers: Newspaper IDs or glob patterns to restrict the IDs to.
+    :param Iterable[int] years: Years to restrict the IDs to.
+    :param List[str] page_files: With `source="pages"`, page files already
+        listed (see :func:`list_pages`).
+    :return: A bag of page IDs.
+    :rtype: db.Bag
 
+    """
     valid_sources = ["issues", "pages"]
-    assert source in valid_sources
-
-    if issue_bag is None:
-        issue_bag = fetch_issues(bucket_name, compute=False).filter(
-            lambda i: len(i) > 0
-        )
+    assert source in valid_sources, f"Unknown source {source}, expected one of {valid_sources}"
 
+    print(f"Fetching page IDs from {source}")
     if source == "issues":
-        print(f"Fetching page IDs from {source}")
         # no need to recompute the issues
-        if issue_bag:
-            pass
-        else:
-            issue_bag = fetch_issues(compute=False)
-        return issue_bag.map(lambda i: i["pp"]).flatten()
+        if issue_bag is None:
+            issue_bag = fetch_issues(
+                bucket_name,
+                compute=False,
+                fields=["pp"],
+                index_dir=index_dir,
+                newspapers=newspapers,
+                years=years,
+            ).filter(lambda i: len(i) > 0)
+        return issue_bag.map(lambda i: i.get("pp", [])).flatten()
+    elif index_dir:
+        from sanity_check.contents.index import page_ids_from_index
+
+        return page_ids_from_index(index_dir, bucket_name, newspapers, years)
     else:
-        page_files = list_pages(bucket_name)
         return (
-            db.from_sequence(page_files, npartitions=n_partitions)
-            .map(alternative_read_text, IMPRESSO_STORAGEOPT)
-            .flatten()
-            .map(json.loads)
-            .filter(lambda i: len(i) > 0)
-            .pluck("id")
+            fetch_page_lines(bucket_name, newspapers, years, n_partitions, page_files)
+            .map(extract_field, "id")
+            .filter(lambda page_id: page_id is not None)
         )
+
+
+def read_page_ids(page_files: List[str]) -> List[str]:
+    """Read the IDs of the pages of some page files (e.g. those of a newspaper-year).
+
+    Unlike :func:`fetch_page_ids`, files are read in the calling process: this
+    is meant to be called from tasks working on a single newspaper-year.
+    """
+    return [
+        page_id
+        for path in page_files
+        for page_id in map(partial(extract_field, field="id"), read_text_file(path))
+        if page_id is not None
+    ]
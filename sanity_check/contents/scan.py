@@ -0,0 +1,916 @@
+"""Single-pass scan engine for canonical issue data.
+
+Checks register what they extract from each issue and how the extracted values
+are reduced; the engine then decompresses and parses every issue file only
+once, no matter how many checks are run over it.
+
+Checks work at one of three levels: issues (:class:`IssueCheck`), content
+items (:class:`ContentItemCheck`, fused into the scan of issues) and pages
+(:class:`PageCheck`, all run in a single scan of the page files). Checks
+added to the registry with :func:`register_check` can be selected by name
+(see :func:`create_checks`) and run together by :func:`scan_pipeline`.
+"""
+
+import time
+from collections import Counter
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from dask import bag as db
+
+from sanity_check.contents.decoding import decode
+from sanity_check.contents.sketches import DEFAULT_CAPACITY, DEFAULT_ERROR_RATE, MIN_CAPACITY, DuplicateSketch
+from sanity_check.contents.sorted_diff import split_difference
+
+
+class IssueCheck:
+    """Base class of the checks that can be run by the scan engine.
+
+    A check follows a map/reduce contract:
+
+    - :meth:`extract` is called on every (non-empty) issue JSON document;
+    - :meth:`accumulate` folds the extracted value into a partition-level
+      partial result, initialised by :meth:`initial`;
+    - :meth:`merge` combines two partial results (it must be associative);
+    - :meth:`finalize` turns the fully merged result into a report (or a
+      dictionary of reports, named `<name>_<key>`).
+
+    When every partition holds all the issues of one newspaper-year (e.g.
+    one issue file, see :func:`sanity_check.contents.s3_data.fetch_issue_lines`),
+    partial results are first passed to :meth:`compact`, together with the
+    context of the partition, which lets checks whose outcome only depends on
+    issues of the same newspaper-year (e.g. duplicated IDs, which start with
+    the newspaper ID and the year) keep only what is reported. Likewise, when
+    every partition holds all the issues of one newspaper (e.g. read from the
+    index), partial results are passed to :meth:`compact_newspaper`.
+
+    `fields` lists the paths of the issue fields the check needs (see
+    :func:`sanity_check.contents.decoding.decode`): the engine decodes only
+    the union of the fields of all checks (`None` means the whole issue).
+    """
+
+    name = None
+    fields = None
+    level = "issue"
+
+    # whether the check runs when no check is selected by name (see :func:`create_checks`)
+    default = True
+
+    # kind of IDs this check can verify in two-stage mode ("issue" or "ci")
+    sketch_kind = None
+
+    # maximum fan-in of the reduction of its partial results (`None`: the default of :func:`scan_issues`)
+    split_every = None
+
+    # what the check needs that the Parquet index does not store (`None`: it can run on the index)
+    not_indexed = None
+
+    @classmethod
+    def from_context(cls, **context) -> "IssueCheck":
+        """Create the check for a run (see :func:`create_checks`); most checks need no context."""
+        return cls()
+
+    def initial(self):
+        raise NotImplementedError
+
+    def extract(self, issue: dict):
+        raise NotImplementedError
+
+    def accumulate(self, acc, value):
+        raise NotImplementedError
+
+    def merge(self, acc, other):
+        raise NotImplementedError
+
+    def compact(self, acc, context: dict):
+        """Reduce a partial result covering a whole newspaper-year (default: keep it as is).
+
+        `context` describes the partition (see `partition_contexts` in
+        :func:`scan_issues`).
+        """
+        return acc
+
+    def compact_newspaper(self, acc):
+        """Reduce a partial result covering all the issues of a newspaper (default: keep it as is)."""
+        return acc
+
+    def finalize(self, acc) -> pd.DataFrame:
+        raise NotImplementedError
+
+
+class ContentItemCheck(IssueCheck):
+    """Base class of the checks run on every content item of the issues.
+
+    Content items are taken from the issues (`i` array) during the scan of
+    issues: `item_fields` are relative to a content item (e.g. `m.id`),
+    :meth:`extract_item` is called on every content item and
+    :meth:`accumulate_item` folds each extracted value.
+    """
+
+    level = "content_item"
+    item_fields = None
+
+    @property
+    def fields(self) -> tuple:
+        if self.item_fields is None:
+            return ("i",)
+        return tuple(f"i[*].{field}" for field in self.item_fields)
+
+    def extract(self, issue: dict) -> list:
+        return [self.extract_item(ci) for ci in issue.get("i", [])]
+
+    def accumulate(self, acc, value: list):
+        for item_value in value:
+            acc = self.accumulate_item(acc, item_value)
+        return acc
+
+    def extract_item(self, ci: dict):
+        raise NotImplementedError
+
+    def accumulate_item(self, acc, value):
+        raise NotImplementedError
+
+
+class PageCheck(IssueCheck):
+    """Base class of the checks run on page JSON documents.
+
+    Same contract as :class:`IssueCheck`, with :meth:`extract` called on
+    every page; all page checks of a run share one scan of the page files.
+    """
+
+    level = "page"
+
+
+# registered checks, by name
+CHECKS = {}
+
+
+def register_check(check_class):
+    """Class decorator adding a check to the registry, under its `name`."""
+    assert check_class.name and check_class.name not in CHECKS, f"Invalid or duplicated check name: {check_class.name}"
+    CHECKS[check_class.name] = check_class
+    return check_class
+
+
+def create_checks(names: Optional[List[str]] = None, **context) -> List[IssueCheck]:
+    """Create registered checks by name.
+
+    With an `index_dir` in the context, checks needing data that the index
+    does not store (see `not_indexed`) are left out of the default selection,
+    and selecting them by name is an error.
+
+    :param List[str] names: Names of the checks (all registered checks
+        enabled by `default` if `None`).
+    :param context: Parameters of the run (`canonical_bucket_name`,
+        `index_dir`, `newspapers`, `years`), passed to `from_context`.
+    :return: The checks, in the given order.
+    :rtype: List[IssueCheck]
+
+    """
+    selected = names or [name for name, check_class in CHECKS.items() if check_class.default]
+    unknown = [name for name in selected if name not in CHECKS]
+    if unknown:
+        raise ValueError(f"Unknown checks: {', '.join(unknown)} (available: {', '.join(CHECKS)})")
+
+    if context.get("index_dir"):
+        unsupported = {name: CHECKS[name].not_indexed for name in selected if CHECKS[name].not_indexed}
+        if unsupported:
+            reasons = "; ".join(f"{name} needs {what}" for name, what in unsupported.items())
+            if names:
+                raise ValueError(f"Checks cannot run on the index ({reasons}): run them on the bz2 files instead")
+            print(f"Skipping checks that cannot run on the index ({reasons}, which are not indexed)")
+            selected = [name for name in selected if name not in unsupported]
+    return [CHECKS[name].from_context(**context) for name in selected]
+
+
+def _collisions(acc: Counter) -> Counter:
+    return Counter({key: freq for key, freq in acc.items() if freq > 1})
+
+
+@register_check
+class DuplicatedIssueIDs(IssueCheck):
+    """Check that newspaper issue IDs are unique within the corpus.
+
+    If `candidates` is given (see :class:`SketchedDuplicateIDs`), only the
+    IDs it flags as possibly duplicated are counted.
+    """
+
+    name = "duplicate_issue_ids"
+    fields = ("id",)
+    sketch_kind = "issue"
+
+    def __init__(self, candidates: DuplicateSketch = None):
+        self.candidates = candidates
+
+    def initial(self) -> Counter:
+        return Counter()
+
+    def extract(self, issue: dict) -> str:
+        return issue["id"]
+
+    def accumulate(self, acc: Counter, value: str) -> Counter:
+        if self.candidates is None or self.candidates.is_candidate([value])[0]:
+            acc[value] += 1
+        return acc
+
+    def merge(self, acc: Counter, other: Counter) -> Counter:
+        acc.update(other)
+        return acc
+
+    def compact(self, acc: Counter, context: dict) -> Counter:
+        return _collisions(acc)
+
+    def compact_newspaper(self, acc: Counter) -> Counter:
+        return _collisions(acc)
+
+    def finalize(self, acc: Counter) -> pd.DataFrame:
+        duplicates = [
+            {"issue_id": issue_id, "freq": freq, "newspaper_id": issue_id.split("-")[0]}
+            for issue_id, freq in acc.items()
+            if freq > 1
+        ]
+        print(f"{len(duplicates)} duplicated IDs were found")
+        if duplicates:
+            return pd.DataFrame(duplicates).set_index("issue_id")
+        return pd.DataFrame(columns=["issue_id", "freq", "newspaper_id"]).set_index("issue_id")
+
+
+@register_check
+class DuplicatedContentItemIDs(IssueCheck):
+    """Check that content item IDs are unique within the corpus.
+
+    If `candidates` is given (see :class:`SketchedDuplicateIDs`), only the
+    IDs it flags as possibly duplicated are counted.
+    """
+
+    name = "duplicate_ci_ids"
+    fields = ("i[*].m.id",)
+    sketch_kind = "ci"
+
+    def __init__(self, candidates: DuplicateSketch = None):
+        self.candidates = candidates
+
+    def initial(self) -> Counter:
+        return Counter()
+
+    def extract(self, issue: dict) -> List[str]:
+        return [ci["m"]["id"] for ci in issue["i"]]
+
+    def accumulate(self, acc: Counter, value: List[str]) -> Counter:
+        if self.candidates is not None:
+            value = [ci_id for ci_id, candidate in zip(value, self.candidates.is_candidate(value)) if candidate]
+        acc.update(value)
+        return acc
+
+    def merge(self, acc: Counter, other: Counter) -> Counter:
+        acc.update(other)
+        return acc
+
+    def compact(self, acc: Counter, context: dict) -> Counter:
+        return _collisions(acc)
+
+    def compact_newspaper(self, acc: Counter) -> Counter:
+        return _collisions(acc)
+
+    def finalize(self, acc: Counter) -> pd.DataFrame:
+        duplicates = [
+            {"ci_id": ci_id, "freq": freq, "newspaper_id": ci_id.split("-")[0]}
+            for ci_id, freq in acc.items()
+            if freq > 1
+        ]
+
+        if duplicates:
+            duplicates_df = pd.DataFrame(duplicates).set_index("ci_id")
+        else:
+            # there are no duplicates
+            duplicates_df = pd.DataFrame(columns=["ci_id", "freq", "newspaper_id"]).set_index("ci_id")
+
+        print(
+            (
+                f"Found {duplicates_df.shape[0]} duplicated "
+                "content item IDs, belonging to "
+                f"{duplicates_df.newspaper_id.unique().size} journals"
+                f"({', '.join(list(duplicates_df.newspaper_id.unique()))})"
+            )
+        )
+        return duplicates_df
+
+
+class SketchedDuplicateIDs(IssueCheck):
+    """First stage of the two-stage duplicate checks: sketch issue or content item IDs.
+
+    Each partition builds a :class:`~sanity_check.contents.sketches.DuplicateSketch`
+    (Bloom filters of seen and repeated IDs, HyperLogLog counts per
+    newspaper), which are merged into one. The report gives the approximate
+    number of duplicates per newspaper; the merged sketch (`self.sketch`)
+    is then passed as `candidates` to :class:`DuplicatedIssueIDs` or
+    :class:`DuplicatedContentItemIDs`, which verify exactly the flagged IDs.
+
+    Every partial result holds two Bloom filters of about 1.2 bytes per ID of
+    `capacity` each: they are merged two at a time, so that few of them are
+    held in memory at once.
+    """
+
+    split_every = 2
+
+    # rough size of bz2-compressed issue files per issue and per content item, to size sketches from their input
+    BYTES_PER_ID = {"issue": 2000, "ci": 100}
+
+    def __init__(self, kind: str = "ci", capacity: int = DEFAULT_CAPACITY, error_rate: float = DEFAULT_ERROR_RATE):
+        assert kind in ("issue", "ci")
+        self.kind = kind
+        self.exact_check = DuplicatedIssueIDs if kind == "issue" else DuplicatedContentItemIDs
+        self.name = f"{self.exact_check.name}_approx"
+        self.fields = self.exact_check.fields
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sketch = None
+
+    @classmethod
+    def for_input_size(
+        cls, kind: str, input_bytes: int, error_rate: float = DEFAULT_ERROR_RATE
+    ) -> "SketchedDuplicateIDs":
+        """Create the check with sketches sized for the IDs of `input_bytes` of bz2-compressed issue files."""
+        return cls(kind, max(MIN_CAPACITY, input_bytes // cls.BYTES_PER_ID[kind]), error_rate)
+
+    def initial(self) -> DuplicateSketch:
+        return DuplicateSketch(self.capacity, self.error_rate)
+
+    def extract(self, issue: dict) -> List[str]:
+        return [issue["id"]] if self.kind == "issue" else [ci["m"]["id"] for ci in issue["i"]]
+
+    def accumulate(self, acc: DuplicateSketch, value: List[str]) -> DuplicateSketch:
+        acc.add(value)
+        return acc
+
+    def merge(self, acc: DuplicateSketch, other: DuplicateSketch) -> DuplicateSketch:
+        return acc.merge(other)
+
+    def finalize(self, acc: DuplicateSketch) -> pd.DataFrame:
+        self.sketch = acc
+        return sketch_report(acc)
+
+
+def sketch_report(sketch: DuplicateSketch) -> pd.DataFrame:
+    """Build the approximate report of a duplicate sketch (one row per newspaper).
+
+    :return: A DataFrame indexed by `newspaper_id`, with columns `n_ids`,
+        `n_distinct` and `n_duplicates` (the last two are estimates).
+    :rtype: pd.DataFrame
+
+    """
+    estimates = sketch.estimates()
+    df = pd.DataFrame.from_dict(estimates, orient="index", columns=["n_ids", "n_distinct", "n_duplicates"])
+    df.index.name = "newspaper_id"
+    print(f"~{df.n_duplicates.sum()} duplicated IDs (estimate), in {(df.n_duplicates > 0).sum()} newspapers")
+    return df
+
+
+class PageIDMismatches:
+    """Page IDs found only in issue JSON or only in page JSON.
+
+    `covered` holds the newspapers (or `(newspaper, year)` pairs) whose page
+    IDs were compared.
+    """
+
+    def __init__(self, covered: Iterable = (), only_in_issues: Iterable[str] = (), only_in_pages: Iterable[str] = ()):
+        self.covered = set(covered)
+        self.only_in_issues = list(only_in_issues)
+        self.only_in_pages = list(only_in_pages)
+
+    def __repr__(self):
+        return (
+            f"<PageIDMismatches covered={len(self.covered)} "
+            f"only_in_issues={len(self.only_in_issues)} only_in_pages={len(self.only_in_pages)}>"
+        )
+
+    def update(self, other: "PageIDMismatches") -> "PageIDMismatches":
+        self.covered |= other.covered
+        self.only_in_issues += other.only_in_issues
+        self.only_in_pages += other.only_in_pages
+        return self
+
+
+def newspaper_page_ids_mismatches(
+    key, page_ids_from_issues: Iterable[str], page_ids_from_pages: Iterable[str]
+) -> PageIDMismatches:
+    """Compare the page IDs of one newspaper (or `(newspaper, year)` key) by sorting both sides and walking them together."""
+    only_in_issues, only_in_pages = split_difference(sorted(page_ids_from_issues), sorted(page_ids_from_pages))
+    return PageIDMismatches([key], only_in_issues, only_in_pages)
+
+
+@register_check
+class InconsistentPageIDs(IssueCheck):
+    """Check whether page IDs in issue JSON (`pp`) match those of page JSON.
+
+    Page IDs start with the newspaper ID and the year, so both sides are
+    compared newspaper-year by newspaper-year (see
+    :func:`newspaper_page_ids_mismatches`), and only the mismatches are
+    collected:
+
+    - with aligned partitions, each partition reads the page files of its
+      newspaper-year (listed once by the caller, see `partition_contexts` in
+      :func:`scan_issues`) in :meth:`compact`;
+    - otherwise, :meth:`finalize` lists the page files once and compares
+      each newspaper-year in a separate task; with `index_dir`, both sides
+      are read from the index by per-newspaper tasks and nothing is collected
+      during the scan.
+    """
+
+    name = "inconsistent_page_ids"
+    fields = ("pp",)
+
+    def __init__(self, canonical_bucket_name: str, index_dir: str = None, newspapers: list = None, years: list = None):
+        self.canonical_bucket_name = canonical_bucket_name
+        self.index_dir = index_dir
+        self.newspapers = newspapers
+        self.years = years
+        if index_dir:
+            self.fields = ()
+
+    @classmethod
+    def from_context(cls, canonical_bucket_name: str, index_dir=None, newspapers=None, years=None, **context):
+        return cls(canonical_bucket_name, index_dir, newspapers, years)
+
+    def initial(self) -> set:
+        return set()
+
+    def extract(self, issue: dict) -> List[str]:
+        return [] if self.index_dir else issue["pp"]
+
+    def accumulate(self, acc: set, value: List[str]) -> set:
+        acc.update(value)
+        return acc
+
+    def compact(self, acc: set, context: dict) -> PageIDMismatches:
+        # imported here to avoid a circular import
+        from sanity_check.contents.s3_data import read_page_ids
+
+        return newspaper_page_ids_mismatches(
+            (context["newspaper"], context["year"]), acc, read_page_ids(context["page_files"])
+        )
+
+    def merge(self, acc, other):
+        if isinstance(acc, PageIDMismatches):
+            return acc.update(other)
+        acc |= other
+        return acc
+
+    def _compare_in_tasks(self, arguments: List[tuple], compare: Callable[..., PageIDMismatches]) -> PageIDMismatches:
+        """Run `compare` on each tuple of arguments (one per newspaper or newspaper-year) in a separate task."""
+        mismatches = PageIDMismatches()
+        if arguments:
+            for newspaper_mismatches in (
+                db.from_sequence(arguments, npartitions=len(arguments)).starmap(compare).compute()
+            ):
+                mismatches.update(newspaper_mismatches)
+        return mismatches
+
+    def _index_mismatches(self) -> PageIDMismatches:
+        # imported here to avoid a circular import
+        from sanity_check.contents.index import _index_newspapers, read_newspaper_page_ids, resolve_index
+        from sanity_check.contents.s3_data import select_newspapers
+
+        version_dir = resolve_index(self.index_dir, self.canonical_bucket_name)
+        newspapers = set()
+        for table in ["issues", "pages"]:
+            newspapers.update(_index_newspapers(f"{version_dir}/{table}"))
+        years = self.years
+
+        return self._compare_in_tasks(
+            [(np,) for np in select_newspapers(newspapers, self.newspapers)],
+            lambda np: newspaper_page_ids_mismatches(np, *read_newspaper_page_ids(version_dir, np, years)),
+        )
+
+    def finalize(self, acc) -> pd.DataFrame:
+        # imported here to avoid a circular import
+        from sanity_check.contents.s3_data import files_by_newspaper_year, list_pages, read_page_ids
+
+        if self.index_dir:
+            mismatches = self._index_mismatches()
+        elif isinstance(acc, PageIDMismatches):
+            mismatches = acc
+        else:
+            # the scan was not aligned on newspaper-years: only the page IDs of the issues were collected
+            from_issues = _by_newspaper_year(acc)
+            page_files = files_by_newspaper_year(list_pages(self.canonical_bucket_name, self.newspapers, self.years))
+            mismatches = self._compare_in_tasks(
+                [
+                    (key, from_issues.get(key, []), page_files.get(key, []))
+                    for key in sorted(set(page_files) | set(from_issues))
+                ],
+                lambda key, page_ids, files: newspaper_page_ids_mismatches(key, page_ids, read_page_ids(files)),
+            )
+        return page_ids_mismatches(mismatches.only_in_issues, mismatches.only_in_pages)
+
+
+def _by_newspaper_year(page_ids: Iterable[str]) -> Dict[Tuple[str, int], List[str]]:
+    """Group page IDs by the newspaper and year they start with (e.g. `GDL-1900-01-01-a-p0001`)."""
+    by_newspaper_year = {}
+    for page_id in page_ids:
+        newspaper, year = page_id.split("-")[:2]
+        by_newspaper_year.setdefault((newspaper, int(year)), []).append(page_id)
+    return by_newspaper_year
+
+
+def page_ids_mismatches(only_in_issues: Iterable[str], only_in_pages: Iterable[str]) -> pd.DataFrame:
+    """Build the report of page IDs found only in issue JSON or only in page JSON.
+
+    :param Iterable[str] only_in_issues: Page IDs listed in issues but without page JSON.
+    :param Iterable[str] only_in_pages: Page IDs with page JSON but not listed in issues.
+    :return: A DataFrame indexed by page ID with columns `from_issues`,
+        `from_pages` and `newspaper_id`.
+    :rtype: pd.DataFrame
+
+    """
+    records = [{"id": page_id, "from_issues": True, "from_pages": np.nan} for page_id in only_in_issues]
+    records += [{"id": page_id, "from_issues": np.nan, "from_pages": True} for page_id in only_in_pages]
+    df_pages = pd.DataFrame(records, columns=["id", "from_issues", "from_pages"]).set_index("id").sort_index()
+    df_pages["newspaper_id"] = df_pages.index.map(lambda z: z.split("-")[0])
+    return df_pages
+
+
+def page_number(page_id: str) -> Optional[int]:
+    """Return the number of a page from its ID (e.g. `GDL-1900-01-01-a-p0004` => 4)."""
+    try:
+        return int(page_id.rsplit("-p", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+@register_check
+class ContentItemPageReferences(IssueCheck):
+    """Check that content items and issues agree on the pages of an issue.
+
+    Within each issue:
+
+    - every page number listed by a content item (`m.pp`) must correspond to
+      a page ID listed in the `pp` field of the issue (`missing_page`);
+    - every page of `pp` must be referenced by at least one content item
+      (`unreferenced_page`); this is only verified when all content items of
+      the issue list their pages.
+
+    Reports the counts per newspaper (`<name>_counts`) and the offending
+    content item and page IDs (`<name>_offending`).
+
+    ..note::
+        The Parquet index does not store the pages of content items: the
+        check does not run with `--index-dir` (see :func:`create_checks`).
+    """
+
+    name = "ci_page_references"
+    fields = ("id", "pp", "i[*].m.id", "i[*].m.pp")
+    not_indexed = "the pages of content items"
+
+    COUNTS = ["n_content_items", "n_pages", "n_missing_pages", "n_unreferenced_pages"]
+
+    def initial(self) -> dict:
+        return {"counts": {}, "offending": []}
+
+    def extract(self, issue: dict) -> dict:
+        issue_id = issue["id"]
+        pages = {page_number(page_id): page_id for page_id in issue.get("pp", [])}
+        content_items = issue.get("i", [])
+
+        offending = []
+        referenced = set()
+        for ci in content_items:
+            for number in ci["m"].get("pp", []):
+                referenced.add(number)
+                if number not in pages:
+                    offending.append(("missing_page", ci["m"]["id"], f"{issue_id}-p{number:04d}"))
+
+        if content_items and all("pp" in ci["m"] for ci in content_items):
+            offending += [
+                ("unreferenced_page", None, page_id)
+                for number, page_id in sorted(pages.items(), key=lambda page: page[1])
+                if number not in referenced
+            ]
+
+        return {
+            "newspaper_id": issue_id.split("-")[0],
+            "n_content_items": len(content_items),
+            "n_pages": len(pages),
+            "offending": offending,
+        }
+
+    def accumulate(self, acc: dict, value: dict) -> dict:
+        counts = acc["counts"].setdefault(value["newspaper_id"], dict.fromkeys(self.COUNTS, 0))
+        counts["n_content_items"] += value["n_content_items"]
+        counts["n_pages"] += value["n_pages"]
+        for kind, ci_id, page_id in value["offending"]:
+            counts["n_missing_pages" if kind == "missing_page" else "n_unreferenced_pages"] += 1
+            acc["offending"].append((kind, ci_id, page_id, value["newspaper_id"]))
+        return acc
+
+    def merge(self, acc: dict, other: dict) -> dict:
+        for newspaper, counts in other["counts"].items():
+            merged = acc["counts"].setdefault(newspaper, dict.fromkeys(self.COUNTS, 0))
+            for key, count in counts.items():
+                merged[key] += count
+        acc["offending"] += other["offending"]
+        return acc
+
+    def finalize(self, acc: dict) -> Dict[str, pd.DataFrame]:
+        counts_df = pd.DataFrame.from_dict(acc["counts"], orient="index", columns=self.COUNTS).sort_index()
+        counts_df.index.name = "newspaper_id"
+        offending_df = pd.DataFrame(acc["offending"], columns=["kind", "ci_id", "page_id", "newspaper_id"])
+
+        print(
+            f"Found {counts_df.n_missing_pages.sum()} references of content items to pages missing from "
+            f"their issue and {counts_df.n_unreferenced_pages.sum()} pages referenced by no content item"
+        )
+        return {"counts": counts_df, "offending": offending_df}
+
+
+@register_check
+class ContentItemTypes(ContentItemCheck):
+    """Count the content items of each newspaper by type (`m.tp`).
+
+    Content items without a type are counted as `missing`.
+
+    ..note::
+        The Parquet index does not store the types of content items: the
+        check does not run with `--index-dir` (see :func:`create_checks`).
+    """
+
+    name = "ci_types"
+    item_fields = ("m.id", "m.tp")
+    not_indexed = "the types of content items"
+
+    MISSING_TYPE = "missing"
+
+    def initial(self) -> Counter:
+        return Counter()
+
+    def extract_item(self, ci: dict) -> tuple:
+        return ci["m"]["id"].split("-")[0], ci["m"].get("tp") or self.MISSING_TYPE
+
+    def accumulate_item(self, acc: Counter, value: tuple) -> Counter:
+        acc[value] += 1
+        return acc
+
+    def merge(self, acc: Counter, other: Counter) -> Counter:
+        acc.update(other)
+        return acc
+
+    def finalize(self, acc: Counter) -> pd.DataFrame:
+        df = pd.DataFrame(
+            [(newspaper, ci_type, n) for (newspaper, ci_type), n in acc.items()],
+            columns=["newspaper_id", "type", "n_content_items"],
+        ).set_index(["newspaper_id", "type"]).sort_index()
+
+        missing = df[df.index.get_level_values("type") == self.MISSING_TYPE]
+        print(f"Found {missing.n_content_items.sum()} content items without type, in {len(missing)} newspapers")
+        return df
+
+
+@register_check
+class EmptyPages(PageCheck):
+    """Check that page JSON documents have regions (`r`).
+
+    Reports the counts per newspaper (`<name>_counts`) and the IDs of the
+    pages without any region (`<name>_offending`).
+
+    ..note::
+        This check needs a scan of all the page files, which are much larger
+        than the issue files: it only runs when selected by name.
+    """
+
+    name = "empty_pages"
+    fields = ("id", "r[*].c")
+    default = False
+
+    COUNTS = ["n_pages", "n_empty_pages"]
+
+    def initial(self) -> dict:
+        return {"counts": {}, "offending": []}
+
+    def extract(self, page: dict) -> tuple:
+        return page["id"], len(page.get("r") or [])
+
+    def accumulate(self, acc: dict, value: tuple) -> dict:
+        page_id, n_regions = value
+        newspaper = page_id.split("-")[0]
+        counts = acc["counts"].setdefault(newspaper, dict.fromkeys(self.COUNTS, 0))
+        counts["n_pages"] += 1
+        if not n_regions:
+            counts["n_empty_pages"] += 1
+            acc["offending"].append((page_id, newspaper))
+        return acc
+
+    def merge(self, acc: dict, other: dict) -> dict:
+        for newspaper, counts in other["counts"].items():
+            merged = acc["counts"].setdefault(newspaper, dict.fromkeys(self.COUNTS, 0))
+            for key, count in counts.items():
+                merged[key] += count
+        acc["offending"] += other["offending"]
+        return acc
+
+    def finalize(self, acc: dict) -> Dict[str, pd.DataFrame]:
+        counts_df = pd.DataFrame.from_dict(acc["counts"], orient="index", columns=self.COUNTS).sort_index()
+        counts_df.index.name = "newspaper_id"
+        offending_df = pd.DataFrame(sorted(acc["offending"]), columns=["page_id", "newspaper_id"]).set_index("page_id")
+
+        print(f"Found {len(offending_df)} pages without regions, in {offending_df.newspaper_id.nunique()} newspapers")
+        return {"counts": counts_df, "offending": offending_df}
+
+
+class ScanReport:
+    """Results of a scan, together with the I/O and timing statistics."""
+
+    def __init__(self, results: Dict[str, pd.DataFrame], n_records: int, bytes_read: int, timings: Dict[str, float]):
+        self.results = results
+        self.n_records = n_records
+        self.bytes_read = bytes_read
+        self.timings = timings
+
+    def __repr__(self):
+        return f"<ScanReport checks={list(self.results)} records={self.n_records} bytes_read={self.bytes_read}>"
+
+    def update(self, other: "ScanReport") -> "ScanReport":
+        """Add the results and statistics of another scan to this report."""
+        self.results.update(other.results)
+        self.n_records += other.n_records
+        self.bytes_read += other.bytes_read
+        for name, seconds in other.timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+        return self
+
+    def summary(self) -> str:
+        lines = [f"Scanned {self.n_records} records ({self.bytes_read} bytes of JSON read)"]
+        for name, seconds in self.timings.items():
+            lines.append(f"  {name}: {seconds:.2f}s")
+        return "\n".join(lines)
+
+
+def _scan_fields(checks: List[IssueCheck]) -> Optional[tuple]:
+    """Return the union of the fields needed by the checks (`None` for all)."""
+    if any(check.fields is None for check in checks):
+        return None
+    return tuple(sorted({field for check in checks for field in check.fields}))
+
+
+def _scan_partition(
+    lines: Iterable[str],
+    contexts: Optional[List[dict]] = None,
+    checks: List[IssueCheck] = (),
+    whole_newspapers: bool = False,
+) -> List[dict]:
+    """Run the extract/accumulate step of all checks over a partition (and its context, if aligned)."""
+    fields = _scan_fields(checks)
+    accs = [check.initial() for check in checks]
+    timings = {"decode": 0.0}
+    timings.update({check.name: 0.0 for check in checks})
+    n_records = 0
+    bytes_read = 0
+
+    for line in lines:
+        # issues read from the index come already decoded
+        if isinstance(line, dict):
+            issue = line
+        else:
+            bytes_read += len(line.encode("utf-8"))
+
+            start = time.perf_counter()
+            issue = decode(line, fields) if line.strip() else None
+            timings["decode"] += time.perf_counter() - start
+
+        # skip empty lines and empty documents
+        if not issue:
+            continue
+        n_records += 1
+
+        for n, check in enumerate(checks):
+            start = time.perf_counter()
+            accs[n] = check.accumulate(accs[n], check.extract(issue))
+            timings[check.name] += time.perf_counter() - start
+
+    if contexts is not None:
+        # aligned partitions have exactly one context
+        [context] = contexts
+        accs = [check.compact(acc, context) for check, acc in zip(checks, accs)]
+    elif whole_newspapers:
+        accs = [check.compact_newspaper(acc) for check, acc in zip(checks, accs)]
+
+    return [{"accs": accs, "timings": timings, "n_records": n_records, "bytes_read": bytes_read}]
+
+
+def _merge_partials(partials: Iterable[dict], checks: List[IssueCheck]) -> dict:
+    """Merge partition-level partial results (used as tree-reduction step)."""
+    merged = None
+    for part in partials:
+        if merged is None:
+            merged = part
+            continue
+        merged["accs"] = [check.merge(acc, other) for check, acc, other in zip(checks, merged["accs"], part["accs"])]
+        for name, seconds in part["timings"].items():
+            merged["timings"][name] += seconds
+        merged["n_records"] += part["n_records"]
+        merged["bytes_read"] += part["bytes_read"]
+    return merged
+
+
+def scan_issues(
+    issue_lines: db.Bag,
+    checks: List[IssueCheck],
+    split_every: int = 8,
+    partition_contexts: Optional[List[dict]] = None,
+    whole_newspapers: bool = False,
+) -> ScanReport:
+    """Run several checks over canonical issues in a single traversal.
+
+    :param db.Bag issue_lines: Bag of raw (undecoded) issue JSON lines, or of
+        issue documents read from the index (or page JSON lines, for page
+        checks).
+    :param List[IssueCheck] checks: Checks to run.
+    :param int split_every: Fan-in of the tree reduction of partial results
+        (lowered to the `split_every` of the checks that set one).
+    :param List[dict] partition_contexts: If each partition holds all the
+        issues of one newspaper-year (e.g. one issue file, see
+        :func:`sanity_check.contents.s3_data.fetch_issue_lines`), the context
+        of each partition: a dictionary with its `newspaper`, `year` and
+        `page_files` (the page files of the newspaper-year, as listed by the
+        caller). Partial results are then compacted before being reduced (see
+        :meth:`IssueCheck.compact`). Newspaper-years with page files but no
+        issues must have a (empty) partition too.
+    :param bool whole_newspapers: Whether each partition holds all the
+        issues of one newspaper (e.g. see
+        :func:`sanity_check.contents.index.issues_by_newspaper`): partial
+        results are then compacted (see :meth:`IssueCheck.compact_newspaper`)
+        before being reduced.
+    :return: A report with one result per check, the number of bytes read and
+        the time spent (summed over all workers) decoding and in each check.
+    :rtype: ScanReport
+
+    """
+    names = [check.name for check in checks]
+    assert len(set(names)) == len(names), f"Check names must be unique: {names}"
+
+    # checks with large partial results merge fewer of them at once
+    split_every = min([split_every] + [check.split_every for check in checks if check.split_every])
+    scan_partition = partial(_scan_partition, checks=checks, whole_newspapers=whole_newspapers)
+    if partition_contexts is None:
+        partials = issue_lines.map_partitions(scan_partition)
+    else:
+        assert len(partition_contexts) == issue_lines.npartitions, "Expected one context per partition"
+        contexts = db.from_sequence(partition_contexts, npartitions=len(partition_contexts))
+        partials = issue_lines.map_partitions(scan_partition, contexts)
+
+    merge = partial(_merge_partials, checks=checks)
+    merged = partials.reduction(merge, merge, split_every=split_every).compute()
+
+    results = {}
+    timings = merged["timings"]
+    for check, acc in zip(checks, merged["accs"]):
+        start = time.perf_counter()
+        result = check.finalize(acc)
+        # checks with several reports return them by suffix
+        if isinstance(result, dict):
+            results.update({f"{check.name}_{suffix}": df for suffix, df in result.items()})
+        else:
+            results[check.name] = result
+        timings[check.name] += time.perf_counter() - start
+
+    return ScanReport(results, merged["n_records"], merged["bytes_read"], timings)
+
+
+def scan_pipeline(
+    checks: List[IssueCheck],
+    issue_lines: Optional[db.Bag] = None,
+    page_lines: Optional[Callable[[], db.Bag]] = None,
+    partition_contexts: Optional[List[dict]] = None,
+    whole_newspapers: bool = False,
+) -> ScanReport:
+    """Run checks of all levels with as few passes over the data as possible.
+
+    Issue and content item checks are fused into one scan of the issues,
+    page checks into one scan of the pages (skipped if there are none).
+
+    :param List[IssueCheck] checks: Checks to run.
+    :param db.Bag issue_lines: Issue lines or documents (see :func:`scan_issues`).
+    :param Callable page_lines: Function returning the bag of page lines,
+        only called if page checks are selected.
+    :param List[dict] partition_contexts: See :func:`scan_issues` (issue scan only).
+    :param bool whole_newspapers: See :func:`scan_issues` (issue scan only).
+    :return: The report of all checks.
+    :rtype: ScanReport
+
+    """
+    report = ScanReport({}, 0, 0, {})
+
+    issue_checks = [check for check in checks if check.level != "page"]
+    if issue_checks:
+        report.update(
+            scan_issues(
+                issue_lines, issue_checks, partition_contexts=partition_contexts, whole_newspapers=whole_newspapers
+            )
+        )
+
+    page_checks = [check for check in checks if check.level == "page"]
+    if page_checks:
+        report.update(scan_issues(page_lines(), page_checks))
+
+    return report
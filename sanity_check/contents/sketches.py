@@ -0,0 +1,267 @@
+"""Mergeable probabilistic sketches of sets of IDs.
+
+- :class:`BloomFilter`: approximate set membership (no false negatives);
+- :class:`DuplicateSketch`: a pair of Bloom filters (`seen`, `duplicates`)
+  whose `duplicates` filter contains every ID that occurs more than once,
+  plus a few false positives;
+- :class:`HyperLogLog`: approximate count of distinct IDs.
+
+All sketches of the same parameters can be merged (e.g. across the
+partitions of a dask bag), and saved to / loaded from ``.npz`` files so that
+later runs can reuse them, together with a fingerprint of the data they were
+built from. IDs are hashed once (128-bit BLAKE2b) and all the
+sketch operations are vectorized over batches of IDs with numpy.
+"""
+
+import math
+import zlib
+from hashlib import blake2b
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+DEFAULT_CAPACITY = 50 * 1000 ** 2
+# smallest capacity of sketches sized from their input
+MIN_CAPACITY = 1000 ** 2
+DEFAULT_ERROR_RATE = 0.01
+DEFAULT_HLL_PRECISION = 14
+
+# IDs are buffered and added to the sketches by batches of this size
+BATCH_SIZE = 100000
+
+
+def hash_ids(ids: Iterable[str]) -> np.ndarray:
+    """Hash IDs into pairs of 64-bit integers (array of shape `(n, 2)`)."""
+    digests = b"".join(blake2b(i.encode("utf-8"), digest_size=16).digest() for i in ids)
+    return np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """Number of bits needed to represent each (unsigned 64-bit) value."""
+    values = values.copy()
+    lengths = np.zeros(values.shape, dtype=np.uint64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        shift = np.uint64(shift)
+        mask = values >= (np.uint64(1) << shift)
+        lengths[mask] += shift
+        values[mask] >>= shift
+    return lengths + values
+
+
+class BloomFilter:
+    """Bloom filter of `n_bits` bits with `n_hashes` hash functions (double hashing)."""
+
+    def __init__(self, n_bits: int, n_hashes: int, bits: np.ndarray = None):
+        self.n_bits = int(n_bits)
+        self.n_hashes = int(n_hashes)
+        self.bits = bits if bits is not None else np.zeros((self.n_bits + 7) // 8, dtype=np.uint8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int = DEFAULT_CAPACITY, error_rate: float = DEFAULT_ERROR_RATE) -> "BloomFilter":
+        """Create a filter holding `capacity` items with the given false-positive rate."""
+        n_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        n_hashes = max(1, int(round(n_bits / capacity * math.log(2))))
+        return cls(n_bits, n_hashes)
+
+    def __repr__(self):
+        return f"<BloomFilter bits={self.n_bits} hashes={self.n_hashes}>"
+
+    # filters of single partitions are sparse: compress them when shipped between workers
+    def __getstate__(self):
+        return {"n_bits": self.n_bits, "n_hashes": self.n_hashes, "bits": zlib.compress(self.bits.tobytes(), 1)}
+
+    def __setstate__(self, state):
+        self.n_bits = state["n_bits"]
+        self.n_hashes = state["n_hashes"]
+        self.bits = np.frombuffer(zlib.decompress(state["bits"]), dtype=np.uint8).copy()
+
+    def _positions(self, hashes: np.ndarray) -> np.ndarray:
+        steps = np.arange(self.n_hashes, dtype=np.uint64)
+        return (hashes[:, :1] + steps * hashes[:, 1:]) % np.uint64(self.n_bits)
+
+    def add_hashes(self, hashes: np.ndarray):
+        positions = self._positions(hashes).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    def contains_hashes(self, hashes: np.ndarray) -> np.ndarray:
+        positions = self._positions(hashes)
+        found = self.bits[positions >> np.uint64(3)] & np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        return (found != 0).all(axis=1)
+
+    def _check_compatible(self, other: "BloomFilter"):
+        assert (self.n_bits, self.n_hashes) == (other.n_bits, other.n_hashes), f"Incompatible filters: {self}, {other}"
+
+    def __or__(self, other: "BloomFilter") -> "BloomFilter":
+        self._check_compatible(other)
+        return BloomFilter(self.n_bits, self.n_hashes, self.bits | other.bits)
+
+    def __and__(self, other: "BloomFilter") -> "BloomFilter":
+        self._check_compatible(other)
+        return BloomFilter(self.n_bits, self.n_hashes, self.bits & other.bits)
+
+
+class HyperLogLog:
+    """HyperLogLog counter of distinct items, with `2 ** precision` registers."""
+
+    def __init__(self, precision: int = DEFAULT_HLL_PRECISION, registers: np.ndarray = None):
+        self.precision = int(precision)
+        self.registers = registers if registers is not None else np.zeros(1 << self.precision, dtype=np.uint8)
+
+    def __repr__(self):
+        return f"<HyperLogLog precision={self.precision} count~{self.count()}>"
+
+    def add_hashes(self, hashes: np.ndarray):
+        values = hashes[:, 0]
+        p = np.uint64(self.precision)
+        index = values >> (np.uint64(64) - p)
+        rest = values & ((np.uint64(1) << (np.uint64(64) - p)) - np.uint64(1))
+        ranks = (np.uint64(64) - p - _bit_length(rest) + np.uint64(1)).astype(np.uint8)
+        np.maximum.at(self.registers, index, ranks)
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # small range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        assert self.precision == other.precision, f"Incompatible counters: {self}, {other}"
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+
+class DuplicateSketch:
+    """Sketch of the IDs seen more than once in a stream of IDs.
+
+    Every ID is checked against the `seen` filter before being added to it:
+    IDs already (probably) seen go into the `duplicates` filter. Two sketches
+    are merged with `duplicates = D1 | D2 | (S1 & S2)`, so that an ID seen
+    once in each of two partitions is a candidate too. Per newspaper (the
+    prefix of IDs), the number of IDs and a HyperLogLog count of distinct IDs
+    are kept, which give the approximate number of duplicates.
+
+    :meth:`is_candidate` has no false negatives: only the IDs it returns
+    `True` for need to be verified exactly.
+    """
+
+    def __init__(
+        self,
+        capacity: int = DEFAULT_CAPACITY,
+        error_rate: float = DEFAULT_ERROR_RATE,
+        precision: int = DEFAULT_HLL_PRECISION,
+    ):
+        self.seen = BloomFilter.for_capacity(capacity, error_rate)
+        self.duplicates = BloomFilter(self.seen.n_bits, self.seen.n_hashes)
+        self.precision = precision
+        self.counts = {}
+        self.distinct = {}
+        self._pending = []
+
+    def __repr__(self):
+        return f"<DuplicateSketch newspapers={len(self.counts)} ids={sum(self.counts.values())} {self.seen}>"
+
+    def __getstate__(self):
+        self.flush()
+        return self.__dict__
+
+    def add(self, ids: Iterable[str]):
+        self._pending.extend(ids)
+        if len(self._pending) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Add the buffered IDs to the sketches."""
+        if not self._pending:
+            return
+        ids, self._pending = self._pending, []
+        hashes = hash_ids(ids)
+
+        # IDs seen in previous batches, or earlier in this one
+        is_first = np.zeros(len(ids), dtype=bool)
+        is_first[np.unique(hashes, axis=0, return_index=True)[1]] = True
+        repeated = self.seen.contains_hashes(hashes) | ~is_first
+
+        self.duplicates.add_hashes(hashes[repeated])
+        self.seen.add_hashes(hashes)
+
+        newspapers = np.array([i.split("-")[0] for i in ids])
+        for newspaper in map(str, np.unique(newspapers)):
+            mask = newspapers == newspaper
+            self.counts[newspaper] = self.counts.get(newspaper, 0) + int(mask.sum())
+            if newspaper not in self.distinct:
+                self.distinct[newspaper] = HyperLogLog(self.precision)
+            self.distinct[newspaper].add_hashes(hashes[mask])
+
+    def merge(self, other: "DuplicateSketch") -> "DuplicateSketch":
+        self.flush()
+        other.flush()
+        self.duplicates = self.duplicates | other.duplicates | (self.seen & other.seen)
+        self.seen = self.seen | other.seen
+        for newspaper, count in other.counts.items():
+            self.counts[newspaper] = self.counts.get(newspaper, 0) + count
+            if newspaper in self.distinct:
+                self.distinct[newspaper].merge(other.distinct[newspaper])
+            else:
+                self.distinct[newspaper] = other.distinct[newspaper]
+        return self
+
+    def is_candidate(self, ids: List[str]) -> np.ndarray:
+        """Tell for each ID whether it may occur more than once (boolean array)."""
+        self.flush()
+        if not ids:
+            return np.zeros(0, dtype=bool)
+        return self.duplicates.contains_hashes(hash_ids(ids))
+
+    def estimates(self) -> Dict[str, dict]:
+        """Approximate number of IDs, distinct IDs and duplicated occurrences per newspaper."""
+        self.flush()
+        estimates = {}
+        for newspaper, count in sorted(self.counts.items()):
+            distinct = min(self.distinct[newspaper].count(), count)
+            estimates[newspaper] = {"n_ids": count, "n_distinct": distinct, "n_duplicates": count - distinct}
+        return estimates
+
+    def save(self, path: str, fingerprint: str = ""):
+        """Save the sketch to a `.npz` file, with the fingerprint of the data it was built from."""
+        self.flush()
+        newspapers = sorted(self.counts)
+        np.savez_compressed(
+            path,
+            params=np.array([self.seen.n_bits, self.seen.n_hashes, self.precision], dtype=np.int64),
+            fingerprint=np.array(fingerprint),
+            seen=self.seen.bits,
+            duplicates=self.duplicates.bits,
+            newspapers=np.array(newspapers, dtype=str),
+            counts=np.array([self.counts[newspaper] for newspaper in newspapers], dtype=np.int64),
+            registers=np.array([self.distinct[newspaper].registers for newspaper in newspapers], dtype=np.uint8).reshape(
+                len(newspapers), 1 << self.precision
+            ),
+        )
+
+    @classmethod
+    def load(cls, path: str, fingerprint: str = None) -> "DuplicateSketch":
+        """Load a sketch saved with :meth:`save`.
+
+        :raises ValueError: If `fingerprint` is given and the sketch was built
+            from other data.
+        """
+        with np.load(path) as data:
+            saved = str(data["fingerprint"]) if "fingerprint" in data.files else ""
+            if fingerprint is not None and saved != fingerprint:
+                raise ValueError(f"Sketch {path} was built from other data ({saved!r} instead of {fingerprint!r})")
+            n_bits, n_hashes, precision = (int(v) for v in data["params"])
+            sketch = cls.__new__(cls)
+            sketch.seen = BloomFilter(n_bits, n_hashes, data["seen"])
+            sketch.duplicates = BloomFilter(n_bits, n_hashes, data["duplicates"])
+            sketch.precision = precision
+            sketch.counts = {str(newspaper): int(count) for newspaper, count in zip(data["newspapers"], data["counts"])}
+            sketch.distinct = {
+                str(newspaper): HyperLogLog(precision, registers.copy())
+                for newspaper, registers in zip(data["newspapers"], data["registers"])
+            }
+            sketch._pending = []
+        return sketch
@@ -0,0 +1,282 @@
+r"""Streaming, compressed and sorted format of content item ID snapshots.
+
+A snapshot is a directory (local or s3) with one sub-directory per newspaper,
+holding the sorted IDs of the newspaper in gzip-compressed chunks of at most
+`chunk_size` IDs, and a small header::
+
+    <snapshot>/HEADER.json
+    <snapshot>/GDL/00000.txt.gz
+    <snapshot>/GDL/00001.txt.gz
+    <snapshot>/JDG/00000.txt.gz
+
+(the chunks of a newspaper written in several parts, e.g. by parallel
+tasks, are named `<part>-00000.txt.gz` instead, see
+:func:`merge_newspaper_entries`).
+
+Within a chunk, IDs are front-coded: each line holds the length of the prefix
+shared with the previous ID and the rest of the ID, e.g.::
+
+    0\tGDL-1900-01-01-a-i0001
+    21\t2
+    13\t2-a-i0001
+
+The header holds the number of IDs and the range (`first`, `last`) of the
+snapshot, of each newspaper and of each chunk. It is written last, so that
+only complete snapshots have one.
+
+Snapshots are written and read as streams: memory does not depend on the
+number of IDs. Since the IDs of a newspaper all start with its ID followed by
+`-`, reading the newspapers in sorted order yields all IDs in sorted order
+(see :mod:`sanity_check.contents.sorted_diff` to compare two snapshots).
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+from itertools import chain, islice
+from typing import Iterable, Iterator, List, Optional
+
+import fsspec
+
+FORMAT_VERSION = 1
+HEADER_FILE = "HEADER.json"
+# about 1-2MB of compressed IDs per chunk
+CHUNK_SIZE = 1000000
+
+
+def _common_prefix_length(previous: str, current: str) -> int:
+    n = 0
+    for a, b in zip(previous, current):
+        if a != b:
+            break
+        n += 1
+    return n
+
+
+def encode_ids(ids: Iterable[str]) -> Iterator[str]:
+    """Front-code sorted IDs, one line per ID (see the module docstring)."""
+    previous = ""
+    for ci_id in ids:
+        n = _common_prefix_length(previous, ci_id)
+        yield f"{n}\t{ci_id[n:]}\n"
+        previous = ci_id
+
+
+def decode_ids(lines: Iterable[str]) -> Iterator[str]:
+    """Decode front-coded lines back into IDs."""
+    previous = ""
+    for line in lines:
+        n, suffix = line.rstrip("\n").split("\t", 1)
+        previous = previous[: int(n)] + suffix
+        yield previous
+
+
+def _write_chunk(path: str, chunk_file: str, ids: Iterable[str], previous: Optional[str], storage_options: dict) -> dict:
+    chunk = {"file": chunk_file, "n_ids": 0, "first": None, "last": None}
+
+    def _checked(ids):
+        last = previous
+        for ci_id in ids:
+            if last is not None and ci_id <= last:
+                raise ValueError(f"IDs are not sorted (or not unique): {ci_id} after {last}")
+            last = ci_id
+            chunk["n_ids"] += 1
+            chunk["first"] = chunk["first"] or ci_id
+            chunk["last"] = ci_id
+            yield ci_id
+
+    with fsspec.open(
+        os.path.join(path, chunk_file), "wt", compression="gzip", encoding="utf-8", **storage_options
+    ) as outfile:
+        outfile.writelines(encode_ids(_checked(ids)))
+    return chunk
+
+
+def _newspaper_entry(chunks: List[dict]) -> dict:
+    chunks = [chunk for chunk in chunks if chunk["n_ids"]]
+    return {
+        "n_ids": sum(chunk["n_ids"] for chunk in chunks),
+        "first": chunks[0]["first"] if chunks else None,
+        "last": chunks[-1]["last"] if chunks else None,
+        "chunks": chunks,
+    }
+
+
+def write_newspaper_chunks(
+    path: str,
+    newspaper: str,
+    ids: Iterable[str],
+    chunk_size: int = CHUNK_SIZE,
+    storage_options: dict = None,
+    part: str = None,
+) -> dict:
+    """Write the IDs of a newspaper, which must be sorted, in chunks.
+
+    This can run anywhere (e.g. on a dask worker): the returned entry is then
+    added to the header by :meth:`SnapshotWriter.add_newspaper`.
+
+    :param str path: Directory of the snapshot (local or s3).
+    :param str newspaper: Newspaper ID.
+    :param Iterable[str] ids: Sorted IDs of the newspaper, consumed lazily.
+    :param int chunk_size: Maximum number of IDs of each chunk.
+    :param dict storage_options: fsspec options of s3 snapshots.
+    :param str part: Name of the part of the newspaper (e.g. a range of
+        years) these IDs are, if it is written in several parts, whose
+        entries are then merged with :func:`merge_newspaper_entries`.
+    :return: The header entry of the newspaper (or of the part).
+    :rtype: dict
+
+    """
+    ids = iter(ids)
+    chunks = []
+    for first_id in ids:
+        chunk_ids = chain([first_id], islice(ids, chunk_size - 1))
+        previous = chunks[-1]["last"] if chunks else None
+        chunk_file = f"{newspaper}/{part}-{len(chunks):05}.txt.gz" if part else f"{newspaper}/{len(chunks):05}.txt.gz"
+        chunks.append(_write_chunk(path, chunk_file, chunk_ids, previous, storage_options or {}))
+
+    entry = _newspaper_entry(chunks)
+    print(f"Written {entry['n_ids']} IDs of {newspaper}{f' ({part})' if part else ''} in {len(chunks)} chunks")
+    return entry
+
+
+def merge_newspaper_entries(entries: List[dict]) -> dict:
+    """Stitch the entries of the parts of a newspaper (see `part` in :func:`write_newspaper_chunks`), in order.
+
+    :param List[dict] entries: Entries of the parts, in the order of their IDs.
+    :return: The header entry of the whole newspaper.
+    :rtype: dict
+    :raises ValueError: If the IDs of a part do not all come after those of
+        the previous parts.
+
+    """
+    chunks = [chunk for entry in entries for chunk in entry["chunks"]]
+    for previous, chunk in zip(chunks, chunks[1:]):
+        if chunk["first"] <= previous["last"]:
+            raise ValueError(f"IDs are not sorted (or not unique): {chunk['first']} after {previous['last']}")
+    return _newspaper_entry(chunks)
+
+
+class SnapshotWriter:
+    """Write a snapshot, one newspaper at a time.
+
+    Newspapers can be written concurrently (e.g. by a thread pool, or by dask
+    workers with :func:`write_newspaper_chunks`); the header is written when
+    the writer is closed.
+    """
+
+    def __init__(self, path: str, source: str, chunk_size: int = CHUNK_SIZE, storage_options: dict = None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.storage_options = storage_options or {}
+        self.header = {
+            "format_version": FORMAT_VERSION,
+            "source": source,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "chunk_size": chunk_size,
+            "newspapers": {},
+        }
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<SnapshotWriter {self.path}>"
+
+    def __enter__(self) -> "SnapshotWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # an incomplete snapshot gets no header
+        if exc_type is None:
+            self.close()
+
+    def add_newspaper(self, newspaper: str, entry: dict) -> None:
+        """Add the header entry of a newspaper written with :func:`write_newspaper_chunks`."""
+        with self._lock:
+            self.header["newspapers"][newspaper] = entry
+
+    def write_newspaper(self, newspaper: str, ids: Iterable[str]) -> dict:
+        """Write the sorted IDs of a newspaper (see :func:`write_newspaper_chunks`)."""
+        entry = write_newspaper_chunks(self.path, newspaper, ids, self.chunk_size, self.storage_options)
+        self.add_newspaper(newspaper, entry)
+        return entry
+
+    def close(self) -> dict:
+        """Write the header, and return it."""
+        with self._lock:
+            newspapers = self.header["newspapers"]
+            self.header["newspapers"] = {np: newspapers[np] for np in sorted(newspapers)}
+            entries = [entry for entry in self.header["newspapers"].values() if entry["n_ids"]]
+            self.header["n_ids"] = sum(entry["n_ids"] for entry in entries)
+            self.header["first"] = entries[0]["first"] if entries else None
+            self.header["last"] = entries[-1]["last"] if entries else None
+
+            with fsspec.open(os.path.join(self.path, HEADER_FILE), "w", encoding="utf-8", **self.storage_options) as f:
+                json.dump(self.header, f, indent=2)
+        print(f"Written snapshot of {self.header['n_ids']} IDs to {self.path}")
+        return self.header
+
+
+def read_header(path: str, storage_options: dict = None) -> dict:
+    """Read the header of a snapshot.
+
+    :raises ValueError: If the snapshot has no header (i.e. it is incomplete)
+        or was written in another format version.
+    """
+    header_path = os.path.join(path, HEADER_FILE)
+    try:
+        with fsspec.open(header_path, "r", encoding="utf-8", **(storage_options or {})) as infile:
+            header = json.load(infile)
+    except FileNotFoundError:
+        raise ValueError(f"{path} is not a complete snapshot: {HEADER_FILE} is missing")
+    if header.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {header.get('format_version')} in {path}")
+    return header
+
+
+def iter_snapshot(path: str, newspapers: List[str] = None, storage_options: dict = None) -> Iterator[str]:
+    """Stream the IDs of a snapshot, in sorted order.
+
+    :param str path: Directory of the snapshot (local or s3).
+    :param List[str] newspapers: Newspapers to read (default: all).
+    :param dict storage_options: fsspec options of s3 snapshots.
+    :return: The IDs of the snapshot.
+    :rtype: Iterator[str]
+
+    """
+    header = read_header(path, storage_options)
+    for newspaper, entry in header["newspapers"].items():
+        if newspapers is not None and newspaper not in newspapers:
+            continue
+        for chunk in entry["chunks"]:
+            yield from iter_chunk(path, chunk["file"], storage_options)
+
+
+def iter_chunk(path: str, chunk_file: str, storage_options: dict = None) -> Iterator[str]:
+    """Stream the IDs of a single chunk of a snapshot."""
+    with fsspec.open(
+        os.path.join(path, chunk_file), "rt", compression="gzip", encoding="utf-8", **(storage_options or {})
+    ) as infile:
+        yield from decode_ids(infile)
+
+
+def verify_snapshot(path: str, storage_options: dict = None) -> int:
+    """Stream a whole snapshot and check its IDs against its header.
+
+    :return: The number of IDs of the snapshot.
+    :rtype: int
+    :raises ValueError: If a chunk does not match its header entry.
+
+    """
+    header = read_header(path, storage_options)
+    previous = None
+    for newspaper, entry in header["newspapers"].items():
+        for chunk in entry["chunks"]:
+            n_ids, first = 0, None
+            for ci_id in iter_chunk(path, chunk["file"], storage_options):
+                if not ci_id.startswith(f"{newspaper}-") or (previous is not None and ci_id <= previous):
+                    raise ValueError(f"Chunk {chunk['file']} of {path} holds unsorted IDs or IDs of another newspaper")
+                n_ids, first, previous = n_ids + 1, first or ci_id, ci_id
+            if (n_ids, first, previous) != (chunk["n_ids"], chunk["first"], chunk["last"]):
+                raise ValueError(f"Chunk {chunk['file']} of {path} does not match its header")
+    return header["n_ids"]
@@ -1,57 +1,260 @@
-import os
-from smart_open import open as s_open
-import boto3
-from impresso_commons.utils.s3 import IMPRESSO_STORAGEOPT
-from impresso_db.base import engine
+"""Command-line script to take snapshots of the content item IDs of the MySQL DB or of a canonical bucket.
 
+Usage:
+    snapshots.py mysql --db-config=<db> --output=<path> [--newspapers=<nps> --chunk-size=<n>]
+    snapshots.py canonical --canonical-bucket=<cb> --output=<path> [--newspapers=<nps> --chunk-size=<n> --executor=<ex> --k8-memory=<mem> --k8-workers=<wkrs> --manifest-dir=<md> --manifest-max-age=<secs>]
+    snapshots.py info --snapshot=<path> [--verify]
 
-def take_mysql_snapshot():
-    """Fetch the list of content item IDs from MySQL."""
+Options:
 
-    db_config = os.environ["IMPRESSO_DB_CONFIG"]
-    print(f'Connecting to MySQL DB {db_config}')
+--executor=<ex>  Dask executor: k8 (cluster on Kubernetes), local (worker processes sized from the local CPUs and memory) or threads [default: k8]
+--k8-memory=<mem>  Memory of each worker of the k8 executor (default: planned from the size of the input files)
+--k8-workers=<wkrs>  Maximum number of workers of the k8 executor (default: planned from the size of the input files)
+--canonical-bucket=<cb>  S3 bucket where canonical JSON data will be read from
+--manifest-dir=<md>  Directory of the local manifest of s3 listings (if omitted, buckets are listed from scratch)
+--manifest-max-age=<secs>  Seconds during which cached listings are reused without any request: files added, removed or rewritten meanwhile are missed (default: 3600; 0 lists each prefix again once per run)
+--db-config=<db>  MySQL DB configuration (e.g. "dev", "prod"), or path of a local SQLite/DuckDB stand-in (see db_backends.py)
+--output=<path>  Directory (local or s3) where the snapshot is written
+--newspapers=<nps>  Newspaper IDs or glob patterns to restrict the snapshot to (e.g. "GDL JDG BL*")
+--chunk-size=<n>  Maximum number of IDs of each compressed chunk [default: 1000000]
+--snapshot=<path>  Directory (local or s3) of a snapshot
+--verify  Read the whole snapshot and check it against its header
 
-    with engine.connect() as db_conn:
-        q = "SELECT id FROM content_items;"
-        mysql_ids = db_conn.execute(q)
+Snapshots are written in the streaming, compressed and sorted format of
+:mod:`sanity_check.contents.snapshot_format`, one newspaper at a time: IDs are
+streamed from the DB in key order, so that memory does not depend on the size
+of the table. Snapshots of canonical buckets are in the same format, so that
+both sides (or two snapshots taken before and after an ingestion) can be
+compared with :mod:`sanity_check.contents.sorted_diff`; their newspapers are
+snapshotted in parallel by dask workers, by ranges of years.
 
-    ci_ids = [
-        db_id
-        for db_id in mysql_ids
-    ]
-    print(f'Fetched {len(ci_ids)} content item IDs from DB')
-    return ci_ids
+Example:
 
+    python sanity_check/contents/snapshots.py mysql --db-config=prod \
+    --output='s3://impresso-sanitycheck/snapshots/mysql-2020-05-01'
 
-def take_canonical_snapshot(input_bucket: str):
-    """Fetch the list of content item IDs from S3."""
+    python sanity_check/contents/snapshots.py canonical --canonical-bucket='s3://original-canonical-fixed' \
+    --output='s3://impresso-sanitycheck/snapshots/canonical-2020-05-01' --manifest-dir=./manifest
+"""  # noqa: E501
 
-    # fetch the list of newspapers from the DB
-    # use glob to get the list of issue files from s3
-    # return the list of content item ids
-    pass
+from typing import List, Tuple
 
+from dask import compute, delayed
+from docopt import docopt
 
-# TODO: make it work also with local directory not only s3
-def write_snapshot_to_s3(data: list, path: str):
+from sanity_check.contents.cluster import StageEstimate, dask_executor, plan_resources
+from sanity_check.contents.db_backends import db_label
+from sanity_check.contents.decoding import decode
+from sanity_check.contents.helpers import parse_newspapers
+from sanity_check.contents.manifest import enable_manifest_cache
+from sanity_check.contents.mysql import iter_ids, key_ranges, list_table_newspapers
+from sanity_check.contents.s3_data import (
+    get_storage_options,
+    iter_text_lines,
+    list_newspaper_file_sizes,
+    path_newspaper_year,
+    select_newspapers,
+)
+from sanity_check.contents.snapshot_format import (
+    CHUNK_SIZE,
+    SnapshotWriter,
+    merge_newspaper_entries,
+    read_header,
+    verify_snapshot,
+    write_newspaper_chunks,
+)
+
+CANONICAL_SNAPSHOT_FIELDS = ["i[*].m.id"]
+# size of the issue files read by each task (the IDs of a range are sorted in memory)
+MAX_RANGE_BYTES = 32 * 1024**2
+
+
+def _storage_options(path: str) -> dict:
+    return get_storage_options() if path.startswith("s3://") else {}
+
+
+def take_mysql_snapshot(
+    output_path: str, db_config: str = None, newspapers: list = None, chunk_size: int = CHUNK_SIZE
+) -> dict:
+    """Write a snapshot of the content item IDs of MySQL (or a local stand-in, see `db_backends.py`).
+
+    :param str output_path: Directory (local or s3) where the snapshot is written.
+    :param str db_config: DB configuration to use (e.g. "dev", "prod", etc.).
+    :param list newspapers: Newspaper IDs or glob patterns to restrict the snapshot to (optional).
+    :param int chunk_size: Maximum number of IDs of each compressed chunk.
+    :return: The header of the snapshot.
+    :rtype: dict
+
+    """
+    selected = sorted(select_newspapers(list_table_newspapers("content_items", db_config), newspapers))
+
+    with SnapshotWriter(output_path, f"mysql:{db_label(db_config)}", chunk_size, _storage_options(output_path)) as w:
+        for newspaper, key_range in zip(selected, key_ranges(selected)):
+            w.write_newspaper(newspaper, iter_ids("content_items", key_range, db_config))
+    return w.header
 
-    session = boto3.Session(
-        aws_access_key_id=IMPRESSO_STORAGEOPT['key'],
-        aws_secret_access_key=IMPRESSO_STORAGEOPT['secret'],
-    )
-    s3_endpoint = IMPRESSO_STORAGEOPT['client_kwargs']['endpoint_url']
 
-    transport_params = {
-        'session': session,
-        'resource_kwargs': {
-            'endpoint_url': s3_endpoint,
-        }
+def _sorted_canonical_ids(issue_files: List[str]) -> List[str]:
+    """Read the content item IDs of some issue files of a newspaper (e.g. a range of years), in sorted order.
+
+    Lines are streamed: only the IDs, not the decompressed files, are held
+    in memory.
+    """
+    ci_ids = {
+        ci["m"]["id"]
+        for path in issue_files
+        for line in iter_text_lines(path)
+        if line.strip()
+        for ci in decode(line, CANONICAL_SNAPSHOT_FIELDS).get("i", [])
     }
+    return sorted(ci_ids)
+
+
+def _snapshot_range(
+    output_path: str, newspaper: str, part: str, issue_files: List[str], chunk_size: int, storage_options
+) -> dict:
+    # run by a worker: the chunks of the range are written directly from there
+    return write_newspaper_chunks(
+        output_path, newspaper, _sorted_canonical_ids(issue_files), chunk_size, storage_options, part
+    )
+
+
+def _year_ranges(file_sizes: List[Tuple[str, int]], max_bytes: int) -> List[Tuple[str, List[str]]]:
+    """Split the issue files of a newspaper into ranges of consecutive years of at most `max_bytes` (if possible).
+
+    Content item IDs start with the newspaper ID and the year, so that the
+    IDs of consecutive ranges follow each other. A file without a year in its
+    name may hold IDs of any year: the newspaper is then a single range.
+
+    :return: The name (`<first year>-<last year>`) and the files of each
+        range, in order.
+    :rtype: List[Tuple[str, List[str]]]
+
+    """
+    by_year = {}
+    for path, size in file_sizes:
+        by_year.setdefault(path_newspaper_year(path)[1], []).append((path, size))
+    if None in by_year:
+        return [("all", sorted(path for path, _ in file_sizes))]
+
+    ranges, years, files, size = [], [], [], 0
+    for year in sorted(by_year):
+        year_size = sum(file_size for _, file_size in by_year[year])
+        if files and size + year_size > max_bytes:
+            ranges.append((f"{years[0]}-{years[-1]}", files))
+            years, files, size = [], [], 0
+        years.append(year)
+        files += sorted(path for path, _ in by_year[year])
+        size += year_size
+    if files:
+        ranges.append((f"{years[0]}-{years[-1]}", files))
+    return ranges
+
+
+def take_canonical_snapshot(
+    input_bucket: str,
+    output_path: str,
+    newspapers: list = None,
+    chunk_size: int = CHUNK_SIZE,
+    issue_file_sizes: List[Tuple[str, int]] = None,
+) -> dict:
+    """Write a snapshot of the content item IDs of a canonical bucket, in the same format as MySQL's.
+
+    Each newspaper is split into ranges of consecutive years (see
+    :func:`_year_ranges`), and each range is a dask task, which reads its
+    issue files and writes its own chunks: ranges are snapshotted in
+    parallel, the largest newspapers first, and only their header entries
+    are sent back, to be stitched in order (see
+    :func:`sanity_check.contents.snapshot_format.merge_newspaper_entries`).
+    Issue files are listed once, from the local manifest if enabled (see
+    `--manifest-dir`).
+
+    :param str input_bucket: S3 bucket with canonical data.
+    :param str output_path: Directory (local or s3) where the snapshot is written.
+    :param list newspapers: Newspaper IDs or glob patterns to restrict the snapshot to (optional).
+    :param int chunk_size: Maximum number of IDs of each compressed chunk.
+    :param List[Tuple[str, int]] issue_file_sizes: Issue files and their sizes,
+        if already listed (see :func:`list_newspaper_file_sizes`).
+    :return: The header of the snapshot.
+    :rtype: dict
+
+    """
+    if issue_file_sizes is None:
+        issue_file_sizes = list_newspaper_file_sizes(input_bucket, "{np}/issues/", newspapers)
+
+    files_by_newspaper = {}
+    for path, size in issue_file_sizes:
+        newspaper, _ = path_newspaper_year(path)
+        files_by_newspaper.setdefault(newspaper, []).append((path, size))
+    ranges = {np: _year_ranges(file_sizes, MAX_RANGE_BYTES) for np, file_sizes in files_by_newspaper.items()}
+    print(
+        f"Snapshotting {len(issue_file_sizes)} issue files of {len(files_by_newspaper)} newspapers "
+        f"in {sum(len(newspaper_ranges) for newspaper_ranges in ranges.values())} ranges of years"
+    )
+
+    storage_options = _storage_options(output_path)
+    largest_first = sorted(files_by_newspaper, key=lambda np: -sum(size for _, size in files_by_newspaper[np]))
+    tasks = [
+        delayed(_snapshot_range)(output_path, newspaper, part, files, chunk_size, storage_options)
+        for newspaper in largest_first
+        for part, files in ranges[newspaper]
+    ]
+    entries = iter(compute(*tasks))
+
+    with SnapshotWriter(output_path, f"canonical:{input_bucket}", chunk_size, storage_options) as writer:
+        for newspaper in largest_first:
+            writer.add_newspaper(newspaper, merge_newspaper_entries([next(entries) for _ in ranges[newspaper]]))
+    return writer.header
+
+
+def print_snapshot_info(path: str, verify: bool = False) -> None:
+    storage_options = _storage_options(path)
+    header = read_header(path, storage_options)
+    print(f"Snapshot {path} of {header['source']}, taken on {header['created']}: {header['n_ids']} IDs")
+    for newspaper, entry in header["newspapers"].items():
+        print(f"  {newspaper}: {entry['n_ids']} IDs in {len(entry['chunks'])} chunks ({entry['first']} - {entry['last']})")
+    if verify:
+        verify_snapshot(path, storage_options)
+        print("All chunks match the header")
+
+
+def main():
+    arguments = docopt(__doc__)
+
+    if arguments['mysql']:
+        take_mysql_snapshot(
+            arguments['--output'],
+            arguments['--db-config'],
+            parse_newspapers(arguments['--newspapers']),
+            int(arguments['--chunk-size']),
+        )
+    elif arguments['canonical']:
+        canonical_bucket = arguments['--canonical-bucket']
+        newspapers = parse_newspapers(arguments['--newspapers'])
+        executor = arguments['--executor']
+        workers = int(arguments['--k8-workers']) if arguments['--k8-workers'] else None
+
+        if arguments['--manifest-dir']:
+            max_age = arguments['--manifest-max-age']
+            enable_manifest_cache(arguments['--manifest-dir'], float(max_age) if max_age else None)
+
+        issue_file_sizes = list_newspaper_file_sizes(canonical_bucket, '{np}/issues/', newspapers)
+        # nothing to plan if the resources are given
+        plan = None
+        if executor != 'threads' and not (arguments['--k8-memory'] and workers):
+            plan = plan_resources([StageEstimate('canonical issues', issue_file_sizes)])
 
-    with s_open(path, 'w', transport_params=transport_params) as outfile:
-        outfile.write("\n".join(data))
-    return
+        with dask_executor(executor, arguments['--k8-memory'], workers, plan):
+            take_canonical_snapshot(
+                canonical_bucket,
+                arguments['--output'],
+                newspapers,
+                int(arguments['--chunk-size']),
+                issue_file_sizes,
+            )
+    elif arguments['info']:
+        print_snapshot_info(arguments['--snapshot'], arguments['--verify'])
 
 
-mysql_ci_ids = take_mysql_snapshot()
-print(len(mysql_ci_ids))
+if __name__ == '__main__':
+    main()
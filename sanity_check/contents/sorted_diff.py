@@ -0,0 +1,64 @@
+"""Streaming set difference of sorted sequences.
+
+Instead of building sets (or joining dataframes) to find the values present
+on only one side, both sides are sorted once and walked together, so that
+only the mismatches are kept in memory.
+"""
+
+from typing import Iterable, Iterator, Tuple
+
+_END = object()
+
+
+def _unique(values: Iterable) -> Iterator:
+    """Drop consecutive repeated values of a sorted iterable."""
+    previous = _END
+    for value in values:
+        if value != previous:
+            yield value
+            previous = value
+
+
+def sorted_difference(left: Iterable, right: Iterable) -> Iterator[Tuple[object, bool]]:
+    """Merge-walk two sorted iterables and yield the values found on one side only.
+
+    Both sides are consumed lazily and exactly once; repeated values are
+    treated as one (set semantics).
+
+    :param Iterable left: Values sorted in ascending order.
+    :param Iterable right: Values sorted in ascending order.
+    :return: Pairs of (value, `True` if only in `left` / `False` if only in
+        `right`), in ascending order of values.
+    :rtype: Iterator[Tuple[object, bool]]
+
+    """
+    left, right = _unique(left), _unique(right)
+    a, b = next(left, _END), next(right, _END)
+
+    while a is not _END and b is not _END:
+        if a == b:
+            a, b = next(left, _END), next(right, _END)
+        elif a < b:
+            yield a, True
+            a = next(left, _END)
+        else:
+            yield b, False
+            b = next(right, _END)
+
+    while a is not _END:
+        yield a, True
+        a = next(left, _END)
+    while b is not _END:
+        yield b, False
+        b = next(right, _END)
+
+
+def split_difference(left: Iterable, right: Iterable) -> Tuple[list, list]:
+    """Return the values found only in `left` and those found only in `right`.
+
+    See :func:`sorted_difference`; inputs must be sorted.
+    """
+    only_left, only_right = [], []
+    for value, in_left in sorted_difference(left, right):
+        (only_left if in_left else only_right).append(value)
+    return only_left, only_right
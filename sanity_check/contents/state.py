@@ -0,0 +1,123 @@
+"""Per-newspaper state of incremental sanity checks.
+
+For every newspaper of a bucket, the state directory keeps the ETags of the
+input objects (issue and page files) of the last run that checked it,
+together with the part of each check result that concerns this newspaper::
+
+    <state_dir>/<bucket>/<newspaper>/state.json
+    <state_dir>/<bucket>/<newspaper>/<result name>.pkl
+
+A new run re-checks only the newspapers whose objects were added, removed or
+overwritten (different ETags), or that were checked with another
+configuration (e.g. other years), and reuses the stored results of the
+others.
+"""
+
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+STATE_FILENAME = "state.json"
+
+
+def newspaper_etags(bucket_name: str, newspapers: List[str] = None, years: List[int] = None) -> Dict[str, Dict[str, str]]:
+    """List the ETags of the issue and page files of each selected newspaper.
+
+    The manifest (if any) is bypassed, as cached listings do not reflect
+    objects overwritten in place.
+
+    :return: A dictionary `{newspaper: {key: etag}}`; newspapers without any
+        issue or page file are left out.
+    :rtype: Dict[str, Dict[str, str]]
+
+    """
+    # imported here to avoid a circular import
+    from sanity_check.contents.s3_data import (
+        _listing_prefixes,
+        list_newspapers,
+        list_prefix_objects,
+        path_newspaper_year,
+        select_newspapers,
+    )
+
+    selected = select_newspapers(list_newspapers(bucket_name), newspapers)
+    prefixes = _listing_prefixes(selected, "{np}/issues/", years) + _listing_prefixes(selected, "{np}/pages/", years)
+
+    etags = {}
+    years = set(years) if years is not None else None
+    for obj in list_prefix_objects(bucket_name, prefixes, use_manifest=False):
+        newspaper = obj["key"].split("/")[0]
+        if years is not None and path_newspaper_year(obj["key"])[1] not in years:
+            continue
+        etags.setdefault(newspaper, {})[obj["key"]] = obj["etag"]
+    return etags
+
+
+def newspaper_of_rows(df: pd.DataFrame) -> pd.Index:
+    """Return the newspaper ID of each row of a check result."""
+    if "newspaper_id" in df.columns:
+        return pd.Index(df["newspaper_id"])
+    # e.g. indexed by newspaper, or by newspaper and content item type
+    assert "newspaper_id" in df.index.names, f"Cannot tell the newspaper of rows with columns {list(df.columns)}"
+    return df.index.get_level_values("newspaper_id")
+
+
+def split_by_newspaper(df: pd.DataFrame, newspapers: List[str]) -> Dict[str, pd.DataFrame]:
+    """Split a check result into one (possibly empty) frame per newspaper."""
+    newspaper_ids = newspaper_of_rows(df)
+    return {newspaper: df[newspaper_ids == newspaper] for newspaper in newspapers}
+
+
+class CheckState:
+    """Per-newspaper ETags and results of the checks of a bucket."""
+
+    def __init__(self, state_dir: str, bucket_name: str):
+        self.state_dir = state_dir
+        self.bucket = bucket_name.replace("s3://", "").split("/")[0]
+
+    def __repr__(self):
+        return f"<CheckState bucket={self.bucket} dir={self.state_dir}>"
+
+    def _newspaper_dir(self, newspaper: str) -> str:
+        return os.path.join(self.state_dir, self.bucket, newspaper)
+
+    def load(self, newspaper: str) -> Optional[dict]:
+        """Load the state of a newspaper (`None` if it was never checked)."""
+        path = os.path.join(self._newspaper_dir(newspaper), STATE_FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as infile:
+            return json.load(infile)
+
+    def is_current(self, newspaper: str, etags: Dict[str, str], config: dict) -> bool:
+        """Tell whether the stored results of a newspaper are still valid."""
+        state = self.load(newspaper)
+        return state is not None and state["etags"] == etags and state["config"] == config
+
+    def results(self, newspaper: str) -> Dict[str, pd.DataFrame]:
+        """Load the stored results of a newspaper."""
+        state = self.load(newspaper)
+        return {
+            name: pd.read_pickle(os.path.join(self._newspaper_dir(newspaper), f"{name}.pkl"))
+            for name in state["results"]
+        }
+
+    def save(self, newspaper: str, etags: Dict[str, str], config: dict, results: Dict[str, pd.DataFrame]) -> None:
+        """Store the ETags and results of a newspaper that was just checked."""
+        newspaper_dir = self._newspaper_dir(newspaper)
+        os.makedirs(newspaper_dir, exist_ok=True)
+
+        for name, df in results.items():
+            df.to_pickle(os.path.join(newspaper_dir, f"{name}.pkl"))
+
+        # the state file is written last (and atomically): results are only
+        # reused once all of them were written
+        state = {"checked_at": time.time(), "config": config, "etags": etags, "results": sorted(results)}
+        path = os.path.join(newspaper_dir, STATE_FILENAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as outfile:
+            json.dump(state, outfile)
+        os.replace(tmp_path, path)
@@ -1,13 +1,26 @@
 """Command-line script to generate stats about impresso corpus/data.
 
 Usage:
-    stats.py s3 --input-bucket=<ib> --output-dir=<od> [--id-field=<id> --k8-memory=<mem> --k8-workers=<wkrs>]
-    stats.py mysql --db-config=<dbcfg> --output-dir=<od> [--k8-memory=<mem> --k8-workers=<wkrs>]
-    stats.py corpus --canonical-bucket=<cb> --rebuilt-bucket=<rb> --db-config=<db> --output-dir=<od> --output-bucket=<ob> [--k8-memory=<mem> --k8-workers=<wkrs>]
+    stats.py s3 --input-bucket=<ib> --output-dir=<od> [--id-field=<id> --executor=<ex> --k8-memory=<mem> --k8-workers=<wkrs> --manifest-dir=<md> --manifest-max-age=<secs> --newspapers=<nps> --years=<yrs>]
+    stats.py mysql --db-config=<dbcfg> --output-dir=<od> [--executor=<ex> --k8-memory=<mem> --k8-workers=<wkrs> --aggregate-in-db]
+    stats.py corpus --canonical-bucket=<cb> --rebuilt-bucket=<rb> --db-config=<db> --output-dir=<od> --output-bucket=<ob> [--executor=<ex> --k8-memory=<mem> --k8-workers=<wkrs> --manifest-dir=<md> --manifest-max-age=<secs> --index-dir=<idx> --index-version=<v> --newspapers=<nps> --years=<yrs> --checkpoint-dir=<cd> --resume]
 
 Options:
 
+--executor=<ex>  Dask executor: k8 (cluster on Kubernetes), local (worker processes sized from the local CPUs and memory) or threads [default: k8]
+--k8-memory=<mem>  Memory of each worker of the k8 executor (default: planned from the size of the input files)
+--k8-workers=<wkrs>  Maximum number of workers of the k8 executor (default: planned from the size of the input files)
 --input-bucket=<ib>  TODO
+--db-config=<db>  MySQL DB configuration (e.g. "dev", "prod"), or path of a local SQLite/DuckDB stand-in (see db_backends.py)
+--manifest-dir=<md>  Directory of the local manifest of s3 listings (if omitted, buckets are listed from scratch)
+--manifest-max-age=<secs>  Seconds during which cached listings are reused without any request: files added, removed or rewritten meanwhile are missed (default: 3600; 0 lists each prefix again once per run)
+--index-dir=<idx>  Read canonical data from the Parquet index in this directory (see index.py) instead of bz2 files
+--index-version=<v>  Version of the index to read, even if the bucket changed since it was built (default: the latest version, which must match the bucket)
+--newspapers=<nps>  Newspaper IDs or glob patterns to restrict the run to (e.g. "GDL JDG BL*")
+--years=<yrs>  Years or year ranges to restrict the run to (e.g. "1850-1860 1900")
+--aggregate-in-db  Count content items per newspaper and year with a grouped query in the DB instead of fetching their IDs
+--checkpoint-dir=<cd>  Directory where partial results are checkpointed, one shard per newspaper
+--resume  With --checkpoint-dir, skip the newspapers whose partial results were already checkpointed
 
 Example:
 
@@ -15,25 +28,33 @@ Example:
 """  # noqa: E501
 
 import os
-import json
 
 # import ipdb  # TODO remove later on
 import pandas as pd
-from dask_k8 import DaskCluster
-from dask import bag as db
+from dask import delayed
 from docopt import docopt
 from pathlib import Path
 import tabulate
 
-from impresso_commons.utils.s3 import IMPRESSO_STORAGEOPT, fixed_s3fs_glob
-from impresso_commons.utils.s3 import alternative_read_text
-from impresso_commons.utils.kube import (
-    make_scheduler_configuration,
-    make_worker_configuration,
+from sanity_check.contents.bz2_chunks import read_lines
+from sanity_check.contents.checkpoints import Checkpoint, run_dask_shards
+from sanity_check.contents.cluster import StageEstimate, dask_executor, plan_resources
+from sanity_check.contents.db_backends import db_label
+from sanity_check.contents.decoding import decode, extract_field
+from sanity_check.contents.helpers import parse_newspapers, parse_years
+from sanity_check.contents.index import pin_index_version
+from sanity_check.contents.manifest import enable_manifest_cache
+from sanity_check.contents.mysql import content_item_counts as mysql_content_item_counts
+from sanity_check.contents.mysql import fetch_ids as mysql_fetch_ids
+from sanity_check.contents.mysql import iter_rows
+from sanity_check.contents.s3_data import (
+    fetch_issue_ids,
+    fetch_issue_ids_rebuilt,
+    fetch_issues,
+    get_storage_options,
+    list_file_sizes,
+    list_newspaper_file_sizes,
 )
-from sanity_check.contents.mysql import list_issues as mysql_list_issues
-from sanity_check.contents.mysql import list_content_items as mysql_list_content_items
-from sanity_check.contents.s3_data import fetch_issue_ids, fetch_issue_ids_rebuilt, fetch_issues
 
 
 def fetch_newspapers_metadata(db_config: str = None) -> pd.DataFrame:
@@ -44,18 +65,8 @@ def fetch_newspapers_metadata(db_config: str = None) -> pd.DataFrame:
     :rtype: pd.DataFrame
 
     """
-    if db_config:
-        os.environ["IMPRESSO_DB_CONFIG"] = db_config
-
-    config = os.environ["IMPRESSO_DB_CONFIG"]
-    print(f'Connecting to MySQL DB {config}')
-
-    # it needs to be imported here (not earlier!) otherwise we can't change/overwrite the DB config
-    from impresso_db.base import engine
-
-    with engine.connect() as db_conn:
-        q = "SELECT id,title, start_year, end_year FROM newspapers;"
-        mysql_data = db_conn.execute(q)
+    q = "SELECT id,title, start_year, end_year FROM newspapers;"
+    mysql_data = iter_rows(q, db_config=db_config)
 
     np_ids = [{"id": datum[0], "title": datum[1], "start_year": datum[2], "end_year": datum[3]} for datum in mysql_data]
     print(f'Fetched {len(np_ids)} newspaper IDs from DB')
@@ -68,17 +79,29 @@ def fetch_newspapers_metadata(db_config: str = None) -> pd.DataFrame:
     return df
 
 
-def fetch_access_rights(s3_canonical_bucket: str, output_dir: str) -> pd.DataFrame:
+def fetch_access_rights(
+    s3_canonical_bucket: str, output_dir: str, index_dir: str = None, newspapers: list = None, years: list = None
+) -> pd.DataFrame:
     """Fetches license information (access rights) per newspaper issue.
 
     :param str s3_canonical_bucket: S3 bucket with canonical data.
     :param str output_dir: Directory where to store intermediate pickle.
+    :param str index_dir: Directory of the Parquet index of `s3_canonical_bucket` (optional).
+    :param list newspapers: Newspaper IDs or glob patterns to restrict the stats to (optional).
+    :param list years: Years to restrict the stats to (optional).
     :return: A pandas DataFrame withe issue ID as the index and a `license` column.
     :rtype: pd.DataFrame
 
     """
 
-    issue_bag = fetch_issues(s3_canonical_bucket, compute=False)
+    issue_bag = fetch_issues(
+        s3_canonical_bucket,
+        compute=False,
+        fields=['id', 'ar'],
+        index_dir=index_dir,
+        newspapers=newspapers,
+        years=years,
+    )
 
     license_df = (
         issue_bag.map(lambda i: {"issue_id": i['id'], "license": i['ar']})
@@ -98,16 +121,28 @@ def fetch_access_rights(s3_canonical_bucket: str, output_dir: str) -> pd.DataFra
     return license_df
 
 
-def compute_canonical_stats(s3_canonical_bucket: str) -> pd.DataFrame:
+def compute_canonical_stats(
+    s3_canonical_bucket: str, index_dir: str = None, newspapers: list = None, years: list = None
+) -> pd.DataFrame:
     """Computes number of issues and pages per newspaper from canonical data in s3.
 
     :param str s3_canonical_bucket: S3 bucket with canonical data.
+    :param str index_dir: Directory of the Parquet index of `s3_canonical_bucket` (optional).
+    :param list newspapers: Newspaper IDs or glob patterns to restrict the stats to (optional).
+    :param list years: Years to restrict the stats to (optional).
     :return: A pandas DataFrame with newspaper ID as the index and columns `n_issues`, `n_pages`.
     :rtype: pd.DataFrame
 
     """
 
-    s3_canonical_issues = fetch_issues(s3_canonical_bucket, compute=False)
+    s3_canonical_issues = fetch_issues(
+        s3_canonical_bucket,
+        compute=False,
+        fields=['id', 'pp'],
+        index_dir=index_dir,
+        newspapers=newspapers,
+        years=years,
+    )
 
     pages_count_df = (
         s3_canonical_issues.map(
@@ -128,101 +163,143 @@ def compute_canonical_stats(s3_canonical_bucket: str) -> pd.DataFrame:
     return df
 
 
-def compute_rebuilt_stats(s3_rebuilt_bucket: str, s3_canonical_bucket: str, output_dir: str) -> pd.DataFrame:
+def _counts_frame(counts: list) -> pd.DataFrame:
+    return pd.DataFrame(
+        [{"type": ci_type, "n_content_items": n, "n_tokens": n_tokens} for ci_type, (n, n_tokens) in counts],
+        columns=["type", "n_content_items", "n_tokens"],
+    ).set_index('type')
+
+
+def _rebuilt_newspaper_stats(rebuilt_files: list):
+    """Count the content items and tokens of each type in the rebuilt files of a newspaper.
+
+    The counts are returned as a lazy dataframe (a dask delayed object), so
+    that the newspapers can be computed together (see :func:`run_dask_shards`).
+    """
+    counts = (
+        read_lines(rebuilt_files, storage_options=get_storage_options())
+        .map(decode, fields=['tp', 'ft'])
+        .map(lambda i: (i['tp'], len(i['ft'].split()) if "ft" in i else 0))
+        .foldby(
+            lambda item: item[0],
+            lambda acc, item: (acc[0] + 1, acc[1] + item[1]),
+            (0, 0),
+            lambda a, b: (a[0] + b[0], a[1] + b[1]),
+            (0, 0),
+        )
+    )
+    return delayed(_counts_frame)(counts)
+
+
+def compute_rebuilt_stats(
+    s3_rebuilt_bucket: str,
+    s3_canonical_bucket: str,
+    output_dir: str,
+    index_dir: str = None,
+    newspapers: list = None,
+    years: list = None,
+    checkpoint_dir: str = None,
+    resume: bool = False,
+) -> pd.DataFrame:
     """Computes number of tokens and images per newspaper from rebuilt data in s3.
 
     ..note::
 
-        In the process, it also fetches license information per issue and adds it to each content item.
-        This intermediate dask dataframe is then serialized for future (re-)use to s3 as per `s3_canonical_bucket`
+        In the process, it also fetches license information per issue (see `fetch_access_rights`),
+        whose breakdown by year is serialized to `output_dir`.
+
+    Each newspaper is processed as a separate shard (see :mod:`sanity_check.contents.checkpoints`):
+    if `checkpoint_dir` is given, the counts of each newspaper are written there as soon as they are
+    computed, and a run with `resume=True` only processes the newspapers that were not done yet.
 
     :param str s3_rebuilt_bucket: S3 bucket with rebuilt data.
     :param str s3_canonical_bucket: S3 bucket with canonical data.
     :param str output_dir: Description of parameter `output_dir`.
+    :param str index_dir: Directory of the Parquet index of `s3_canonical_bucket` (optional).
+    :param list newspapers: Newspaper IDs or glob patterns to restrict the stats to (optional).
+    :param list years: Years to restrict the stats to (optional).
+    :param str checkpoint_dir: Directory where the counts of each newspaper are checkpointed (optional).
+    :param bool resume: Whether to reuse the counts found in `checkpoint_dir`.
     :return: A pandas DataFrame with newspaper ID as the index and columns `n_tokens`, `n_images`.
     :rtype: pd.DataFrame
 
     """
 
-    rebuilt_files = fixed_s3fs_glob(f'{s3_rebuilt_bucket}/*.bz2')
+    rebuilt_files = list_file_sizes(s3_rebuilt_bucket, newspapers=newspapers, years=years)
     print(f"Found {len(rebuilt_files)} files")
 
-    rebuilt_data = (
-        db.from_sequence(rebuilt_files, partition_size=10)
-        .map(alternative_read_text, IMPRESSO_STORAGEOPT)
-        .flatten()
-        .map(json.loads)
-        .map(
-            lambda i: {
-                "id": i['id'],
-                "year": i['id'].split('-')[1],
-                "newspaper": i['id'].split('-')[0],
-                "issue_id": "-".join(i['id'].split("-")[:-1]),
-                "type": i['tp'],
-                "n_tokens": len(i['ft'].split()) if "ft" in i else None,
-                "title_length": len(i['t']) if "t" in i and i['t'] else None,
-            }
-        )
-        .persist()
-    )
-
-    rebuilt_df = (
-        rebuilt_data.to_dataframe(
-            meta={
-                "id": str,
-                "year": str,
-                "newspaper": str,
-                "issue_id": str,
-                "type": str,
-                "n_tokens": object,
-                "title_length": object,
-            }
-        )
-        .set_index('id')
-        .persist()
+    files_by_newspaper = {}
+    for path, size in rebuilt_files:
+        newspaper = os.path.basename(path).split('-')[0]
+        files_by_newspaper.setdefault(newspaper, []).append((path, size))
+
+    checkpoint = None
+    if checkpoint_dir:
+        config = {"rebuilt_bucket": s3_rebuilt_bucket, "newspapers": newspapers, "years": years}
+        checkpoint = Checkpoint(checkpoint_dir, "rebuilt_stats", config, resume)
+
+    # large files are decompressed in several chunks, in parallel, and all
+    # newspapers are submitted to the cluster at once
+    counts = run_dask_shards(
+        sorted(files_by_newspaper),
+        lambda newspaper: _rebuilt_newspaper_stats(files_by_newspaper[newspaper]),
+        checkpoint,
     )
 
-    license_df = fetch_access_rights(s3_canonical_bucket, output_dir)
-    rebuilt_enriched_df = rebuilt_df.join(license_df, on='issue_id').persist()
-    # files = enriched_df.to_csv(
-    #    "s3://impresso-stats/contentitem-license-stats/",
-    #    storage_options=IMPRESSO_STORAGEOPT
-    # )
-
-    # calculate the number of tokens per newspaper and add it to the dataframe
-    df = rebuilt_df.groupby(by='newspaper').agg({"n_tokens": sum}).compute()
-    df.n_tokens = df.n_tokens.astype('int')
+    fetch_access_rights(s3_canonical_bucket, output_dir, index_dir, newspapers, years)
 
     # breakdown of content items by type
-    counts_by_type = rebuilt_df.groupby(by='type').size().compute()
-    print(f"Total number of content items: {rebuilt_df.shape[0].compute()}")
+    counts_by_type = pd.concat(counts.values()).groupby(level='type').n_content_items.sum()
+    print(f"Total number of content items: {counts_by_type.sum()}")
     print(counts_by_type)  # use tabulate here
 
-    # calculate the number of images per newspaper and add it to the dataframe
-    imgs_by_nps = rebuilt_df[rebuilt_df.type == 'img'].groupby(by=['newspaper']).size().compute()
-    imgs_by_nps_df = pd.DataFrame({"n_images": imgs_by_nps})
-    df = df.join(imgs_by_nps_df, how='outer')
-    df.fillna(0, inplace=True)
-    df.n_images = df.n_images.astype(int)
+    # number of tokens and images per newspaper
+    df = pd.DataFrame(
+        [
+            {
+                "newspaper": newspaper,
+                "n_tokens": int(np_counts.n_tokens.sum()),
+                "n_images": int(np_counts.n_content_items.get('img', 0)),
+            }
+            for newspaper, np_counts in counts.items()
+        ],
+        columns=["newspaper", "n_tokens", "n_images"],
+    ).set_index('newspaper')
 
-    # files = evenized_light_df.to_csv("s3://impresso-stats/content-item-stats/", storage_options=IMPRESSO_STORAGEOPT)
     return df
 
 
-def compute_corpus_stats(s3_canonical_bucket: str, s3_rebuilt_bucket: str, db_config: str, output_dir: str) -> None:
+def compute_corpus_stats(
+    s3_canonical_bucket: str,
+    s3_rebuilt_bucket: str,
+    db_config: str,
+    output_dir: str,
+    index_dir: str = None,
+    newspapers: list = None,
+    years: list = None,
+    checkpoint_dir: str = None,
+    resume: bool = False,
+) -> None:
     """Computes corpus statistics from data in MySQL DB as well as in S3.
 
     :param str s3_canonical_bucket: S3 bucket with canonical data.
     :param str s3_rebuilt_bucket: S3 bucket with rebuilt data.
     :param str db_config: DB configuration to use (e.g. "dev", "prod", etc.).
     :param str output_dir: Description of parameter `output_dir`.
+    :param str index_dir: Directory of the Parquet index of `s3_canonical_bucket` (optional).
+    :param list newspapers: Newspaper IDs or glob patterns to restrict the stats to (optional).
+    :param list years: Years to restrict the stats to (optional).
+    :param str checkpoint_dir: Directory where rebuilt stats are checkpointed by newspaper (optional).
+    :param bool resume: Whether to resume from the checkpoints found in `checkpoint_dir`.
     :return: Description of returned object.
     :rtype: None
 
     """
     stats_df = fetch_newspapers_metadata(db_config)
-    canonical_stats_df = compute_canonical_stats(s3_canonical_bucket)
-    rebuilt_stats_df = compute_rebuilt_stats(s3_rebuilt_bucket, s3_canonical_bucket, output_dir)
+    canonical_stats_df = compute_canonical_stats(s3_canonical_bucket, index_dir, newspapers, years)
+    rebuilt_stats_df = compute_rebuilt_stats(
+        s3_rebuilt_bucket, s3_canonical_bucket, output_dir, index_dir, newspapers, years, checkpoint_dir, resume
+    )
 
     # do various joins
     corpus_stats_df = stats_df.join(canonical_stats_df, how='inner')
@@ -244,7 +321,9 @@ def compute_corpus_stats(s3_canonical_bucket: str, s3_rebuilt_bucket: str, db_co
     corpus_stats_df.to_csv(os.path.join(output_dir, 'newspaper_stats.csv'))
 
 
-def compute_content_items_stats(s3_input_bucket: str, output_dir: str, id_field: str = 'id') -> pd.DataFrame:
+def compute_content_items_stats(
+    s3_input_bucket: str, output_dir: str, id_field: str = 'id', newspapers: list = None, years: list = None
+) -> pd.DataFrame:
     """Computes the number of content items per newspaper per year in a given s3 bucket.
 
     This function can be used on any s3 bucket containing ``.bz2``-compressed JSON-line files, provided that
@@ -253,26 +332,27 @@ def compute_content_items_stats(s3_input_bucket: str, output_dir: str, id_field:
     :param str s3_input_bucket: Name of input s3 bucket (starting with ``s3://``)
     :param str output_dir: Path of output directory.
     :param str id_field: Name of the field to be used an the id (default ``id``).
+    :param list newspapers: Newspaper IDs or glob patterns to restrict the stats to (optional).
+    :param list years: Years to restrict the stats to (optional).
     :return: A dataframe with content item stats.
     :rtype: pd.DataFrame
 
     """
     csv_output_file = os.path.join(output_dir, "ci_stats.csv")
     pickle_output_file = os.path.join(output_dir, "ci_stats.pkl")
-    input_files = fixed_s3fs_glob(os.path.join(s3_input_bucket, '*bz2'))
+    input_files = list_file_sizes(s3_input_bucket, 'bz2', newspapers, years)
     print(f'Found {len(input_files)} input files in {s3_input_bucket}')
 
     print('Computing statistics...')
     contentitems_df = (
-        db.from_sequence(input_files, partition_size=2)
-        .map(alternative_read_text, IMPRESSO_STORAGEOPT)
-        .flatten()
-        .map(json.loads)
+        read_lines(input_files, storage_options=get_storage_options())
+        .map(extract_field, id_field)
+        .filter(lambda ci_id: ci_id is not None)
         .map(
-            lambda i: {
-                "id": i[id_field],
-                "year": int(i[id_field].split("-")[1]),
-                "newspaper": i[id_field].split("-")[0],
+            lambda ci_id: {
+                "id": ci_id,
+                "year": int(ci_id.split("-")[1]),
+                "newspaper": ci_id.split("-")[0],
             }
         )
         .to_dataframe(
@@ -305,17 +385,33 @@ def compute_content_items_stats(s3_input_bucket: str, output_dir: str, id_field:
     return df
 
 
-def compute_mysql_stats(db_config: str, output_dir: str) -> pd.DataFrame:
-    ci_bag = db.from_sequence(mysql_list_content_items(db_config))
+def compute_mysql_stats(db_config: str, output_dir: str, aggregate_in_db: bool = False) -> pd.DataFrame:
+    """Computes the number of content items per newspaper and year in the MySQL DB.
 
-    ci_ddf = (
-        ci_bag.map(lambda ci: {'id': ci, 'newspaper': ci.split('-')[0], 'year': ci.split('-')[1]})
-        .to_dataframe()
-        .set_index('id')
-        .persist()
-    )
+    :param str db_config: DB configuration to use (e.g. "dev", "prod", etc.).
+    :param str output_dir: Path of output directory.
+    :param bool aggregate_in_db: Whether to count content items with a grouped query in the DB
+        (see :func:`sanity_check.contents.mysql.content_item_counts`) instead of fetching their IDs.
+    :return: A dataframe indexed by `<newspaper>-<year>`, with columns `newspaper`, `year` and `count`.
+    :rtype: pd.DataFrame
 
-    cis_grouped = ci_ddf.groupby(by=['newspaper', 'year']).size().compute()
+    """
+    if aggregate_in_db:
+        cis_grouped = pd.DataFrame(
+            mysql_content_item_counts(db_config), columns=['newspaper', 'year', 'count']
+        ).set_index(['newspaper', 'year'])['count']
+    else:
+        # content item IDs are fetched by the workers, one newspaper at a time
+        ci_bag = mysql_fetch_ids("content_items", db_config)
+
+        ci_ddf = (
+            ci_bag.map(lambda ci: {'id': ci, 'newspaper': ci.split('-')[0], 'year': ci.split('-')[1]})
+            .to_dataframe()
+            .set_index('id')
+            .persist()
+        )
+
+        cis_grouped = ci_ddf.groupby(by=['newspaper', 'year']).size().compute()
 
     df = pd.DataFrame(cis_grouped)
     df.reset_index(inplace=True)
@@ -325,7 +421,7 @@ def compute_mysql_stats(db_config: str, output_dir: str) -> pd.DataFrame:
     df["mysql"] = True
     df["mysql_db"] = db_config
 
-    filename = f"contentitems_mysql-{db_config}"
+    filename = f"contentitems_mysql-{db_label(db_config)}"
 
     csv_path = os.path.join(output_dir, f"{filename}.csv")
     df[['count']].to_csv(csv_path)
@@ -370,40 +466,72 @@ def main():
     output_dir = arguments['--output-dir']
     db_config = arguments['--db-config']
     id_field = arguments['--id-field']
-    memory = arguments['--k8-memory'] if arguments['--k8-memory'] else "1G"
-    workers = int(arguments['--k8-workers']) if arguments['--k8-workers'] else 50
-
-    image_uri = "ic-registry.epfl.ch/dhlab/impresso_data-sanity-check:v1"
-
-    try:
-        # first thing to do is to create the dask kubernetes cluster
-        cluster = DaskCluster(
-            namespace="dhlab",
-            cluster_id="impresso-sanitycheck-cli",
-            scheduler_pod_spec=make_scheduler_configuration(),
-            worker_pod_spec=make_worker_configuration(docker_image=image_uri, memory=memory),
+    index_dir = arguments['--index-dir']
+    newspapers = parse_newspapers(arguments['--newspapers'])
+    years = parse_years(arguments['--years'])
+    executor = arguments['--executor']
+    memory = arguments['--k8-memory']
+    workers = int(arguments['--k8-workers']) if arguments['--k8-workers'] else None
+
+    if arguments['--manifest-dir']:
+        max_age = arguments['--manifest-max-age']
+        enable_manifest_cache(arguments['--manifest-dir'], float(max_age) if max_age else None)
+    if arguments['--index-version']:
+        pin_index_version(arguments['--index-version'])
+
+    # MySQL stats are computed by the database: there is nothing to plan
+    plan = None
+    if db_stats and arguments['--aggregate-in-db']:
+        # only the grouped counts are fetched, no cluster is needed
+        executor = 'threads'
+    # nothing to plan either if the resources are given
+    planned = executor != 'threads' and not (memory and workers)
+    if planned and s3_stats:
+        # input files are read in chunks (see `bz2_chunks.py`)
+        plan = plan_resources(
+            [StageEstimate('input files', list_file_sizes(s3_input_bucket, 'bz2', newspapers, years), split_files=True)]
         )
-        cluster.create()
-        cluster.scale(workers, blocking=True)
-        dask_client = cluster.make_dask_client()
-        dask_client.get_versions(check=True)
-        print(dask_client)
-
+    elif planned and corpus_stats:
+        stages = [
+            StageEstimate(
+                'rebuilt files',
+                list_file_sizes(s3_rebuilt_bucket, newspapers=newspapers, years=years),
+                split_files=True,
+            )
+        ]
+        # canonical files are not read if the index is
+        if not index_dir:
+            stages += [
+                StageEstimate(
+                    'canonical issues',
+                    list_newspaper_file_sizes(s3_canonical_bucket, '{np}/issues/', newspapers, years),
+                ),
+                StageEstimate(
+                    'canonical pages', list_newspaper_file_sizes(s3_canonical_bucket, '{np}/pages/', newspapers, years)
+                ),
+            ]
+        plan = plan_resources(stages)
+
+    with dask_executor(executor, memory, workers, plan):
         if db_stats:
-            compute_mysql_stats(db_config, output_dir)
+            compute_mysql_stats(db_config, output_dir, arguments['--aggregate-in-db'])
         elif s3_stats:
             if id_field:
-                compute_content_items_stats(s3_input_bucket, output_dir, id_field)
+                compute_content_items_stats(s3_input_bucket, output_dir, id_field, newspapers, years)
             else:
-                compute_content_items_stats(s3_input_bucket, output_dir)
+                compute_content_items_stats(s3_input_bucket, output_dir, newspapers=newspapers, years=years)
         elif corpus_stats:
-            compute_corpus_stats(s3_canonical_bucket, s3_rebuilt_bucket, db_config, output_dir)
-
-    except Exception as e:
-        raise e
-    finally:
-        if cluster:
-            cluster.close()
+            compute_corpus_stats(
+                s3_canonical_bucket,
+                s3_rebuilt_bucket,
+                db_config,
+                output_dir,
+                index_dir,
+                newspapers,
+                years,
+                arguments['--checkpoint-dir'],
+                arguments['--resume'],
+            )
 
 
 if __name__ == '__main__':
@@ -1,12 +1,25 @@
 """Command-line script to generate configuration files for ingestion/rebuild scripts.
 
 Usage:
-    sync.py s3 --canonical-bucket=<cb> --rebuilt-bucket=<rb> --output-dir=<od> [--k8-memory=<mem> --k8-workers=<wkrs>]
-    sync.py db --canonical-bucket=<cb> --db-config=<db> --output-dir=<od> [--k8-memory=<mem> --k8-workers=<wkrs>]
+    sync.py s3 --canonical-bucket=<cb> --rebuilt-bucket=<rb> --output-dir=<od> [--executor=<ex> --k8-memory=<mem> --k8-workers=<wkrs> --manifest-dir=<md> --manifest-max-age=<secs> --index-dir=<idx> --index-version=<v> --newspapers=<nps> --years=<yrs> --checkpoint-dir=<cd> --resume --n-batches=<n>]
+    sync.py db --canonical-bucket=<cb> --db-config=<db> --output-dir=<od> [--executor=<ex> --k8-memory=<mem> --k8-workers=<wkrs> --manifest-dir=<md> --manifest-max-age=<secs> --index-dir=<idx> --index-version=<v> --newspapers=<nps> --years=<yrs>]
 
 Options:
 
+--executor=<ex>  Dask executor: k8 (cluster on Kubernetes), local (worker processes sized from the local CPUs and memory) or threads [default: k8]
+--k8-memory=<mem>  Memory of each worker of the k8 executor (default: planned from the size of the input files)
+--k8-workers=<wkrs>  Maximum number of workers of the k8 executor (default: planned from the size of the input files)
 --canonical-bucket=<cb>  S3 bucket where canonical JSON data will be read from
+--db-config=<db>  MySQL DB configuration (e.g. "dev", "prod"), or path of a local SQLite/DuckDB stand-in (see db_backends.py)
+--manifest-dir=<md>  Directory of the local manifest of s3 listings (if omitted, buckets are listed from scratch)
+--manifest-max-age=<secs>  Seconds during which cached listings are reused without any request: files added, removed or rewritten meanwhile are missed (default: 3600; 0 lists each prefix again once per run)
+--index-dir=<idx>  Read canonical data from the Parquet index in this directory (see index.py) instead of bz2 files
+--index-version=<v>  Version of the index to read, even if the bucket changed since it was built (default: the latest version, which must match the bucket)
+--newspapers=<nps>  Newspaper IDs or glob patterns to restrict the run to (e.g. "GDL JDG BL*")
+--years=<yrs>  Years or year ranges to restrict the run to (e.g. "1850-1860 1900")
+--checkpoint-dir=<cd>  Directory where partial results are checkpointed, one shard per newspaper
+--resume  With --checkpoint-dir, skip the newspapers whose partial results were already checkpointed
+--n-batches=<n>  Also plan the rebuild and ingestion work into this many batches of roughly equal size (e.g. one per downstream worker)
 
 Example:
 
@@ -14,35 +27,59 @@ Example:
     --rebuilt-bucket='s3://passim-rebuilt' --output-dir=./ --k8-memory="1G" --k8-workers=25
 """  # noqa: E501
 
+import heapq
 import os
 import json
+from typing import Callable, List, Optional, Tuple
+
 import pandas as pd
-from dask_k8 import DaskCluster
+from dask import delayed
 from docopt import docopt
 
-from impresso_commons.utils.kube import (
-    make_scheduler_configuration,
-    make_worker_configuration,
-)
+from sanity_check.contents.checkpoints import Checkpoint, run_dask_shards
+from sanity_check.contents.cluster import StageEstimate, dask_executor, plan_resources
+from sanity_check.contents.configs import config_entries, entry_costs, plan_batches, sizes_by_newspaper_year
+from sanity_check.contents.decoding import extract_field
+from sanity_check.contents.helpers import parse_newspapers, parse_years
+from sanity_check.contents.index import issue_ids_from_index, pin_index_version, resolve_index
+from sanity_check.contents.manifest import enable_manifest_cache
 from sanity_check.contents.mysql import list_issues as mysql_list_issues
 from sanity_check.contents.s3_data import (
     fetch_issue_ids,
-    fetch_issue_ids_rebuilt,
+    list_files_rebuilt,
+    list_issues,
+    list_newspaper_file_sizes,
+    iter_text_lines,
+    path_newspaper_year,
 )
+from sanity_check.contents.sorted_diff import split_difference
+
+# without a distributed client, newspapers are compared by single tasks, many of which can run at once
+MAX_PARALLEL_SYNC_SHARDS = 32
+
+# files read by each downstream job (e.g. a rebuild reads both the issues and the pages)
+REBUILD_INPUTS = ['{np}/issues/', '{np}/pages/']
+INGESTION_INPUTS = ['{np}/']
+DB_INGESTION_INPUTS = ['{np}/issues/']
 
 
-def sync_db(s3_bucket_name: str, mysql_db_config: str) -> pd.DataFrame:
+def sync_db(
+    s3_bucket_name: str, mysql_db_config: str, index_dir: str = None, newspapers: list = None, years: list = None
+) -> pd.DataFrame:
     """
     Check which canonical issues from S3 are not present in the DB.
 
+    `newspapers` (IDs or glob patterns) and `years` restrict the check to a
+    subset of the S3 bucket.
+
     Return a dataframe with detailed information.
     """
 
     # get list of issue IDs from s3
-    s3_issues_ids = fetch_issue_ids(s3_bucket_name)
+    s3_issues_ids = fetch_issue_ids(s3_bucket_name, index_dir=index_dir, newspapers=newspapers, years=years)
 
     # do the same for MySQL
-    mysql_issue_ids = mysql_list_issues(mysql_db_config)
+    mysql_issue_ids = mysql_list_issues(mysql_db_config, newspapers, years)
 
     # create dataframe with issue ids from s3
     s3_issue_data = pd.DataFrame([{"id": issue_id, "in_s3": True} for issue_id in s3_issues_ids]).set_index('id')
@@ -69,42 +106,188 @@ def sync_db(s3_bucket_name: str, mysql_db_config: str) -> pd.DataFrame:
     return issues_to_ingest
 
 
-def sync_rebuilt(canonical_bucket_name: str, rebuilt_bucket_name: str) -> tuple:
-    """
-    Check which canonical issues have not been rebuilt, and which rebuilt
-    data are not yet ingested into canonical.
+def _issue_id(line: str) -> Optional[str]:
+    return extract_field(line, "id")
 
-    # TODO: serialise dataframes somewhere
 
-    Return a dataframe with detailed information.
+def _rebuilt_issue_id(line: str) -> Optional[str]:
+    ci_id = extract_field(line, "id")
+    return "-".join(ci_id.split("-")[:-1]) if ci_id is not None else None
+
+
+def _path_newspaper(path: str) -> str:
+    """Newspaper of a file: from its name, or else from its prefix (`{np}/`) in the bucket."""
+    newspaper, _ = path_newspaper_year(path)
+    return newspaper or path.split("://", 1)[-1].split("/")[1]
+
+
+def _sorted_run(paths: List[str], issue_id: Callable[[str], Optional[str]]) -> List[str]:
+    """Read the distinct issue IDs of some files (run by a worker), in ascending order.
+
+    Lines are streamed and only their ID is extracted (see
+    :func:`sanity_check.contents.decoding.extract_field`), so that only the
+    IDs, not the decompressed files, are held in memory.
     """
+    issue_ids = {issue_id(line) for path in paths for line in iter_text_lines(path)}
+    issue_ids.discard(None)
+    return sorted(issue_ids)
 
-    s3_canonical_issues = fetch_issue_ids(canonical_bucket_name, compute=False)
-    s3_rebuilt_issues = fetch_issue_ids_rebuilt(rebuilt_bucket_name, compute=False)
 
-    # the s3 rebuilt bucket is not empty
-    if s3_rebuilt_issues:
+def _sorted_runs(files: List[str], issue_id: Callable[[str], Optional[str]]) -> list:
+    """Sort the issue IDs found in the files of a newspaper, one task per year.
 
-        s3_rebuilt_data = (
-            s3_rebuilt_issues.map(lambda i: {'id': i, "in_rebuilt": True}).to_dataframe().set_index('id').compute()
-        )
+    Issue IDs start with the newspaper ID and the year: the files of each
+    year are read and sorted by a separate task (a dask delayed object), in
+    parallel. Files without a year in their name may hold IDs of any year:
+    theirs are sorted by a task of their own. The runs are then merged (see
+    :func:`_newspaper_issue_mismatches`).
+    """
+    files_by_year = {}
+    for path in files:
+        files_by_year.setdefault(path_newspaper_year(path)[1], []).append(path)
+    return [delayed(_sorted_run)(paths, issue_id) for paths in files_by_year.values()]
+
+
+def _index_issue_ids(
+    index_dir: str, canonical_bucket_name: str, index_version: str, newspaper: str, years: list = None
+) -> List[str]:
+    # the index partition of the newspaper is read by the task itself, from the version checked by the client
+    return issue_ids_from_index(index_dir, canonical_bucket_name, [newspaper], years, index_version).compute(
+        scheduler="sync"
+    )
 
-        s3_canonical_data = (
-            s3_canonical_issues.map(lambda i: {'id': i, "in_canonical": True}).to_dataframe().set_index('id').compute()
-        )
 
-        print('Joining the two dataframes')
-        issue_data = s3_rebuilt_data.join(s3_canonical_data, how='outer')
-        print('Joining the two dataframes... done')
-    # the s3 rebuilt bucket is empty!
+def _newspaper_issue_mismatches(
+    canonical_runs: List[List[str]], rebuilt_runs: List[List[str]], canonical_ids: Optional[List[str]] = None
+) -> Tuple[List[str], List[str]]:
+    """Merge-diff the canonical and rebuilt issue IDs of a newspaper (run by a worker).
+
+    :param List[List[str]] canonical_runs: Sorted canonical issue IDs, e.g.
+        one list per year (see :func:`_sorted_runs`).
+    :param List[List[str]] rebuilt_runs: Sorted rebuilt issue IDs, likewise.
+    :param List[str] canonical_ids: Canonical issue IDs read from the index,
+        in any order, instead of `canonical_runs` (optional).
+    :return: The IDs of issues that are only in canonical (to rebuild) and
+        of those that are only in rebuilt (to ingest).
+    :rtype: Tuple[List[str], List[str]]
+
+    """
+    if canonical_ids is not None:
+        canonical = sorted(set(canonical_ids))
     else:
-        issue_data = (
-            s3_canonical_issues.map(lambda i: {'id': i, "in_canonical": True, "in_rebuilt": None})
-            .to_dataframe()
-            .set_index('id')
-            .compute()
-        )
+        canonical = heapq.merge(*canonical_runs)
+    return split_difference(canonical, heapq.merge(*rebuilt_runs))
+
+
+def _mismatches_frame(mismatches: Tuple[List[str], List[str]]) -> pd.DataFrame:
+    to_rebuild, to_ingest = mismatches
+    return pd.DataFrame(
+        [{"id": issue_id, "in_rebuilt": None, "in_canonical": True} for issue_id in to_rebuild]
+        + [{"id": issue_id, "in_rebuilt": True, "in_canonical": None} for issue_id in to_ingest],
+        columns=["id", "in_rebuilt", "in_canonical"],
+    ).set_index('id')
+
+
+def _newspaper_rebuilt_sync(
+    newspaper: str,
+    canonical_files: List[str],
+    rebuilt_files: List[str],
+    canonical_bucket_name: str,
+    index_dir: str = None,
+    years: list = None,
+    index_version: str = None,
+):
+    """Compare the canonical and rebuilt issue IDs of one newspaper, keeping only the mismatches.
+
+    The mismatches are returned as a lazy dataframe (a dask delayed object),
+    so that the newspapers can be computed together (see
+    :func:`sanity_check.contents.checkpoints.run_dask_shards`).
+    """
+    canonical_runs, canonical_ids = [], None
+    if index_dir:
+        canonical_ids = delayed(_index_issue_ids)(index_dir, canonical_bucket_name, index_version, newspaper, years)
+    else:
+        canonical_runs = _sorted_runs(canonical_files, _issue_id)
+
+    mismatches = delayed(_newspaper_issue_mismatches)(
+        canonical_runs, _sorted_runs(rebuilt_files, _rebuilt_issue_id), canonical_ids
+    )
+    return delayed(_mismatches_frame)(mismatches)
+
+
+def sync_rebuilt(
+    canonical_bucket_name: str,
+    rebuilt_bucket_name: str,
+    index_dir: str = None,
+    newspapers: list = None,
+    years: list = None,
+    checkpoint_dir: str = None,
+    resume: bool = False,
+) -> tuple:
+    """
+    Check which canonical issues have not been rebuilt, and which rebuilt
+    data are not yet ingested into canonical.
 
+    `newspapers` (IDs or glob patterns) and `years` restrict the comparison
+    to a subset of both buckets.
+
+    The issue IDs of each newspaper-year of both buckets are read and sorted
+    by separate tasks, and each newspaper is compared by a single task, which
+    merge-walks them in sorted order (see
+    :mod:`sanity_check.contents.sorted_diff`): only the mismatches are sent
+    back, so that the memory of the client does not depend on the size of
+    the corpus.
+
+    Each newspaper is also a separate shard, and all shards are submitted to
+    the cluster at once (see :func:`sanity_check.contents.checkpoints.run_dask_shards`):
+    if `checkpoint_dir` is given,
+    the mismatches of each newspaper are written there as soon as they are
+    found, and a run with `resume=True` only compares the newspapers that
+    were not done yet.
+
+    Return a dataframe with detailed information.
+    """
+    canonical_files = {}
+    for path in list_issues(canonical_bucket_name, newspapers, years):
+        canonical_files.setdefault(_path_newspaper(path), []).append(path)
+    rebuilt_files = {}
+    for path in list_files_rebuilt(rebuilt_bucket_name, newspapers, years):
+        rebuilt_files.setdefault(_path_newspaper(path), []).append(path)
+
+    index_version = None
+    if index_dir:
+        index_version = os.path.basename(resolve_index(index_dir, canonical_bucket_name))
+
+    checkpoint = None
+    if checkpoint_dir:
+        config = {
+            "canonical_bucket": canonical_bucket_name,
+            "rebuilt_bucket": rebuilt_bucket_name,
+            "index_dir": index_dir,
+            "index_version": index_version,
+            "newspapers": newspapers,
+            "years": years,
+        }
+        checkpoint = Checkpoint(checkpoint_dir, "rebuilt_sync", config, resume)
+
+    mismatches = run_dask_shards(
+        sorted(set(canonical_files) | set(rebuilt_files)),
+        lambda newspaper: _newspaper_rebuilt_sync(
+            newspaper,
+            canonical_files.get(newspaper, []),
+            rebuilt_files.get(newspaper, []),
+            canonical_bucket_name,
+            index_dir,
+            years,
+            index_version,
+        ),
+        checkpoint,
+        max_parallel=MAX_PARALLEL_SYNC_SHARDS,
+    )
+
+    issue_data = pd.concat(
+        list(mismatches.values()) or [pd.DataFrame(columns=["in_rebuilt", "in_canonical"], index=pd.Index([], name='id'))]
+    )
     issue_data['newspaper_id'] = issue_data.index.map(lambda i: i.split('-')[0])
     issue_data['year'] = issue_data.index.map(lambda i: int(i.split('-')[1]))
 
@@ -114,30 +297,45 @@ def sync_rebuilt(canonical_bucket_name: str, rebuilt_bucket_name: str) -> tuple:
     return (issues_to_ingest, issues_to_rebuild)
 
 
+def _input_sizes(bucket_name: str, bases: List[str], issues: pd.DataFrame) -> dict:
+    """Size of the files of `bucket_name` under `bases` of each newspaper and year of `issues`."""
+    if issues.empty:
+        return {}
+    newspapers, years = sorted(set(issues.newspaper_id)), sorted(set(issues.year))
+    return sizes_by_newspaper_year(
+        file_size for base in bases for file_size in list_newspaper_file_sizes(bucket_name, base, newspapers, years)
+    )
+
+
+def _write_config(output_dir: str, name: str, config: list, costs: list, indent: int = 4) -> None:
+    """Write a configuration (`<name>-config.json`), and the cost of its entries (`<name>-costs.json`) next to it."""
+    for suffix, data in [('config', config), ('costs', costs)]:
+        with open(os.path.join(output_dir, f'{name}-{suffix}.json'), 'w') as cfg_file:
+            json.dump(data, cfg_file, indent=indent)
+
+
 def configure_db_ingestion(s3_bucket_name: str, mysql_db_config: str, issues_to_ingest: pd.DataFrame) -> list:
-    """Generate the config file for DB ingestion in a data-driven fashion."""
-    config = []
+    """Generate the config file for DB ingestion in a data-driven fashion.
 
+    Entries cover exactly the years with issues to ingest (see
+    :mod:`sanity_check.contents.configs`).
+    """
     if issues_to_ingest is None:
         issues_to_ingest = sync_db(s3_bucket_name, mysql_db_config)
 
-    for key, group in issues_to_ingest.groupby(by='newspaper_id'):
-        missing_years = sorted(set(group.year))
-        config.append({key: [min(missing_years), max(missing_years) + 1]})
-    return config
+    return config_entries(issues_to_ingest)
 
 
 def configure_rebuild(
-    canonical_bucket_name: str, rebuilt_bucket_name: str, issues_to_rebuild: pd.DataFrame = None,
+    canonical_bucket_name: str, rebuilt_bucket_name: str, issues_to_rebuild: pd.DataFrame = None
 ) -> list:
     """Generate the config file for data rebuild in a data-driven fashion.
 
     The configuration file is generated by comparing the newspaper issue IDs
     contained in the s3 canonical bucket against those in the s3 rebuilt
-    bucket.
+    bucket. Entries cover exactly the years with missing issues (see
+    :mod:`sanity_check.contents.configs`).
     """
-    config = []
-
     if issues_to_rebuild is None:
         issues_to_ingest, issues_to_rebuild = sync_rebuilt(canonical_bucket_name, rebuilt_bucket_name)
 
@@ -149,23 +347,19 @@ def configure_rebuild(
         )
     )
 
-    for key, group in issues_to_rebuild.groupby(by='newspaper_id'):
-        missing_years = sorted(set(group.year))
-        config.append({key: [min(missing_years), max(missing_years) + 1]})
-    return config
+    return config_entries(issues_to_rebuild)
 
 
 def configure_ingestion(
-    canonical_bucket_name: str, rebuilt_bucket_name: str, issues_to_ingest: pd.DataFrame = None,
+    canonical_bucket_name: str, rebuilt_bucket_name: str, issues_to_ingest: pd.DataFrame = None
 ) -> list:
     """Generate the config file for data rebuild in a data-driven fashion.
 
     The configuration file is generated by comparing the newspaper issue IDs
     contained in the s3 canonical bucket against those in the s3 rebuilt
-    bucket.
+    bucket. Entries cover exactly the years with missing issues (see
+    :mod:`sanity_check.contents.configs`).
     """
-    config = []
-
     if issues_to_ingest is None:
         issues_to_ingest, issues_to_rebuild = sync_rebuilt(canonical_bucket_name, rebuilt_bucket_name)
 
@@ -177,67 +371,94 @@ def configure_ingestion(
         )
     )
 
-    for key, group in issues_to_ingest.groupby(by='newspaper_id'):
-        missing_years = sorted(set(group.year))
-        config.append({key: [min(missing_years), max(missing_years) + 1]})
-    return config
+    return config_entries(issues_to_ingest)
 
 
-def run_s3_sync(canonical_bucket_name: str, rebuilt_bucket_name: str, output_dir: str) -> None:
+def run_s3_sync(
+    canonical_bucket_name: str,
+    rebuilt_bucket_name: str,
+    output_dir: str,
+    index_dir: str = None,
+    newspapers: list = None,
+    years: list = None,
+    checkpoint_dir: str = None,
+    resume: bool = False,
+    n_batches: int = None,
+) -> None:
     """Short summary.
 
     :param str canonical_bucket_name: Name of S3 bucket with canonical data.
     :param str rebuilt_bucket_name: Name of S3 bucket with rebuilt data.
     :param str output_dir: Description of parameter `output_dir`.
-    :param str k8_memory: Memory to be given each worker in the dask kubernetes
-        cluster (e.g. "10G").
-    :param int k8_workers_n: Numnber of workers to create when initialising
-        the dask kubernetes cluster.
+    :param str index_dir: Directory of the Parquet index of the canonical
+        bucket, to be read instead of the bz2 files (optional).
+    :param list newspapers: Newspaper IDs or glob patterns to restrict the sync to (optional).
+    :param list years: Years to restrict the sync to (optional).
+    :param str checkpoint_dir: Directory where the comparison is checkpointed
+        by newspaper (optional).
+    :param bool resume: Whether to resume from the checkpoints found in
+        `checkpoint_dir`.
+    :param int n_batches: If given, the rebuild and ingestion work is also
+        planned into this many batches of roughly equal size
+        (`*-batches.json`, see :func:`sanity_check.contents.configs.plan_batches`).
     :return: None
     :rtype: None
 
     """
     try:
 
-        issues_to_ingest, issues_to_rebuild = sync_rebuilt(canonical_bucket_name, rebuilt_bucket_name)
+        issues_to_ingest, issues_to_rebuild = sync_rebuilt(
+            canonical_bucket_name, rebuilt_bucket_name, index_dir, newspapers, years, checkpoint_dir, resume
+        )
 
         # serialize dataframes for later
         issues_to_ingest.to_pickle(os.path.join(output_dir, 'issues_to_ingest.pkl'))
         issues_to_rebuild.to_pickle(os.path.join(output_dir, 'issues_to_rebuild.pkl'))
 
-        ingestion_config = configure_ingestion(
-            canonical_bucket_name, rebuilt_bucket_name, issues_to_ingest=issues_to_ingest,
-        )
+        # sizes of the files each job will read, listed once for costs and batches
+        ingestion_sizes = _input_sizes(rebuilt_bucket_name, INGESTION_INPUTS, issues_to_ingest)
+        rebuild_sizes = _input_sizes(canonical_bucket_name, REBUILD_INPUTS, issues_to_rebuild)
 
-        rebuild_config = configure_rebuild(
-            canonical_bucket_name, rebuilt_bucket_name, issues_to_rebuild=issues_to_rebuild,
-        )
+        ingestion_config = configure_ingestion(canonical_bucket_name, rebuilt_bucket_name, issues_to_ingest)
+        rebuild_config = configure_rebuild(canonical_bucket_name, rebuilt_bucket_name, issues_to_rebuild)
 
-        # write the generated configurations to a file
-        rebuild_cfg_path = os.path.join(output_dir, 'rebuild-config.json')
-        with open(rebuild_cfg_path, 'w') as cfg_file:
-            json.dump(rebuild_config, cfg_file, indent=4)
+        # write the generated configurations (and their costs) to files
+        _write_config(output_dir, 'rebuild', rebuild_config, entry_costs(issues_to_rebuild, rebuild_sizes))
+        _write_config(output_dir, 'ingestion', ingestion_config, entry_costs(issues_to_ingest, ingestion_sizes))
 
-        ingestion_cfg_path = os.path.join(output_dir, 'ingestion-config.json')
-        with open(ingestion_cfg_path, 'w') as cfg_file:
-            json.dump(ingestion_config, cfg_file, indent=4)
+        if n_batches:
+            for name, issues, sizes in [
+                ('rebuild', issues_to_rebuild, rebuild_sizes),
+                ('ingestion', issues_to_ingest, ingestion_sizes),
+            ]:
+                batches = plan_batches(issues, sizes, n_batches)
+                costs = [batch['cost'] for batch in batches] or [0]
+                print(f'Planned {len(batches)} {name} batches (cost from {min(costs)} to {max(costs)})')
+                with open(os.path.join(output_dir, f'{name}-batches.json'), 'w') as cfg_file:
+                    json.dump(batches, cfg_file, indent=4)
 
     except Exception as e:
         raise e
 
 
-def run_db_sync(canonical_bucket_name: str, db_config: str, output_dir: str) -> None:
+def run_db_sync(
+    canonical_bucket_name: str,
+    db_config: str,
+    output_dir: str,
+    index_dir: str = None,
+    newspapers: list = None,
+    years: list = None,
+) -> None:
 
-    issues_to_ingest = sync_db(canonical_bucket_name, db_config)
+    issues_to_ingest = sync_db(canonical_bucket_name, db_config, index_dir, newspapers, years)
 
     issues_to_ingest.to_pickle(os.path.join(output_dir, 'issues_to_ingest_db.pkl'))
 
     dbingestion_config = configure_db_ingestion(canonical_bucket_name, db_config, issues_to_ingest)
 
-    # write the generated configurations to a file
-    dbingestion_cfg_path = os.path.join(output_dir, 'dbingest-config.json')
-    with open(dbingestion_cfg_path, 'w') as cfg_file:
-        json.dump(dbingestion_config, cfg_file, indent=2)
+    # write the generated configuration (and its costs) to files
+    sizes = _input_sizes(canonical_bucket_name, DB_INGESTION_INPUTS, issues_to_ingest)
+    _write_config(output_dir, 'dbingest', dbingestion_config, entry_costs(issues_to_ingest, sizes), indent=2)
 
 
 def main():
@@ -248,40 +469,61 @@ def main():
     s3_rebuilt_bucket = arguments['--rebuilt-bucket']
     output_dir = arguments['--output-dir']
     db_config = arguments['--db-config']
-    memory = arguments['--k8-memory'] if arguments['--k8-memory'] else "1G"
-    workers = int(arguments['--k8-workers']) if arguments['--k8-workers'] else 50
-
-    image_uri = "ic-registry.epfl.ch/dhlab/impresso_data-sanity-check:v1"
-    try:
-        # first thing to do is to create the dask kubernetes cluster
-        cluster = DaskCluster(
-            namespace="dhlab",
-            cluster_id="impresso-sanitycheck-cli",
-            scheduler_pod_spec=make_scheduler_configuration(),
-            worker_pod_spec=make_worker_configuration(docker_image=image_uri, memory=memory),
-        )
-        #import pdb; pdb.set_trace()
-        cluster.create()
-        cluster.scale(workers, blocking=True)
-        dask_client = cluster.make_dask_client()
-        dask_client.get_versions(check=True)
-        print(dask_client)
+    index_dir = arguments['--index-dir']
+    newspapers = parse_newspapers(arguments['--newspapers'])
+    years = parse_years(arguments['--years'])
+    executor = arguments['--executor']
+    memory = arguments['--k8-memory']
+    workers = int(arguments['--k8-workers']) if arguments['--k8-workers'] else None
+
+    if arguments['--manifest-dir']:
+        max_age = arguments['--manifest-max-age']
+        enable_manifest_cache(arguments['--manifest-dir'], float(max_age) if max_age else None)
+    if arguments['--index-version']:
+        pin_index_version(arguments['--index-version'])
+
+    # nothing to plan if the resources are given; canonical issues are not read if the index is
+    plan = None
+    if executor != 'threads' and not (memory and workers):
+        stages = []
+        if not index_dir:
+            stages.append(
+                StageEstimate(
+                    'canonical issues',
+                    list_newspaper_file_sizes(s3_canonical_bucket, '{np}/issues/', newspapers, years),
+                )
+            )
+        if s3_sync:
+            stages.append(
+                StageEstimate(
+                    'rebuilt files', list_newspaper_file_sizes(s3_rebuilt_bucket, '{np}/', newspapers, years)
+                )
+            )
+        plan = plan_resources(stages) if stages else None
 
+    with dask_executor(executor, memory, workers, plan):
         if s3_sync:
             run_s3_sync(
-                canonical_bucket_name=s3_canonical_bucket, rebuilt_bucket_name=s3_rebuilt_bucket, output_dir=output_dir,
+                canonical_bucket_name=s3_canonical_bucket,
+                rebuilt_bucket_name=s3_rebuilt_bucket,
+                output_dir=output_dir,
+                index_dir=index_dir,
+                newspapers=newspapers,
+                years=years,
+                checkpoint_dir=arguments['--checkpoint-dir'],
+                resume=arguments['--resume'],
+                n_batches=int(arguments['--n-batches']) if arguments['--n-batches'] else None,
             )
         elif db_sync:
             run_db_sync(
-                canonical_bucket_name=s3_canonical_bucket, db_config=db_config, output_dir=output_dir,
+                canonical_bucket_name=s3_canonical_bucket,
+                db_config=db_config,
+                output_dir=output_dir,
+                index_dir=index_dir,
+                newspapers=newspapers,
+                years=years,
             )
 
-    except Exception as e:
-        raise e
-    finally:
-        if cluster:
-            cluster.close()
-
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,66 @@
+import bz2
+import json
+import os
+import random
+import tempfile
+import unittest
+from unittest import TestCase
+
+from sanity_check.contents.bz2_chunks import plan_chunks, read_chunk
+
+
+class TestBz2Chunks(TestCase):
+
+    def setUp(self):
+        rng = random.Random(42)
+        words = ["impresso", "journal", "été", "Genève", "x" * 40]
+        self.lines = [
+            json.dumps({"id": f"GDL-1900-01-01-a-i{n:04d}", "ft": " ".join(rng.choice(words) for _ in range(rng.randint(0, 200)))})
+            for n in range(3000)
+        ]
+        data = ("\n".join(self.lines) + "\n").encode("utf-8")
+
+        # two concatenated streams with small (100k) blocks
+        half = len(data) // 2
+        compressed = bz2.compress(data[:half], 1) + bz2.compress(data[half:], 1)
+
+        fd, self.path = tempfile.mkstemp(suffix=".jsonl.bz2")
+        with os.fdopen(fd, "wb") as f:
+            f.write(compressed)
+        self.size = len(compressed)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_chunks_preserve_lines(self):
+        for chunk_size in [1000, 12345, self.size // 3, self.size * 2]:
+            partitions = plan_chunks([(self.path, self.size)], chunk_size)
+            lines = [line for chunks in partitions for chunk in chunks for line in read_chunk(*chunk)]
+            self.assertEqual(lines, self.lines)
+
+    def test_streams_ending_with_lines(self):
+        # one stream per group of lines: every stream (and thus block) boundary falls on a line end
+        streams = [
+            bz2.compress(("\n".join(self.lines[n : n + 150]) + "\n").encode("utf-8"), 1)
+            for n in range(0, len(self.lines), 150)
+        ]
+        with open(self.path, "wb") as f:
+            f.write(b"".join(streams))
+        size = sum(map(len, streams))
+
+        for chunk_size in [len(streams[0]) // 2, len(streams[0]), 54321, size // 7, size // 2]:
+            partitions = plan_chunks([(self.path, size)], chunk_size)
+            self.assertGreater(len(partitions), 1)
+            lines = [line for chunks in partitions for chunk in chunks for line in read_chunk(*chunk)]
+            self.assertEqual(len(lines), len(self.lines))
+            self.assertEqual(lines, self.lines)
+
+    def test_plan_chunks(self):
+        partitions = plan_chunks([(self.path, self.size), ("a.bz2", 10), ("b.bz2", 10)], self.size // 2 + 1)
+        self.assertEqual(len(partitions), 3)
+        self.assertEqual(partitions[0], [(self.path, 0, self.size // 2)])
+        self.assertEqual(partitions[2], [("a.bz2", 0, None), ("b.bz2", 0, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
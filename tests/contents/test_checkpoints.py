@@ -0,0 +1,81 @@
+import tempfile
+import unittest
+from unittest import TestCase
+
+from dask import delayed
+
+from sanity_check.contents.checkpoints import Checkpoint, run_dask_shards, run_shards
+
+try:
+    from distributed import Client
+except ImportError:
+    Client = None
+
+
+class TestCheckpoints(TestCase):
+
+    def test_resume(self):
+        config = {"bucket": "s3://rebuilt", "years": [1900]}
+        computed = []
+
+        def compute(newspaper):
+            if newspaper == "JDG" and not computed_ok:
+                raise RuntimeError("worker died")
+            computed.append(newspaper)
+            return {"newspaper": newspaper, "n": len(newspaper)}
+
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            # the first run fails on one shard, but the others are checkpointed
+            computed_ok = False
+            checkpoint = Checkpoint(checkpoint_dir, "stats", config)
+            with self.assertRaises(RuntimeError):
+                run_shards(["GDL", "JDG", "LCE"], compute, checkpoint, max_parallel=1)
+            self.assertEqual(sorted(computed), ["GDL", "LCE"])
+
+            # a resumed run only computes the missing shard
+            computed_ok = True
+            computed.clear()
+            checkpoint = Checkpoint(checkpoint_dir, "stats", config, resume=True)
+            results = run_shards(["GDL", "JDG", "LCE"], compute, checkpoint)
+            self.assertEqual(computed, ["JDG"])
+            self.assertEqual(list(results), ["GDL", "JDG", "LCE"])
+            self.assertEqual(results["LCE"], {"newspaper": "LCE", "n": 3})
+
+            # without resuming, everything is computed again
+            computed.clear()
+            run_shards(["GDL", "JDG"], compute, Checkpoint(checkpoint_dir, "stats", config))
+            self.assertEqual(sorted(computed), ["GDL", "JDG"])
+
+            # checkpoints of another configuration cannot be resumed
+            with self.assertRaises(ValueError):
+                Checkpoint(checkpoint_dir, "stats", {**config, "years": None}, resume=True)
+
+    def test_without_checkpoint(self):
+        self.assertEqual(run_shards(["a", "bb"], len), {"a": 1, "bb": 2})
+
+
+    def check_dask_shards(self):
+        def shard_graph(newspaper):
+            if newspaper == "JDG":
+                return delayed(lambda: 1 / 0)()
+            return delayed(len)(newspaper)
+
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            # the failing shard does not prevent the others from being checkpointed
+            with self.assertRaises(ZeroDivisionError):
+                run_dask_shards(["GDL", "JDG", "LCE"], shard_graph, Checkpoint(checkpoint_dir, "stats", {}))
+            checkpoint = Checkpoint(checkpoint_dir, "stats", {}, resume=True)
+            self.assertEqual(sorted(checkpoint.completed()), ["GDL", "LCE"])
+            self.assertEqual(run_dask_shards(["GDL", "LCE"], shard_graph, checkpoint), {"GDL": 3, "LCE": 3})
+
+    def test_dask_shards_without_client(self):
+        self.check_dask_shards()
+
+    @unittest.skipIf(Client is None, "distributed is not installed")
+    def test_dask_shards_with_client(self):
+        with Client(processes=False, n_workers=1, threads_per_worker=2):
+            self.check_dask_shards()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import TestCase, mock
+
+import dask
+import fsspec
+from fsspec.implementations.memory import MemoryFileSystem
+from fsspec.registry import _registry
+
+try:
+    from sanity_check.contents import checks, s3_data
+except ImportError:
+    # boto3 or impresso_commons are not installed
+    checks = s3_data = None
+
+
+class MemoryS3FileSystem(MemoryFileSystem):
+    """In-memory stand-in for s3, so that `s3://` paths can be read without a bucket."""
+
+    protocol = ("s3",)
+    store = {}
+    pseudo_dirs = [""]
+
+
+def make_issue(issue_id, content_items, pages):
+    return json.dumps({"id": issue_id, "pp": pages, "i": [{"m": {"id": ci_id, "tp": tp}} for ci_id, tp in content_items]})
+
+
+@unittest.skipIf(checks is None, "s3 dependencies are not installed")
+class TestIncrementalChecks(TestCase):
+
+    files = {
+        "GDL/issues/GDL-1900-issues.jsonl.bz2": [
+            make_issue("GDL-1900-01-01-a", [("GDL-1900-01-01-a-i0001", "ar")], ["GDL-1900-01-01-a-p0001"]),
+            make_issue("GDL-1900-01-01-a", [("GDL-1900-01-01-a-i0001", None)], []),
+        ],
+        "JDG/issues/JDG-1900-issues.jsonl.bz2": [
+            make_issue("JDG-1900-01-01-a", [("JDG-1900-01-01-a-i0001", "img")], ["JDG-1900-01-01-a-p0001"]),
+        ],
+        "GDL/pages/GDL-1900/GDL-1900-01-01-a-pages.jsonl.bz2": [json.dumps({"id": "GDL-1900-01-01-a-p0001"})],
+        "JDG/pages/JDG-1900/JDG-1900-01-01-a-pages.jsonl.bz2": [json.dumps({"id": "JDG-1900-01-01-a-p0001"})],
+    }
+
+    def setUp(self):
+        MemoryS3FileSystem.store.clear()
+        self.state_dir = tempfile.TemporaryDirectory()
+        for patch in [
+            mock.patch.dict(_registry, {"s3": MemoryS3FileSystem}),
+            mock.patch.object(s3_data, "get_storage_options", return_value={}),
+            mock.patch.object(checks, "list_newspaper_objects", self.list_objects),
+            mock.patch.object(checks, "list_pages", self.list_pages),
+            mock.patch.object(checks, "newspaper_etags", self.newspaper_etags),
+            dask.config.set(scheduler="sync"),
+        ]:
+            patch.__enter__()
+            self.addCleanup(patch.__exit__, None, None, None)
+
+        for key, lines in self.files.items():
+            with fsspec.open(f"s3://canonical/{key}", "wt", compression="bz2") as outfile:
+                outfile.write("".join(f"{line}\n" for line in lines))
+
+    def tearDown(self):
+        self.state_dir.cleanup()
+
+    def list_objects(self, bucket_name, base, newspapers=None, years=None):
+        return [
+            {"key": key, "size": 100, "etag": "1"}
+            for key in sorted(self.files)
+            if "/issues/" in key and (newspapers is None or key.split("/")[0] in newspapers)
+        ]
+
+    def list_pages(self, bucket_name, newspapers=None, years=None):
+        return [
+            f"s3://canonical/{key}"
+            for key in sorted(self.files)
+            if "/pages/" in key and (newspapers is None or key.split("/")[0] in newspapers)
+        ]
+
+    def newspaper_etags(self, bucket_name, newspapers=None, years=None):
+        etags = {}
+        for key in self.files:
+            etags.setdefault(key.split("/")[0], {})[key] = "1"
+        return etags
+
+    def test_default_checks_with_state_dir(self):
+        # all the default checks, whatever the index of their results
+        report = checks.run_checks_canonical("s3://canonical", self.state_dir.name, state_dir=self.state_dir.name)
+        self.assertEqual(list(report.results["incremental_status"].status), ["checked", "checked"])
+        ci_types = report.results["ci_types"]
+        self.assertEqual(list(ci_types.index), [("GDL", "ar"), ("GDL", "missing"), ("JDG", "img")])
+        self.assertTrue(os.path.exists(os.path.join(self.state_dir.name, "ci_types.csv")))
+
+        # unchanged newspapers are merged from their stored results
+        reused = checks.run_checks_canonical("s3://canonical", self.state_dir.name, state_dir=self.state_dir.name)
+        self.assertEqual(list(reused.results["incremental_status"].status), ["skipped", "skipped"])
+        self.assertEqual(set(reused.results), set(report.results))
+        for name, df in report.results.items():
+            if name != "incremental_status":
+                self.assertTrue(reused.results[name].sort_index().equals(df.sort_index()), name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+from unittest import TestCase
+
+import dask
+
+from sanity_check.contents.cluster import (
+    MAX_PLANNED_WORKERS,
+    MIN_LOCAL_WORKER_MEMORY,
+    TASK_SIZE,
+    StageEstimate,
+    _adapt,
+    dask_executor,
+    format_bytes,
+    local_cluster_size,
+    plan_resources,
+)
+
+GB = 1024 ** 3
+
+
+class TestCluster(TestCase):
+
+    def test_local_cluster_size(self):
+        # enough memory: one single-threaded worker per CPU
+        self.assertEqual(local_cluster_size(8, 80 * GB), (8, 1, 8 * GB))
+
+        # little memory: fewer workers, with several threads each
+        n_workers, threads, memory_limit = local_cluster_size(8, 5 * GB)
+        self.assertEqual((n_workers, threads), (2, 4))
+        self.assertGreaterEqual(memory_limit, MIN_LOCAL_WORKER_MEMORY)
+
+        # always at least one worker
+        self.assertEqual(local_cluster_size(4, GB)[:2], (1, 4))
+
+    def test_stage_estimate(self):
+        files = [("a.bz2", 1000), ("b.bz2", 2 * TASK_SIZE + 1)]
+
+        # one task per file
+        stage = StageEstimate("issues", files)
+        self.assertEqual((stage.n_files, stage.n_bytes, stage.n_tasks), (2, 2 * TASK_SIZE + 1001, 2))
+        self.assertEqual(stage.max_task_bytes, 2 * TASK_SIZE + 1)
+
+        # large files split into chunks
+        stage = StageEstimate("rebuilt files", files, split_files=True)
+        self.assertEqual((stage.n_files, stage.n_bytes, stage.n_tasks), (2, 2 * TASK_SIZE + 1001, 4))
+        self.assertEqual(stage.max_task_bytes, TASK_SIZE)
+
+    def test_adapt(self):
+        class StaticCluster:
+            def scale(self, n):
+                self.n_workers = n
+
+        # clusters without adaptive scaling are scaled to the planned number of workers
+        cluster = StaticCluster()
+        _adapt(cluster, 2, 20)
+        self.assertEqual(cluster.n_workers, 20)
+
+    def test_plan_resources(self):
+        # small inputs: one worker with the minimum memory
+        plan = plan_resources([StageEstimate("issues", [("a.bz2", 1000)])])
+        self.assertEqual((plan.min_workers, plan.workers, plan.memory), (1, 1, "1G"))
+
+        # the stage with the most tasks sets the number of workers
+        small_files = [(f"{i}.bz2", 1000) for i in range(40)]
+        large_files = [(f"{i}.bz2", 10 * TASK_SIZE) for i in range(2)]
+        plan = plan_resources(
+            [StageEstimate("pages", small_files), StageEstimate("rebuilt files", large_files, split_files=True)]
+        )
+        self.assertEqual((plan.min_workers, plan.workers), (1, 10))
+        self.assertEqual(plan.memory, "1G")
+
+        # files read whole by a single task need more memory
+        plan = plan_resources([StageEstimate("issues", large_files)])
+        self.assertEqual((plan.workers, plan.memory), (1, "7G"))
+
+        # bounded number of workers
+        plan = plan_resources([StageEstimate("issues", [(f"{i}", 1) for i in range(10000)])])
+        self.assertEqual(plan.workers, MAX_PLANNED_WORKERS)
+        self.assertEqual(plan.min_workers, MAX_PLANNED_WORKERS // 10)
+
+    def test_format_bytes(self):
+        self.assertEqual(format_bytes(512), "512")
+        self.assertEqual(format_bytes(1536 * 1024 ** 2), "1.5G")
+
+    def test_threads_executor(self):
+        with dask_executor("threads") as client:
+            self.assertIsNone(client)
+            self.assertEqual(dask.config.get("scheduler"), "threads")
+
+    def test_unknown_executor(self):
+        with self.assertRaises(ValueError):
+            with dask_executor("yarn"):
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
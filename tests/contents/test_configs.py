@@ -0,0 +1,79 @@
+import unittest
+from unittest import TestCase
+
+import pandas as pd
+
+from sanity_check.contents.configs import config_entries, entry_costs, plan_batches, sizes_by_newspaper_year, year_ranges
+
+try:
+    from sanity_check.contents import s3_data
+except ImportError:
+    # boto3 or impresso_commons are not installed
+    s3_data = None
+
+
+def issues_frame(issue_ids):
+    issues = pd.DataFrame(index=pd.Index(issue_ids, name='id'))
+    issues['newspaper_id'] = issues.index.map(lambda i: i.split('-')[0])
+    issues['year'] = issues.index.map(lambda i: int(i.split('-')[1]))
+    return issues
+
+
+class TestConfigs(TestCase):
+
+    def test_year_ranges(self):
+        self.assertEqual(year_ranges([1990, 1850, 1851, 1852, 1851]), [[1850, 1853], [1990, 1991]])
+        self.assertEqual(year_ranges([]), [])
+
+    def test_config_entries(self):
+        issues = issues_frame(
+            [f"GDL-1850-01-{day:02d}-a" for day in range(1, 31)]
+            + [f"GDL-1851-02-{day:02d}-a" for day in range(1, 11)]
+            + ["GDL-1990-01-02-a", "JDG-1900-01-01-a"]
+        )
+        sizes = {("GDL", 1850): 100, ("GDL", 1851): 50, ("GDL", 1990): 10}
+
+        # entries keep the schema of the downstream configurations
+        config = config_entries(issues)
+        self.assertEqual(config, [{"GDL": [1850, 1852]}, {"GDL": [1990, 1991]}, {"JDG": [1900, 1901]}])
+
+        # costs are a separate list, in the same order
+        self.assertEqual(
+            entry_costs(issues, sizes),
+            [
+                {"newspaper": "GDL", "years": [1850, 1852], "n_issues": 40, "bytes": 150},
+                {"newspaper": "GDL", "years": [1990, 1991], "n_issues": 1, "bytes": 10},
+                {"newspaper": "JDG", "years": [1900, 1901], "n_issues": 1, "bytes": 0},
+            ],
+        )
+        self.assertEqual(entry_costs(issues)[0], {"newspaper": "GDL", "years": [1850, 1852], "n_issues": 40})
+
+    @unittest.skipIf(s3_data is None, "s3 dependencies are not installed")
+    def test_sizes_by_newspaper_year(self):
+        # e.g. the issue and page files read by a rebuild
+        file_sizes = [
+            ("s3://canonical/GDL/issues/GDL-1900-issues.jsonl.bz2", 10),
+            ("s3://canonical/GDL/pages/GDL-1900/GDL-1900-01-01-a-pages.jsonl.bz2", 30),
+            ("s3://canonical/GDL/pages/GDL-1901/GDL-1901-01-01-a-pages.jsonl.bz2", 5),
+        ]
+        self.assertEqual(sizes_by_newspaper_year(file_sizes), {("GDL", 1900): 40, ("GDL", 1901): 5})
+
+    def test_plan_batches(self):
+        issues = issues_frame([f"GDL-{year}-01-01-a" for year in range(1900, 1906)] + ["JDG-1900-01-01-a"])
+        sizes = {("GDL", year): 10 for year in range(1900, 1906)}
+        sizes[("JDG", 1900)] = 60
+
+        # the largest newspaper-year gets a batch of its own
+        batches = plan_batches(issues, sizes, n_batches=2)
+        self.assertEqual([batch["cost"] for batch in batches], [60, 60])
+        self.assertEqual(batches[0]["config"], [{"JDG": [1900, 1901]}])
+        self.assertEqual(batches[1]["config"], [{"GDL": [1900, 1906]}])
+
+        # without sizes, batches are balanced by number of issues
+        batches = plan_batches(issues, n_batches=3)
+        self.assertEqual([batch["cost"] for batch in batches], [3, 2, 2])
+        self.assertTrue(all(batch["unit"] == "n_issues" for batch in batches))
+
+
+if __name__ == '__main__':
+    unittest.main()
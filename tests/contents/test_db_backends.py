@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+
+from sanity_check.contents.db_backends import (
+    MySQLBackend,
+    SQLiteBackend,
+    backend_class,
+    create_local_db,
+    db_label,
+    generate_fixtures,
+    get_backend,
+    read_fixtures,
+)
+from sanity_check.contents.mysql import (
+    content_item_counts,
+    fetch_ids,
+    iter_rows,
+    key_ranges,
+    list_issues,
+    list_newspapers,
+    list_table_newspapers,
+    read_ids,
+)
+
+try:
+    from sanity_check.contents import s3_data
+except ImportError:
+    # boto3 or impresso_commons are not installed
+    s3_data = None
+
+
+class TestDBBackends(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "fixtures.sqlite")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_backend_class(self):
+        self.assertIs(backend_class("dev"), MySQLBackend)
+        self.assertIs(backend_class("/tmp/fixtures.sqlite"), SQLiteBackend)
+        self.assertIs(backend_class("sqlite:///tmp/fixtures"), SQLiteBackend)
+        self.assertEqual(db_label("prod"), "prod")
+        self.assertEqual(db_label("/tmp/fixtures.sqlite"), "fixtures")
+
+    def test_generate_fixtures(self):
+        fixtures = generate_fixtures(["GDL", "JDG"], [1900, 1901], issues_per_year=400, items_per_issue=3)
+
+        self.assertEqual(len(fixtures["newspapers"]), 2)
+        self.assertEqual(len(fixtures["issues"]), 2 * 2 * 400)
+        self.assertEqual(len(fixtures["content_items"]), 2 * 2 * 400 * 3)
+        issue_ids = [row[0] for row in fixtures["issues"]]
+        self.assertEqual(len(set(issue_ids)), len(issue_ids))
+        self.assertEqual(issue_ids[0], "GDL-1900-01-01-a")
+        self.assertEqual(issue_ids[365], "GDL-1900-01-01-b")
+        self.assertEqual(fixtures["content_items"][0], ("GDL-1900-01-01-a-i0001", "GDL-1900-01-01-a"))
+
+    def test_local_db(self):
+        create_local_db(self.db_path, generate_fixtures(["GDL", "JDG"], [1900, 1901], 10, 2))
+
+        self.assertIsInstance(get_backend(self.db_path), SQLiteBackend)
+        self.assertEqual(list_newspapers(self.db_path), ["GDL", "JDG"])
+        self.assertEqual(len(list_issues(self.db_path)), 40)
+        ids = read_ids("content_items", key_ranges(["GDL"], [1901])[0], self.db_path)
+        self.assertEqual(len(ids), 20)
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(all(ci.startswith("GDL-1901-") for ci in ids))
+        self.assertEqual(
+            content_item_counts(self.db_path),
+            [("GDL", "1900", 20), ("GDL", "1901", 20), ("JDG", "1900", 20), ("JDG", "1901", 20)],
+        )
+        rows = list(iter_rows("SELECT id FROM issues WHERE year = :year;", {"year": 1900}, self.db_path, fetch_size=3))
+        self.assertEqual(len(rows), 20)
+
+    def create_db_with_missing_timespan(self):
+        fixtures = generate_fixtures(["GDL", "JDG"], [1900], 10, 2)
+        fixtures["content_items"].append(("XYZ-1900-01-01-a-i0001", "XYZ-1900-01-01-a"))
+        create_local_db(self.db_path, fixtures)
+
+    def test_list_table_newspapers(self):
+        self.create_db_with_missing_timespan()
+        self.assertEqual(list_newspapers(self.db_path), ["GDL", "JDG"])
+        self.assertEqual(list_table_newspapers("content_items", self.db_path), ["GDL", "JDG", "XYZ"])
+        self.assertEqual(list_table_newspapers("issues", self.db_path), ["GDL", "JDG"])
+
+    @unittest.skipIf(s3_data is None, "s3 dependencies are not installed")
+    def test_fetch_ids_of_newspapers_missing_from_timespans(self):
+        self.create_db_with_missing_timespan()
+
+        # the content items of XYZ are fetched, although XYZ has no timespan
+        ci_ids = fetch_ids("content_items", self.db_path).compute(scheduler="sync")
+        self.assertEqual(len(ci_ids), 41)
+        self.assertIn("XYZ-1900-01-01-a-i0001", ci_ids)
+        self.assertEqual(fetch_ids("content_items", self.db_path, ["X*"]).compute(scheduler="sync"), ci_ids[-1:])
+
+    def test_read_fixtures(self):
+        with open(os.path.join(self.tmp_dir.name, "issues.csv"), "w", encoding="utf-8") as outfile:
+            outfile.write("year,id,newspaper_id\n1900,GDL-1900-01-01-a,GDL\n")
+
+        fixtures = read_fixtures(self.tmp_dir.name)
+        self.assertEqual(fixtures["issues"], [("GDL-1900-01-01-a", "GDL", "1900")])
+        self.assertEqual(fixtures["content_items"], [])
+
+        create_local_db(self.db_path, fixtures)
+        self.assertEqual(list(iter_rows("SELECT id, year FROM issues;", db_config=self.db_path)), [("GDL-1900-01-01-a", 1900)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import json
+import unittest
+from unittest import TestCase
+
+from sanity_check.contents.decoding import decode, extract_field
+
+
+class TestDecoding(TestCase):
+
+    issue = {
+        "id": "GDL-1900-01-01-a",
+        "ar": "open_public",
+        "pp": ["GDL-1900-01-01-a-p0001", "GDL-1900-01-01-a-p0002"],
+        "i": [
+            {"m": {"id": "GDL-1900-01-01-a-i0001", "pp": [1], "tp": "ar"}},
+            {"m": {"id": "GDL-1900-01-01-a-i0002", "pp": [2], "tp": "img"}},
+        ],
+    }
+
+    def test_decode_projects_fields(self):
+        line = json.dumps(self.issue)
+
+        self.assertEqual(decode(line), self.issue)
+        self.assertEqual(decode(line, ["id", "pp"]), {"id": self.issue["id"], "pp": self.issue["pp"]})
+        self.assertEqual(
+            decode(line, ["i[*].m.id", "i[*].m.pp"]),
+            {"i": [{"m": {"id": ci["m"]["id"], "pp": ci["m"]["pp"]}} for ci in self.issue["i"]]},
+        )
+        # missing fields are left out
+        self.assertEqual(decode(line, ["id", "ft"]), {"id": self.issue["id"]})
+
+    def test_extract_field(self):
+        self.assertEqual(extract_field(json.dumps(self.issue)), self.issue["id"])
+        # `id` is not the first key: falls back to decoding
+        self.assertEqual(extract_field(json.dumps({"ar": "closed", "id": "JDG-1900-01-01-a"})), "JDG-1900-01-01-a")
+        # escaped values fall back to decoding as well
+        self.assertEqual(extract_field(json.dumps({"id": 'a"b'})), 'a"b')
+        self.assertIsNone(extract_field("{}"))
+        self.assertIsNone(extract_field(""))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,19 @@
+import unittest
+from unittest import TestCase
+
+from sanity_check.contents.helpers import parse_newspapers, parse_years
+
+
+class TestHelpers(TestCase):
+
+    def test_parse_newspapers(self):
+        self.assertEqual(parse_newspapers("GDL JDG,BL*"), ["GDL", "JDG", "BL*"])
+        self.assertIsNone(parse_newspapers(None))
+
+    def test_parse_years(self):
+        self.assertEqual(parse_years("1850-1852 1900,1851"), [1850, 1851, 1852, 1900])
+        self.assertIsNone(parse_years(""))
+
+
+if __name__ == '__main__':
+    unittest.main()
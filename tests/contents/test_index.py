@@ -0,0 +1,156 @@
+import json
+import tempfile
+import unittest
+from unittest import TestCase, mock
+
+import dask
+import fsspec
+from fsspec.implementations.memory import MemoryFileSystem
+from fsspec.registry import _registry
+
+from sanity_check.contents.scan import DuplicatedContentItemIDs, scan_issues
+
+try:
+    from sanity_check.contents import index, s3_data
+except ImportError:
+    # boto3 or impresso_commons are not installed
+    index = s3_data = None
+
+
+class MemoryS3FileSystem(MemoryFileSystem):
+    """In-memory stand-in for s3, so that `s3://` paths can be read without a bucket."""
+
+    protocol = ("s3",)
+    store = {}
+    pseudo_dirs = [""]
+
+
+class RecordingDuplicates(DuplicatedContentItemIDs):
+    """Keeps the reduced state it is given (at module level, so that it is pickled by reference)."""
+
+    reduced = []
+
+    def finalize(self, acc):
+        self.reduced.append(dict(acc))
+        return super().finalize(acc)
+
+
+def make_issue(issue_id, ci_ids, pages):
+    return json.dumps({"id": issue_id, "ar": "OpenPublic", "pp": pages, "i": [{"m": {"id": ci_id}} for ci_id in ci_ids]})
+
+
+@unittest.skipIf(index is None, "s3 dependencies are not installed")
+class TestIndex(TestCase):
+
+    files = {
+        "GDL/issues/GDL-1900-issues.jsonl.bz2": [
+            make_issue(
+                "GDL-1900-01-01-a", ["GDL-1900-01-01-a-i0001", "GDL-1900-01-01-a-i0002"], ["GDL-1900-01-01-a-p0001"]
+            ),
+        ],
+        "GDL/issues/GDL-1901-issues.jsonl.bz2": [
+            make_issue("GDL-1901-01-01-a", ["GDL-1901-01-01-a-i0001"], ["GDL-1901-01-01-a-p0001"]),
+        ],
+        "JDG/issues/JDG-1900-issues.jsonl.bz2": [
+            make_issue("JDG-1900-01-01-a", ["JDG-1900-01-01-a-i0001"], ["JDG-1900-01-01-a-p0001"]),
+        ],
+        "GDL/pages/GDL-1900-pages.jsonl.bz2": [json.dumps({"id": "GDL-1900-01-01-a-p0001"})],
+        "GDL/pages/GDL-1901-pages.jsonl.bz2": [json.dumps({"id": "GDL-1901-01-01-a-p0001"})],
+    }
+
+    def setUp(self):
+        MemoryS3FileSystem.store.clear()
+        self.index_dir = tempfile.TemporaryDirectory()
+        for patch in [
+            mock.patch.dict(_registry, {"s3": MemoryS3FileSystem}),
+            mock.patch.dict(index._CHECKED_VERSIONS, clear=True),
+            mock.patch.object(index, "_list_canonical_objects", self.list_objects),
+            mock.patch.object(index, "get_storage_options", return_value={}),
+            mock.patch.object(s3_data, "get_storage_options", return_value={}),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.etags, self.n_writes = {}, 0
+        for key, lines in self.files.items():
+            self.write(key, lines)
+
+    def tearDown(self):
+        self.index_dir.cleanup()
+
+    def write(self, key, lines):
+        with fsspec.open(f"s3://canonical/{key}", "wt", compression="bz2") as outfile:
+            outfile.write("".join(f"{line}\n" for line in lines))
+        # a new ETag for each write
+        self.n_writes += 1
+        self.etags[key] = str(self.n_writes)
+
+    def list_objects(self, canonical_bucket_name):
+        return [{"key": key, "size": 0, "etag": etag} for key, etag in sorted(self.etags.items())]
+
+    def test_build_and_read_index(self):
+        version_dir = index.build_index("s3://canonical", self.index_dir.name)
+        self.assertEqual(index.resolve_index(self.index_dir.name, "s3://canonical"), version_dir)
+
+        issues = index.read_index_table(self.index_dir.name, "s3://canonical", "issues").compute()
+        self.assertEqual(sorted(issues.issue_id), ["GDL-1900-01-01-a", "GDL-1901-01-01-a", "JDG-1900-01-01-a"])
+        gdl_1900 = issues.set_index("issue_id").loc["GDL-1900-01-01-a"]
+        self.assertEqual(list(gdl_1900.ci_ids), ["GDL-1900-01-01-a-i0001", "GDL-1900-01-01-a-i0002"])
+        self.assertEqual(list(gdl_1900.page_ids), ["GDL-1900-01-01-a-p0001"])
+
+        pages = index.read_index_table(
+            self.index_dir.name, "s3://canonical", "pages", ["page_id"], newspapers=["G*"], years=[1901]
+        ).compute()
+        self.assertEqual(list(pages.page_id), ["GDL-1901-01-01-a-p0001"])
+
+        # an existing version is not built again
+        with mock.patch.object(index.db, "read_text") as read_text:
+            self.assertEqual(index.build_index("s3://canonical", self.index_dir.name), version_dir)
+            read_text.assert_not_called()
+
+    def test_compact_duplicates_by_newspaper(self):
+        # a content item ID of GDL repeated in another year file
+        self.write(
+            "GDL/issues/GDL-1902-issues.jsonl.bz2",
+            [make_issue("GDL-1902-01-01-a", ["GDL-1900-01-01-a-i0001", "GDL-1902-01-01-a-i0001"], [])],
+        )
+        index.build_index("s3://canonical", self.index_dir.name)
+
+        # (the in-memory bucket is only visible in this process)
+        dask_config = dask.config.set(scheduler="sync")
+        dask_config.__enter__()
+        self.addCleanup(dask_config.__exit__, None, None, None)
+
+        issues = index.issues_by_newspaper(self.index_dir.name, "s3://canonical")
+        self.assertEqual(issues.npartitions, 2)
+        self.assertEqual(len(issues.compute()), 4)
+
+        RecordingDuplicates.reduced = []
+        report = scan_issues(issues, [RecordingDuplicates()], whole_newspapers=True)
+        self.assertEqual(list(report.results["duplicate_ci_ids"].index), ["GDL-1900-01-01-a-i0001"])
+        # only the collisions of each newspaper reach the reduction, not all the IDs of the corpus
+        self.assertEqual(RecordingDuplicates.reduced, [{"GDL-1900-01-01-a-i0001": 2}])
+
+    def test_outdated_index(self):
+        version_dir = index.build_index("s3://canonical", self.index_dir.name)
+        version = version_dir.rsplit("/", 1)[-1]
+
+        # a file rewritten after the index was built
+        index._CHECKED_VERSIONS.clear()
+        self.write("JDG/issues/JDG-1900-issues.jsonl.bz2", [make_issue("JDG-1900-01-02-a", [], [])])
+        with self.assertRaises(ValueError):
+            index.read_index_table(self.index_dir.name, "s3://canonical", "issues")
+
+        # unless the version is pinned
+        issues = index.read_index_table(self.index_dir.name, "s3://canonical", "issues", version=version).compute()
+        self.assertIn("JDG-1900-01-01-a", list(issues.issue_id))
+        self.assertEqual(index.resolve_index(self.index_dir.name, "s3://canonical", version), version_dir)
+
+        # a new version is built for the new files
+        new_version_dir = index.build_index("s3://canonical", self.index_dir.name)
+        self.assertNotEqual(new_version_dir, version_dir)
+        self.assertEqual(index.resolve_index(self.index_dir.name, "s3://canonical"), new_version_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
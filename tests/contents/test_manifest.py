@@ -0,0 +1,120 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import TestCase, mock
+
+from sanity_check.contents import manifest
+from sanity_check.contents.manifest import BucketManifest
+
+try:
+    from sanity_check.contents import s3_data
+except ImportError:
+    # boto3 or impresso_commons are not installed
+    s3_data = None
+
+
+class FakeS3Client:
+    """Paginated `list_objects` over an in-memory bucket (`{key: (size, etag)}`)."""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.n_listings = 0
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects"
+        return self
+
+    def paginate(self, Bucket, Prefix="", PaginationConfig=None):
+        self.n_listings += 1
+        contents = [
+            {"Key": key, "Size": size, "ETag": f'"{etag}"'}
+            for key, (size, etag) in sorted(self.objects.items())
+            if key.startswith(Prefix)
+        ]
+        yield {"Contents": contents} if contents else {}
+
+
+@unittest.skipIf(s3_data is None, "s3 dependencies are not installed")
+class TestBucketManifest(TestCase):
+
+    prefixes = ["GDL/issues/", "JDG/issues/"]
+
+    def setUp(self):
+        self.run_started_at = manifest._RUN_STARTED_AT
+        self.manifest_dir = tempfile.TemporaryDirectory()
+        self.s3_client = FakeS3Client(
+            {
+                "GDL/issues/GDL-1900-issues.jsonl.bz2": (10, "a"),
+                "GDL/issues/GDL-1901-issues.jsonl.bz2": (20, "b"),
+                "JDG/issues/JDG-1900-issues.jsonl.bz2": (30, "c"),
+            }
+        )
+
+    def tearDown(self):
+        manifest._RUN_STARTED_AT = self.run_started_at
+        self.manifest_dir.cleanup()
+
+    def new_run(self, max_age=0):
+        # cached listings were made by an earlier run
+        manifest._RUN_STARTED_AT = time.time() + 1
+        return BucketManifest("s3://canonical", self.manifest_dir.name, max_age, self.s3_client)
+
+    def test_listings_are_cached(self):
+        bucket_manifest = self.new_run()
+        self.assertEqual(bucket_manifest.refresh(self.prefixes), self.prefixes)
+        self.assertEqual([obj["etag"] for obj in bucket_manifest.objects(self.prefixes)], ["a", "b", "c"])
+
+        # listings made during a run are not listed again by the same run
+        manifest._RUN_STARTED_AT = 0
+        n_listings = self.s3_client.n_listings
+        self.assertEqual(len(bucket_manifest.objects(self.prefixes)), 3)
+        self.assertEqual(self.s3_client.n_listings, n_listings)
+
+        # nor by later runs within `max_age`
+        self.assertEqual(self.new_run(max_age=60).refresh(self.prefixes), [])
+        self.assertEqual(self.s3_client.n_listings, n_listings)
+
+    def test_changed_prefixes(self):
+        self.new_run().refresh(self.prefixes)
+        self.assertEqual(self.new_run().refresh(self.prefixes), [])
+
+        # a key before the last cached one, a key rewritten in place, a removed key
+        for change, prefix in [
+            (lambda objects: objects.update({"GDL/issues/GDL-1899-issues.jsonl.bz2": (5, "d")}), "GDL/issues/"),
+            (lambda objects: objects.update({"JDG/issues/JDG-1900-issues.jsonl.bz2": (30, "e")}), "JDG/issues/"),
+            (lambda objects: objects.pop("GDL/issues/GDL-1901-issues.jsonl.bz2"), "GDL/issues/"),
+        ]:
+            change(self.s3_client.objects)
+            bucket_manifest = self.new_run()
+            self.assertEqual(bucket_manifest.refresh(self.prefixes), [prefix])
+            self.assertEqual(
+                sorted((obj["key"], obj["etag"]) for obj in bucket_manifest.objects(self.prefixes, refresh=False)),
+                sorted((key, etag) for key, (_, etag) in self.s3_client.objects.items()),
+            )
+
+    def test_default_max_age(self):
+        self.new_run().refresh(self.prefixes)
+        n_listings = self.s3_client.n_listings
+
+        # later runs reuse recent listings without any request, unless told to list them once per run
+        with mock.patch.dict(os.environ, {manifest.MANIFEST_DIR_ENV: self.manifest_dir.name}):
+            os.environ.pop(manifest.MANIFEST_MAX_AGE_ENV, None)
+            bucket_manifest = manifest.manifest_from_env("s3://canonical", self.s3_client)
+            self.assertEqual(bucket_manifest.max_age, manifest.DEFAULT_MAX_AGE)
+            self.assertEqual(len(bucket_manifest.objects(self.prefixes)), 3)
+            self.assertEqual(self.s3_client.n_listings, n_listings)
+
+            manifest.enable_manifest_cache(self.manifest_dir.name, 0)
+            manifest.manifest_from_env("s3://canonical", self.s3_client).refresh(self.prefixes)
+            self.assertEqual(self.s3_client.n_listings, n_listings + len(self.prefixes))
+
+    def test_save_leaves_no_temporary_files(self):
+        bucket_manifest = self.new_run()
+        bucket_manifest.refresh(self.prefixes)
+        prefix_dir = os.path.join(self.manifest_dir.name, "canonical", "GDL/issues/")
+        self.assertEqual(os.listdir(prefix_dir), [manifest.MANIFEST_FILENAME])
+
+
+if __name__ == "__main__":
+    unittest.main()
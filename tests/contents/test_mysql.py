@@ -0,0 +1,41 @@
+import sqlite3
+import unittest
+from unittest import TestCase
+
+from sanity_check.contents.mysql import content_item_counts, key_ranges
+
+
+class TestMySQL(TestCase):
+
+    def test_key_ranges(self):
+        ids = ["GDL-1899-12-31-a", "GDL-1900-01-01-a-i0001", "GDL-1900-12-31-a", "GDL-1901-01-01-a", "GDLX-1900-01-01-a"]
+
+        def in_range(key_range):
+            low, high = key_range
+            return [i for i in ids if low <= i < high]
+
+        self.assertEqual(key_ranges(["GDL", "GDLX"]), [("GDL-", "GDL."), ("GDLX-", "GDLX.")])
+        self.assertEqual(in_range(key_ranges(["GDL"])[0]), ids[:4])
+        self.assertEqual(in_range(key_ranges(["GDL"], [1900])[0]), ids[1:3])
+        self.assertEqual(len(key_ranges(["GDL", "JDG"], [1900, 1901, 1900])), 4)
+
+    def test_content_item_counts(self):
+        ids = [
+            "GDL-1900-01-01-a-i0001",
+            "GDL-1900-01-01-a-i0002",
+            "GDL-1901-01-01-a-i0001",
+            "JDG-1900-01-02-a-i0001",
+            "BLB-1900-01-02-a-i0001",
+        ]
+        db_conn = sqlite3.connect(":memory:")
+        db_conn.execute("CREATE TABLE content_items (id VARCHAR(50) PRIMARY KEY);")
+        db_conn.executemany("INSERT INTO content_items VALUES (?);", [(ci,) for ci in ids])
+
+        counts = content_item_counts(db_conn=db_conn)
+
+        self.assertEqual(counts, [("BLB", "1900", 1), ("GDL", "1900", 2), ("GDL", "1901", 1), ("JDG", "1900", 1)])
+        db_conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
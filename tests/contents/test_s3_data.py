@@ -0,0 +1,155 @@
+import os
+import unittest
+from unittest import TestCase, mock
+
+from sanity_check.contents.manifest import MANIFEST_DIR_ENV
+
+try:
+    from sanity_check.contents import s3_data
+except ImportError:
+    # boto3 or impresso_commons are not installed
+    s3_data = None
+
+
+class FakeS3Client:
+    """Paginated (and optionally delimited) `list_objects` over an in-memory bucket."""
+
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+        self.requests = []
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects"
+        return self
+
+    def paginate(self, Bucket, Prefix="", Delimiter=None, PaginationConfig=None):
+        page_size = (PaginationConfig or {}).get("PageSize", 1000)
+        entries = []
+        for key in self.keys:
+            if not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                prefix = Prefix + rest.split(Delimiter)[0] + Delimiter
+                if ("prefix", prefix) not in entries:
+                    entries.append(("prefix", prefix))
+            else:
+                entries.append(("key", key))
+
+        for start in range(0, max(len(entries), 1), page_size):
+            self.requests.append({"Bucket": Bucket, "Prefix": Prefix, "Delimiter": Delimiter})
+            page = entries[start : start + page_size]
+            response = {}
+            keys = [{"Key": key, "Size": len(key), "ETag": f'"{key}"'} for kind, key in page if kind == "key"]
+            prefixes = [{"Prefix": prefix} for kind, prefix in page if kind == "prefix"]
+            if keys:
+                response["Contents"] = keys
+            if prefixes:
+                response["CommonPrefixes"] = prefixes
+            yield response
+
+
+@unittest.skipIf(s3_data is None, "s3 dependencies are not installed")
+class TestS3Listings(TestCase):
+
+    keys = [
+        "GDL/issues/GDL-1900-issues.jsonl.bz2",
+        "GDL/issues/GDL-1901-issues.jsonl.bz2",
+        "GDL/issues/GDL-1950-issues.jsonl.bz2",
+        "GDL/pages/GDL-1900/GDL-1900-01-01-a-pages.jsonl.bz2",
+        "JDG/issues/JDG-1900-issues.jsonl.bz2",
+        "LCE/issues/",
+    ]
+
+    def setUp(self):
+        self.s3_client = FakeS3Client(self.keys)
+
+    def test_list_newspapers(self):
+        newspapers = s3_data.list_newspapers("s3://canonical", self.s3_client, page_size=2)
+        self.assertEqual(newspapers, {"GDL", "JDG", "LCE"})
+        # only the common prefixes are listed
+        self.assertTrue(all(request["Delimiter"] == "/" for request in self.s3_client.requests))
+        self.assertEqual(len(self.s3_client.requests), 2)
+
+        # the same, paging through all keys
+        self.assertEqual(s3_data.list_newspapers("s3://canonical", FakeS3Client(self.keys), delimited=False), newspapers)
+        self.assertEqual(s3_data.list_newspapers("s3://empty", FakeS3Client([])), set())
+
+    def test_list_keys(self):
+        objects = s3_data.list_keys("s3://canonical/ignored", "GDL/issues/", self.s3_client, page_size=2)
+        self.assertEqual([obj["Key"] for obj in objects], self.keys[:3])
+        self.assertEqual({request["Bucket"] for request in self.s3_client.requests}, {"canonical"})
+        self.assertEqual(len(self.s3_client.requests), 2)
+        self.assertEqual(s3_data.list_keys("canonical", "BL/", self.s3_client), [])
+
+    def test_listing_prefixes(self):
+        self.assertEqual(s3_data._listing_prefixes(["GDL", "JDG"], "{np}/issues/"), ["GDL/issues/", "JDG/issues/"])
+        self.assertEqual(
+            s3_data._listing_prefixes(["GDL"], "{np}/pages/", [1901, 1900, 1901]),
+            ["GDL/pages/GDL-1900", "GDL/pages/GDL-1901"],
+        )
+        # too many years: newspapers are listed as a whole
+        years = range(1900, 1901 + s3_data.MAX_YEAR_PREFIXES)
+        self.assertEqual(s3_data._listing_prefixes(["GDL"], "{np}/issues/", years), ["GDL/issues/"])
+
+    def test_list_newspaper_objects(self):
+        for patch in [
+            mock.patch.object(s3_data, "get_s3_client", return_value=self.s3_client),
+            # listed from the bucket, not from a manifest
+            mock.patch.dict(os.environ, {MANIFEST_DIR_ENV: ""}),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        objects = s3_data.list_newspaper_objects("s3://canonical", "{np}/issues/", ["G*", "LCE"], [1900, 1950])
+        self.assertEqual(
+            [obj["key"] for obj in objects], ["GDL/issues/GDL-1900-issues.jsonl.bz2", "GDL/issues/GDL-1950-issues.jsonl.bz2"]
+        )
+        # one listing per selected newspaper and year
+        listed = sorted(request["Prefix"] for request in self.s3_client.requests if request["Prefix"])
+        self.assertEqual(listed, ["GDL/issues/GDL-1900", "GDL/issues/GDL-1950", "LCE/issues/LCE-1900", "LCE/issues/LCE-1950"])
+
+        # directory markers are left out
+        self.assertEqual(s3_data.list_newspaper_objects("s3://canonical", "{np}/issues/", ["LCE"]), [])
+
+
+@unittest.skipIf(s3_data is None, "s3 dependencies are not installed")
+class TestS3Client(TestCase):
+
+    storage_options = {"key": "id", "secret": "secret", "client_kwargs": {"endpoint_url": "https://s3.example.org"}}
+
+    def setUp(self):
+        self.boto3 = mock.MagicMock()
+        for patch in [
+            mock.patch.object(s3_data, "boto3", self.boto3),
+            mock.patch.object(s3_data, "Config", lambda **kwargs: kwargs),
+            mock.patch.object(s3_data, "IMPRESSO_STORAGEOPT", self.storage_options),
+            mock.patch.dict(s3_data._s3_clients, clear=True),
+            mock.patch.dict(os.environ, {s3_data.S3_POOL_SIZE_ENV: "8"}),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_get_s3_client(self):
+        # nothing is created until the client is used
+        self.boto3.session.Session.assert_not_called()
+
+        client = s3_data.get_s3_client()
+        self.assertIs(s3_data.get_s3_client(), client)
+        self.boto3.session.Session.assert_called_once_with(aws_access_key_id="id", aws_secret_access_key="secret")
+        self.boto3.session.Session.return_value.client.assert_called_once_with(
+            "s3", endpoint_url="https://s3.example.org", config={"max_pool_connections": 8}
+        )
+        self.assertEqual(s3_data.get_storage_options()["config_kwargs"], {"max_pool_connections": 8})
+
+        # a new client for another pool size, or in another (e.g. forked) process
+        os.environ[s3_data.S3_POOL_SIZE_ENV] = "16"
+        s3_data.get_s3_client()
+        with mock.patch.object(s3_data.os, "getpid", return_value=-1):
+            s3_data.get_s3_client()
+        self.assertEqual(self.boto3.session.Session.call_count, 3)
+        self.assertEqual(len(s3_data._s3_clients), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+import json
+import unittest
+from unittest import TestCase
+
+import pandas as pd
+from dask import bag as db
+
+from sanity_check.contents.scan import (
+    CHECKS,
+    ContentItemCheck,
+    ContentItemPageReferences,
+    ContentItemTypes,
+    EmptyPages,
+    PageCheck,
+    create_checks,
+    register_check,
+    scan_pipeline,
+    scan_issues,
+    newspaper_page_ids_mismatches,
+    page_ids_mismatches,
+    DuplicatedIssueIDs,
+    DuplicatedContentItemIDs,
+    SketchedDuplicateIDs,
+)
+
+
+def make_issue(issue_id, ci_ids, pages=()):
+    return json.dumps({"id": issue_id, "pp": list(pages), "i": [{"m": {"id": ci_id}} for ci_id in ci_ids]})
+
+
+class TestScanIssues(TestCase):
+
+    issue_lines = [
+        make_issue("GDL-1900-01-01-a", ["GDL-1900-01-01-a-i0001", "GDL-1900-01-01-a-i0002"]),
+        make_issue("GDL-1900-01-02-a", ["GDL-1900-01-02-a-i0001"]),
+        "",
+        make_issue("GDL-1900-01-01-a", ["GDL-1900-01-01-a-i0001"]),
+        make_issue("JDG-1900-01-01-a", ["JDG-1900-01-01-a-i0001"]),
+    ]
+
+    def test_single_scan_runs_all_checks(self):
+        issue_lines = db.from_sequence(self.issue_lines, npartitions=3)
+        report = scan_issues(issue_lines, [DuplicatedIssueIDs(), DuplicatedContentItemIDs()])
+
+        self.assertEqual(report.n_records, 4)
+        self.assertEqual(report.bytes_read, sum(len(line) for line in self.issue_lines))
+        self.assertIn("decode", report.timings)
+
+        duplicated_issues = report.results["duplicate_issue_ids"]
+        self.assertEqual(list(duplicated_issues.index), ["GDL-1900-01-01-a"])
+        self.assertEqual(duplicated_issues.loc["GDL-1900-01-01-a"].freq, 2)
+
+        duplicated_cis = report.results["duplicate_ci_ids"]
+        self.assertEqual(list(duplicated_cis.index), ["GDL-1900-01-01-a-i0001"])
+        self.assertEqual(list(duplicated_cis.newspaper_id), ["GDL"])
+
+    def test_aligned_partitions_give_same_results(self):
+        checks = [DuplicatedIssueIDs(), DuplicatedContentItemIDs()]
+        shuffled = scan_issues(db.from_sequence(self.issue_lines, npartitions=3), checks)
+
+        # one partition per newspaper-year: GDL-1900 issues, then JDG-1900 ones
+        by_newspaper_year = db.from_sequence(self.issue_lines, partition_size=4)
+        self.assertEqual(by_newspaper_year.npartitions, 2)
+        contexts = [{"newspaper": np, "year": 1900, "page_files": []} for np in ["GDL", "JDG"]]
+        aligned = scan_issues(by_newspaper_year, checks, partition_contexts=contexts)
+
+        for name in shuffled.results:
+            self.assertTrue(shuffled.results[name].equals(aligned.results[name]))
+
+    def test_two_stage_duplicates(self):
+        issue_lines = db.from_sequence(self.issue_lines, npartitions=3)
+        sketch_check = SketchedDuplicateIDs("ci", capacity=1000)
+        approximate = scan_issues(issue_lines, [sketch_check]).results["duplicate_ci_ids_approx"]
+        self.assertEqual(list(approximate.n_ids), [4, 1])
+
+        exact = scan_issues(issue_lines, [DuplicatedContentItemIDs(candidates=sketch_check.sketch)])
+        self.assertEqual(list(exact.results["duplicate_ci_ids"].index), ["GDL-1900-01-01-a-i0001"])
+
+        # sketches are sized from the size of the issue files
+        self.assertEqual(SketchedDuplicateIDs.for_input_size("ci", 10 ** 10).capacity, 10 ** 8)
+        self.assertEqual(SketchedDuplicateIDs.for_input_size("issue", 10 ** 10).capacity, 5 * 10 ** 6)
+
+    def test_page_ids_mismatches(self):
+        mismatches = newspaper_page_ids_mismatches(
+            "GDL",
+            ["GDL-1900-01-01-a-p0002", "GDL-1900-01-01-a-p0001"],
+            ["GDL-1900-01-01-a-p0001", "GDL-1900-01-01-a-p0003"],
+        )
+        df = page_ids_mismatches(mismatches.only_in_issues, mismatches.only_in_pages)
+
+        self.assertEqual(list(df.index), ["GDL-1900-01-01-a-p0002", "GDL-1900-01-01-a-p0003"])
+        self.assertEqual(list(df.from_issues.fillna(False)), [True, False])
+        self.assertEqual(list(df.from_pages.fillna(False)), [False, True])
+        self.assertEqual(list(df.newspaper_id), ["GDL", "GDL"])
+
+    def test_ci_page_references(self):
+        issue = {
+            "id": "GDL-1900-01-01-a",
+            "pp": ["GDL-1900-01-01-a-p0001", "GDL-1900-01-01-a-p0002", "GDL-1900-01-01-a-p0003"],
+            "i": [
+                {"m": {"id": "GDL-1900-01-01-a-i0001", "pp": [1, 2]}},
+                {"m": {"id": "GDL-1900-01-01-a-i0002", "pp": [4]}},
+            ],
+        }
+        report = scan_issues(db.from_sequence([json.dumps(issue)]), [ContentItemPageReferences()])
+
+        counts = report.results["ci_page_references_counts"]
+        self.assertEqual(counts.loc["GDL"].tolist(), [2, 3, 1, 1])
+
+        offending = report.results["ci_page_references_offending"]
+        self.assertEqual(list(offending.kind), ["missing_page", "unreferenced_page"])
+        self.assertEqual(offending.ci_id[0], "GDL-1900-01-01-a-i0002")
+        self.assertEqual(list(offending.page_id), ["GDL-1900-01-01-a-p0004", "GDL-1900-01-01-a-p0003"])
+
+    def test_ci_types_and_empty_pages(self):
+        issue = {
+            "id": "GDL-1900-01-01-a",
+            "i": [{"m": {"id": "GDL-1900-01-01-a-i0001", "tp": "ar"}}, {"m": {"id": "GDL-1900-01-01-a-i0002"}}],
+        }
+        pages = [
+            {"id": "GDL-1900-01-01-a-p0001", "r": [{"c": [0, 0, 10, 10], "p": []}]},
+            {"id": "GDL-1900-01-01-a-p0002", "r": []},
+        ]
+        report = scan_pipeline(
+            [ContentItemTypes(), EmptyPages()],
+            db.from_sequence([json.dumps(issue)]),
+            lambda: db.from_sequence([json.dumps(page) for page in pages]),
+        )
+
+        types = report.results["ci_types"]
+        self.assertEqual(types.loc[("GDL", "ar")].n_content_items, 1)
+        self.assertEqual(types.loc[("GDL", "missing")].n_content_items, 1)
+
+        self.assertEqual(report.results["empty_pages_counts"].loc["GDL"].tolist(), [2, 1])
+        self.assertEqual(list(report.results["empty_pages_offending"].index), ["GDL-1900-01-01-a-p0002"])
+
+    def test_registry_and_fused_pipeline(self):
+        self.assertEqual(
+            [check.name for check in create_checks(canonical_bucket_name="s3://canonical")],
+            ["duplicate_issue_ids", "duplicate_ci_ids", "inconsistent_page_ids", "ci_page_references", "ci_types"],
+        )
+        with self.assertRaises(ValueError):
+            create_checks(["no_such_check"])
+
+        # checks needing data that is not indexed are left out on the index, or refused if selected
+        self.assertEqual(
+            [check.name for check in create_checks(canonical_bucket_name="s3://canonical", index_dir="index")],
+            ["duplicate_issue_ids", "duplicate_ci_ids", "inconsistent_page_ids"],
+        )
+        with self.assertRaises(ValueError):
+            create_checks(["duplicate_issue_ids", "ci_types"], index_dir="index")
+
+        @register_check
+        class CountContentItems(ContentItemCheck):
+            name = "n_content_items"
+            item_fields = ("m.id",)
+
+            def initial(self):
+                return 0
+
+            def extract_item(self, ci):
+                return ci["m"]["id"]
+
+            def accumulate_item(self, acc, value):
+                return acc + 1
+
+            def merge(self, acc, other):
+                return acc + other
+
+            def finalize(self, acc):
+                return pd.DataFrame([{"n_content_items": acc}])
+
+        @register_check
+        class CountPages(PageCheck):
+            name = "n_pages"
+            fields = ("id",)
+
+            def initial(self):
+                return 0
+
+            def extract(self, page):
+                return page["id"]
+
+            def accumulate(self, acc, value):
+                return acc + 1
+
+            def merge(self, acc, other):
+                return acc + other
+
+            def finalize(self, acc):
+                return pd.DataFrame([{"n_pages": acc}])
+
+        try:
+            checks = create_checks(["duplicate_issue_ids", "n_content_items", "n_pages"])
+            page_lines = [json.dumps({"id": "GDL-1900-01-01-a-p0001"}), json.dumps({"id": "GDL-1900-01-01-a-p0002"})]
+            report = scan_pipeline(
+                checks, db.from_sequence(self.issue_lines, npartitions=2), lambda: db.from_sequence(page_lines)
+            )
+        finally:
+            del CHECKS["n_content_items"], CHECKS["n_pages"]
+
+        self.assertEqual(report.n_records, 6)
+        self.assertEqual(report.results["n_content_items"].n_content_items[0], 5)
+        self.assertEqual(report.results["n_pages"].n_pages[0], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
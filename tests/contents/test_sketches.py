@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+
+from sanity_check.contents.sketches import DuplicateSketch, HyperLogLog, hash_ids
+
+
+class TestSketches(TestCase):
+
+    def test_duplicate_sketch(self):
+        ids = [f"GDL-1900-01-01-a-i{n:04d}" for n in range(5000)] + [f"JDG-1900-01-01-a-i{n:04d}" for n in range(1000)]
+        duplicated = ["GDL-1900-01-01-a-i0010", "JDG-1900-01-01-a-i0020"]
+
+        # a duplicate seen once in each partition must be a candidate too
+        left, right = DuplicateSketch(capacity=10000), DuplicateSketch(capacity=10000)
+        left.add(ids[:3000] + duplicated[1:])
+        right.add(ids[3000:] + duplicated[:1])
+        sketch = left.merge(right)
+
+        candidates = [i for i, candidate in zip(ids, sketch.is_candidate(ids)) if candidate]
+        self.assertTrue(set(duplicated) <= set(candidates))
+        self.assertLess(len(candidates), 100)
+        self.assertEqual(sketch.estimates()["JDG"]["n_ids"], 1001)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "ci_ids.npz")
+            sketch.save(path, fingerprint="abc")
+            loaded = DuplicateSketch.load(path, fingerprint="abc")
+            # sketches of other data are not loaded
+            with self.assertRaises(ValueError):
+                DuplicateSketch.load(path, fingerprint="def")
+        self.assertEqual(loaded.estimates(), sketch.estimates())
+        self.assertEqual(list(loaded.is_candidate(ids)), list(sketch.is_candidate(ids)))
+
+    def test_hyperloglog(self):
+        hll = HyperLogLog(precision=12)
+        hll.add_hashes(hash_ids([str(n) for n in range(20000)] * 2))
+        self.assertAlmostEqual(hll.count(), 20000, delta=20000 * 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
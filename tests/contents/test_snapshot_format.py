@@ -0,0 +1,105 @@
+import gzip
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+
+from sanity_check.contents.snapshot_format import (
+    SnapshotWriter,
+    decode_ids,
+    encode_ids,
+    iter_snapshot,
+    merge_newspaper_entries,
+    read_header,
+    verify_snapshot,
+    write_newspaper_chunks,
+)
+
+IDS = {
+    "GDL": ["GDL-1900-01-01-a-i0001", "GDL-1900-01-01-a-i0002", "GDL-1900-01-02-a-i0001", "GDL-1901-01-01-a-i0001"],
+    "GDLX": ["GDLX-1900-01-01-a-i0001"],
+    "JDG": [],
+}
+
+
+class TestSnapshotFormat(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "snapshot")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_front_coding(self):
+        lines = list(encode_ids(IDS["GDL"]))
+        self.assertEqual(lines[:3], ["0\tGDL-1900-01-01-a-i0001\n", "21\t2\n", "13\t2-a-i0001\n"])
+        self.assertEqual(list(decode_ids(lines)), IDS["GDL"])
+
+    def test_write_read(self):
+        with SnapshotWriter(self.path, "test", chunk_size=3) as writer:
+            # newspapers may be written in any order
+            for newspaper in ("JDG", "GDLX", "GDL"):
+                writer.write_newspaper(newspaper, iter(IDS[newspaper]))
+
+        header = read_header(self.path)
+        self.assertEqual(header["n_ids"], 5)
+        self.assertEqual(list(header["newspapers"]), ["GDL", "GDLX", "JDG"])
+        self.assertEqual([c["n_ids"] for c in header["newspapers"]["GDL"]["chunks"]], [3, 1])
+        self.assertEqual(header["newspapers"]["GDL"]["last"], "GDL-1901-01-01-a-i0001")
+        self.assertEqual((header["first"], header["last"]), ("GDL-1900-01-01-a-i0001", "GDLX-1900-01-01-a-i0001"))
+
+        ids = list(iter_snapshot(self.path))
+        self.assertEqual(ids, IDS["GDL"] + IDS["GDLX"])
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(list(iter_snapshot(self.path, ["GDLX"])), IDS["GDLX"])
+        self.assertEqual(verify_snapshot(self.path), 5)
+
+    def test_add_newspaper(self):
+        # e.g. chunks written by dask workers, header entries gathered by the client
+        entries = [(np, write_newspaper_chunks(self.path, np, IDS[np], chunk_size=2)) for np in ("GDLX", "GDL")]
+        with SnapshotWriter(self.path, "test", chunk_size=2) as writer:
+            for newspaper, entry in entries:
+                writer.add_newspaper(newspaper, entry)
+
+        self.assertEqual(list(iter_snapshot(self.path)), IDS["GDL"] + IDS["GDLX"])
+        self.assertEqual(verify_snapshot(self.path), 5)
+
+    def test_merge_newspaper_entries(self):
+        # e.g. ranges of years written by separate tasks, and stitched in order
+        parts = [("1900", IDS["GDL"][:3]), ("1901", IDS["GDL"][3:]), ("1902", [])]
+        entries = [write_newspaper_chunks(self.path, "GDL", ids, chunk_size=2, part=part) for part, ids in parts]
+        with SnapshotWriter(self.path, "test", chunk_size=2) as writer:
+            writer.add_newspaper("GDL", merge_newspaper_entries(entries))
+
+        self.assertEqual(
+            [chunk["file"] for chunk in writer.header["newspapers"]["GDL"]["chunks"]],
+            ["GDL/1900-00000.txt.gz", "GDL/1900-00001.txt.gz", "GDL/1901-00000.txt.gz"],
+        )
+        self.assertEqual(list(iter_snapshot(self.path)), IDS["GDL"])
+        self.assertEqual(verify_snapshot(self.path), 4)
+
+        with self.assertRaises(ValueError):
+            merge_newspaper_entries(list(reversed(entries)))
+
+    def test_verify_corrupted_chunk(self):
+        with SnapshotWriter(self.path, "test") as writer:
+            writer.write_newspaper("GDL", IDS["GDL"])
+        with gzip.open(os.path.join(self.path, "GDL", "00000.txt.gz"), "wt") as outfile:
+            outfile.writelines(encode_ids(IDS["GDL"][:2]))
+
+        with self.assertRaises(ValueError):
+            verify_snapshot(self.path)
+
+    def test_unsorted_ids(self):
+        with self.assertRaises(ValueError):
+            with SnapshotWriter(self.path, "test") as writer:
+                writer.write_newspaper("GDL", list(reversed(IDS["GDL"])))
+
+        # no header is written for incomplete snapshots
+        with self.assertRaises(ValueError):
+            read_header(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
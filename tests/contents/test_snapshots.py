@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import TestCase, mock
+
+import dask
+
+from sanity_check.contents.snapshot_format import iter_snapshot, read_header, verify_snapshot
+
+try:
+    from sanity_check.contents import snapshots
+except ImportError:
+    # boto3 or impresso_commons are not installed
+    snapshots = None
+
+
+def make_issue(ci_ids):
+    return json.dumps({"id": ci_ids[0].rsplit("-", 1)[0], "i": [{"m": {"id": ci_id}} for ci_id in ci_ids]})
+
+
+@unittest.skipIf(snapshots is None, "s3 dependencies are not installed")
+class TestCanonicalSnapshot(TestCase):
+
+    issue_files = {
+        "s3://canonical/GDL/issues/GDL-1901-issues.jsonl.bz2": [
+            make_issue(["GDL-1901-01-01-a-i0002", "GDL-1901-01-01-a-i0001"])
+        ],
+        "s3://canonical/GDL/issues/GDL-1900-issues.jsonl.bz2": [
+            make_issue(["GDL-1900-01-02-a-i0001"]),
+            "",
+            make_issue(["GDL-1900-01-01-a-i0001"]),
+        ],
+        "s3://canonical/GDL/issues/GDL-1902-issues.jsonl.bz2": [make_issue(["GDL-1902-01-01-a-i0001"])],
+        "s3://canonical/JDG/issues/JDG-1900-issues.jsonl.bz2": [make_issue(["JDG-1900-01-01-a-i0001"])],
+    }
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, "snapshot")
+        for patch in [
+            mock.patch.object(snapshots, "iter_text_lines", lambda path: iter(self.issue_files[path])),
+            # two years of GDL per range
+            mock.patch.object(snapshots, "MAX_RANGE_BYTES", 200),
+            dask.config.set(scheduler="sync"),
+        ]:
+            patch.__enter__()
+            self.addCleanup(patch.__exit__, None, None, None)
+
+    def test_year_ranges(self):
+        file_sizes = [(path, 100) for path in self.issue_files if "/GDL/" in path]
+        ranges = snapshots._year_ranges(file_sizes, 200)
+        self.assertEqual([name for name, _ in ranges], ["1900-1901", "1902-1902"])
+        self.assertEqual([path.split("/")[-1][:8] for path in ranges[0][1]], ["GDL-1900", "GDL-1901"])
+
+        # a file without a year: the newspaper is a single range
+        undated = file_sizes + [("s3://canonical/GDL/issues/GDL-issues.jsonl.bz2", 10)]
+        self.assertEqual([name for name, _ in snapshots._year_ranges(undated, 200)], ["all"])
+
+    def test_take_canonical_snapshot(self):
+        header = snapshots.take_canonical_snapshot(
+            "s3://canonical", self.path, chunk_size=2, issue_file_sizes=[(path, 100) for path in self.issue_files]
+        )
+        self.assertEqual(header, read_header(self.path))
+        self.assertEqual(
+            [chunk["file"] for chunk in header["newspapers"]["GDL"]["chunks"]],
+            ["GDL/1900-1901-00000.txt.gz", "GDL/1900-1901-00001.txt.gz", "GDL/1902-1902-00000.txt.gz"],
+        )
+        self.assertEqual(header["newspapers"]["GDL"]["n_ids"], 5)
+
+        ids = list(iter_snapshot(self.path))
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), 6)
+        self.assertEqual(verify_snapshot(self.path), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
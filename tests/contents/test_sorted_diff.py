@@ -0,0 +1,23 @@
+import unittest
+from unittest import TestCase
+
+from sanity_check.contents.sorted_diff import sorted_difference, split_difference
+
+
+class TestSortedDiff(TestCase):
+
+    def test_sorted_difference(self):
+        left = ["a", "b", "b", "d", "f"]
+        right = ["b", "c", "d", "g", "h"]
+        self.assertEqual(
+            list(sorted_difference(left, right)),
+            [("a", True), ("c", False), ("f", True), ("g", False), ("h", False)],
+        )
+
+    def test_split_difference(self):
+        self.assertEqual(split_difference(iter([1, 2, 3]), iter([])), ([1, 2, 3], []))
+        self.assertEqual(split_difference([], [1, 1]), ([], [1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import tempfile
+import unittest
+from unittest import TestCase
+
+import pandas as pd
+
+from sanity_check.contents.state import CheckState, split_by_newspaper
+
+
+class TestCheckState(TestCase):
+
+    def test_state_roundtrip(self):
+        duplicates = pd.DataFrame(
+            [{"ci_id": "GDL-1900-01-01-a-i0001", "freq": 2, "newspaper_id": "GDL"}]
+        ).set_index("ci_id")
+        by_newspaper = split_by_newspaper(duplicates, ["GDL", "JDG"])
+        self.assertEqual(len(by_newspaper["GDL"]), 1)
+        self.assertEqual(len(by_newspaper["JDG"]), 0)
+
+        etags = {"GDL/issues/GDL-1900-issues.jsonl.bz2": "abc"}
+        config = {"years": None, "two_stage": False, "approximate": False}
+
+        with tempfile.TemporaryDirectory() as state_dir:
+            state = CheckState(state_dir, "s3://canonical")
+            self.assertFalse(state.is_current("GDL", etags, config))
+
+            state.save("GDL", etags, config, {"duplicate_ci_ids": by_newspaper["GDL"]})
+            self.assertTrue(state.is_current("GDL", etags, config))
+            self.assertFalse(state.is_current("GDL", {**etags, "GDL/pages/x.bz2": "def"}, config))
+            self.assertFalse(state.is_current("GDL", etags, {**config, "years": [1900]}))
+            self.assertTrue(state.results("GDL")["duplicate_ci_ids"].equals(by_newspaper["GDL"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
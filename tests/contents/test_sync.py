@@ -0,0 +1,78 @@
+import json
+import unittest
+from unittest import TestCase, mock
+
+import dask
+
+try:
+    from sanity_check.contents import sync
+except ImportError:
+    # boto3 or impresso_commons are not installed
+    sync = None
+
+
+@unittest.skipIf(sync is None, "s3 dependencies are not installed")
+class TestSync(TestCase):
+
+    canonical_files = {
+        "s3://canonical/GDL/issues/GDL-1901-issues.jsonl.bz2": ["GDL-1901-01-01-a", "GDL-1901-01-02-a"],
+        "s3://canonical/GDL/issues/GDL-1900-issues.jsonl.bz2": ["GDL-1900-01-02-a", "GDL-1900-01-01-a"],
+        # a file without a year in its name, holding IDs of several years
+        "s3://canonical/GDL/issues/GDL-extra-issues.jsonl.bz2": ["GDL-1902-01-01-a", "GDL-1900-06-01-a"],
+    }
+    rebuilt_files = {
+        "s3://rebuilt/GDL/GDL-1900.jsonl.bz2": ["GDL-1900-01-01-a-i0001", "GDL-1900-01-01-a-i0002"],
+        "s3://rebuilt/GDL/GDL-1901.jsonl.bz2": ["GDL-1901-01-02-a-i0001", "GDL-1901-05-01-a-i0001"],
+        "s3://rebuilt/GDL/GDL-1902.jsonl.bz2": ["GDL-1902-01-01-a-i0001"],
+    }
+
+    def setUp(self):
+        files = {**self.canonical_files, **self.rebuilt_files}
+        for patch in [
+            mock.patch.object(sync, "iter_text_lines", lambda path: (json.dumps({"id": i}) for i in files[path])),
+            mock.patch.object(sync, "list_issues", lambda *args: list(self.canonical_files)),
+            mock.patch.object(sync, "list_files_rebuilt", lambda *args: list(self.rebuilt_files)),
+            dask.config.set(scheduler="sync"),
+        ]:
+            patch.__enter__()
+            self.addCleanup(patch.__exit__, None, None, None)
+
+    def test_sorted_runs(self):
+        # one run per year, and one for the file without a year
+        runs = dask.compute(*sync._sorted_runs(list(self.canonical_files), sync._issue_id))
+        self.assertEqual(len(runs), 3)
+        self.assertTrue(all(run == sorted(run) for run in runs))
+        self.assertEqual(sum(len(run) for run in runs), 6)
+
+        rebuilt_runs = dask.compute(*sync._sorted_runs(list(self.rebuilt_files), sync._rebuilt_issue_id))
+        self.assertEqual(
+            sorted(i for run in rebuilt_runs for i in run),
+            ["GDL-1900-01-01-a", "GDL-1901-01-02-a", "GDL-1901-05-01-a", "GDL-1902-01-01-a"],
+        )
+
+    def test_newspaper_issue_mismatches(self):
+        canonical_runs = dask.compute(*sync._sorted_runs(list(self.canonical_files), sync._issue_id))
+        rebuilt_runs = dask.compute(*sync._sorted_runs(list(self.rebuilt_files), sync._rebuilt_issue_id))
+        to_rebuild, to_ingest = sync._newspaper_issue_mismatches(canonical_runs, rebuilt_runs)
+        self.assertEqual(to_rebuild, ["GDL-1900-01-02-a", "GDL-1900-06-01-a", "GDL-1901-01-01-a"])
+        self.assertEqual(to_ingest, ["GDL-1901-05-01-a"])
+
+        # the same, with the canonical IDs read from the index
+        canonical_ids = ["GDL-1901-01-01-a", "GDL-1900-01-02-a", "GDL-1900-01-01-a", "GDL-1902-01-01-a"]
+        to_rebuild, to_ingest = sync._newspaper_issue_mismatches([], rebuilt_runs, canonical_ids)
+        self.assertEqual(to_rebuild, ["GDL-1900-01-02-a", "GDL-1901-01-01-a"])
+        self.assertEqual(to_ingest, ["GDL-1901-01-02-a", "GDL-1901-05-01-a"])
+
+    def test_sync_rebuilt(self):
+        issues_to_ingest, issues_to_rebuild = sync.sync_rebuilt("s3://canonical", "s3://rebuilt")
+        self.assertEqual(list(issues_to_rebuild.index), ["GDL-1900-01-02-a", "GDL-1900-06-01-a", "GDL-1901-01-01-a"])
+        self.assertEqual(list(issues_to_ingest.index), ["GDL-1901-05-01-a"])
+        self.assertEqual(list(issues_to_ingest.year), [1901])
+
+    def test_path_newspaper(self):
+        self.assertEqual(sync._path_newspaper("s3://canonical/GDL/issues/GDL-1900-issues.jsonl.bz2"), "GDL")
+        self.assertEqual(sync._path_newspaper("s3://canonical/JDG/issues/issues.jsonl.bz2"), "JDG")
+
+
+if __name__ == '__main__':
+    unittest.main()